@@ -0,0 +1,314 @@
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from config import Config
+from database import EmailDatabase
+from fake_servers import FakeSMTPServer, FakeIMAPServer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SCENARIOS = ('bulk_send', 'monitor_inbox', 'rules', 'db_writes')
+
+_WORDS = ('invoice', 'meeting', 'report', 'urgent', 'update', 'project', 'review', 'quarterly',
+          'budget', 'deadline', 'server', 'release', 'customer', 'ticket', 'schedule', 'lunch')
+
+_MESSAGE = (
+    'From: {sender}\r\n'
+    'To: me@example.com\r\n'
+    'Subject: {subject}\r\n'
+    'Content-Type: text/plain; charset="utf-8"\r\n'
+    '\r\n'
+    '{body}\r\n'
+)
+
+
+def percentile(samples, percent):
+    """Nearest-rank percentile of sorted samples (seconds), in milliseconds"""
+    if not samples:
+        return None
+    index = min(len(samples), max(1, math.ceil(len(samples) * percent / 100))) - 1
+    return round(samples[index] * 1000, 3)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and its children, in MB"""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def summarize(count, elapsed, samples):
+    """Throughput and latency figures for one scenario"""
+    samples.sort()
+    return {
+        'count': count,
+        'seconds': round(elapsed, 3),
+        'msgs_per_sec': round(count / elapsed, 1) if elapsed else None,
+        'p50_ms': percentile(samples, 50),
+        'p99_ms': percentile(samples, 99),
+    }
+
+
+def time_calls(obj, name, samples):
+    """Record the duration of every call to obj.name in samples"""
+    method = getattr(obj, name)
+
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+
+    setattr(obj, name, timed)
+
+
+@contextlib.contextmanager
+def configured(**settings):
+    """Override Config settings for the duration of a scenario"""
+    saved = {key: getattr(Config, key) for key in settings}
+    for key, value in settings.items():
+        setattr(Config, key, value)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            setattr(Config, key, value)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the per-message progress output of the code under test"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def server_settings(workdir, smtp=None, imap=None):
+    """Config settings pointing at the fake servers and a scratch database"""
+    settings = {
+        'DB_PATH': os.path.join(workdir, 'benchmark.db'),
+        'EMAIL_ADDRESS': 'me@example.com',
+        'EMAIL_PASSWORD': 'secret',
+        'NOTIFICATION_EMAIL': 'alerts@example.com',
+        'SMTP_RATE_LIMIT': 0,
+    }
+    if smtp:
+        settings.update(SMTP_SERVER=smtp.host, SMTP_PORT=smtp.port, SMTP_USE_TLS=False)
+    if imap:
+        settings.update(IMAP_SERVER=imap.host, IMAP_PORT=imap.port, IMAP_USE_SSL=False)
+    return settings
+
+
+def make_rules(db, count, rng):
+    """Add count notification rules mixing sender, subject and keyword filters"""
+    for i in range(count):
+        kind = i % 3
+        db.add_notification_rule(
+            f'rule-{i}',
+            sender_filter=f'user{rng.randrange(count * 10)}@example.com' if kind == 0 else None,
+            subject_filter=f'{rng.choice(_WORDS)} {i}' if kind == 1 else None,
+            keyword_filter=f'order #{i}' if kind == 2 else None
+        )
+
+
+def make_email(i, rng):
+    """A (sender, subject, body) triple of plausible incoming mail"""
+    sender = f'User {i} <user{rng.randrange(100000)}@example.com>'
+    subject = f'{rng.choice(_WORDS).title()} {rng.choice(_WORDS)} {rng.randrange(1000)}'
+    body = ' '.join(rng.choice(_WORDS) for _ in range(60)) + f' about order #{rng.randrange(10000)}'
+    return sender, subject, body
+
+
+def bench_bulk_send(workdir, rows, latency=0.0, workers=1, processes=1, **_):
+    """Send rows personalized messages through the fake SMTP server.
+
+    Latency is per SMTP delivery, and only measured in-process
+    (processes=1).
+    """
+    csv_file = os.path.join(workdir, 'recipients.csv')
+    with open(csv_file, 'w') as f:
+        f.write('email,name\n')
+        for i in range(rows):
+            f.write(f'user{i}@example.com,User {i}\n')
+
+    samples = []
+    with FakeSMTPServer(latency=latency) as smtp, configured(**server_settings(workdir, smtp=smtp)):
+        from email_sender import EmailSender
+        sender = EmailSender()
+        time_calls(sender, '_deliver', samples)
+        try:
+            start = time.perf_counter()
+            with quiet():
+                sent, failed = sender.send_bulk_emails(
+                    csv_file, 'Your {name} update', 'Hello {name},\n\nHere is your weekly update.',
+                    workers=workers, processes=processes, resume=False
+                )
+            elapsed = time.perf_counter() - start
+        finally:
+            sender.close()
+    result = summarize(sent, elapsed, samples)
+    result['failed'] = failed
+    return result
+
+
+def bench_monitor_inbox(workdir, rows, rules=1000, latency=0.0, seed=0, **_):
+    """Process rows unseen messages from the fake IMAP server in one polling cycle.
+
+    Latency is per processed message: logging it and matching the rules.
+    """
+    rng = random.Random(seed)
+    with FakeIMAPServer(latency=latency) as imap, FakeSMTPServer() as smtp, \
+            configured(**server_settings(workdir, smtp=smtp, imap=imap)):
+        for i in range(rows):
+            sender, subject, body = make_email(i, rng)
+            imap.deliver(_MESSAGE.format(sender=sender, subject=subject, body=body).encode('utf-8'))
+
+        from email_monitor import EmailMonitor
+        monitor = EmailMonitor()
+        make_rules(monitor.db, rules, rng)
+        samples = []
+        time_calls(monitor, 'process_email', samples)
+        try:
+            start = time.perf_counter()
+            with quiet():
+                processed = monitor.monitor_inbox()
+            elapsed = time.perf_counter() - start
+        finally:
+            monitor.stop()
+            monitor.sender.close()
+            monitor.db.close()
+    return summarize(processed, elapsed, samples)
+
+
+def bench_rules(workdir, rows, rules=1000, seed=0, **_):
+    """Match rows emails against the notification rules"""
+    rng = random.Random(seed)
+    with configured(**server_settings(workdir)):
+        from email_monitor import EmailMonitor
+        monitor = EmailMonitor()
+        make_rules(monitor.db, rules, rng)
+        emails = [make_email(i, rng) for i in range(rows)]
+        # Compile outside the timed loop; it is rebuilt only when rules change
+        monitor.get_rule_matcher()
+        samples = []
+        matched = 0
+        try:
+            start = time.perf_counter()
+            for sender, subject, body in emails:
+                call_start = time.perf_counter()
+                matched += bool(monitor.check_notification_rules(sender, subject, body))
+                samples.append(time.perf_counter() - call_start)
+            elapsed = time.perf_counter() - start
+        finally:
+            monitor.sender.close()
+            monitor.db.close()
+    result = summarize(rows, elapsed, samples)
+    result['matched'] = matched
+    return result
+
+
+def bench_db_writes(workdir, rows, seed=0, **_):
+    """Log rows sent and rows monitored emails through the batched writer.
+
+    Latency is per log call; the time includes the final flush to disk.
+    """
+    rng = random.Random(seed)
+    emails = [make_email(i, rng) for i in range(rows)]
+    db = EmailDatabase(os.path.join(workdir, 'benchmark.db'))
+    samples = []
+    try:
+        start = time.perf_counter()
+        for i, (sender, subject, body) in enumerate(emails):
+            call_start = time.perf_counter()
+            db.log_sent_email(f'user{i}@example.com', subject, sync=False)
+            db.log_monitored_email(sender, subject, body[:500], sync=False)
+            samples.append((time.perf_counter() - call_start) / 2)
+        db.flush()
+        elapsed = time.perf_counter() - start
+    finally:
+        db.close()
+    return summarize(rows * 2, elapsed, samples)
+
+
+_BENCHMARKS = {
+    'bulk_send': bench_bulk_send,
+    'monitor_inbox': bench_monitor_inbox,
+    'rules': bench_rules,
+    'db_writes': bench_db_writes,
+}
+
+
+def run_scenario(name, options):
+    """Run one scenario in a scratch directory and return its figures"""
+    with tempfile.TemporaryDirectory() as workdir:
+        result = _BENCHMARKS[name](workdir, **options)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def git_commit():
+    """Commit of the working tree, so results can be compared across commits"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(scenarios, options):
+    """Run each scenario in a fresh process, so peak RSS is its own"""
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for name in scenarios:
+        with context.Pool(1) as pool:
+            results[name] = pool.apply(run_scenario, (name, options))
+    return {
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'options': options,
+        'scenarios': results,
+    }
+
+
+def main(argv=None):
+    """Run the benchmarks against in-process fake servers and print JSON"""
+    parser = argparse.ArgumentParser(description="Measure throughput, latency and memory against fake servers")
+    parser.add_argument('scenarios', nargs='*', help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--rows', type=int, default=10000, help="Messages or rows per scenario")
+    parser.add_argument('--rules', type=int, default=1000, help="Notification rules to match against")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds the fake servers wait per command")
+    parser.add_argument('--workers', type=int, default=1, help="Bulk send threads")
+    parser.add_argument('--processes', type=int, default=1, help="Bulk send processes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON here instead of stdout")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    options = {'rows': args.rows, 'rules': args.rules, 'latency': args.latency,
+               'workers': args.workers, 'processes': args.processes, 'seed': args.seed}
+    report = json.dumps(run_benchmarks(args.scenarios or SCENARIOS, options), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
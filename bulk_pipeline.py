@@ -0,0 +1,254 @@
+import queue
+import threading
+from templates import CompiledTemplate, compile_template
+from smtp_batch import chunked
+from recipients import normalize_address
+
+_DONE = object()
+
+
+class CampaignProgress:
+    """Tracks which rows of a campaign are sent and checkpoints them in batches.
+
+    Sent rows are held in a bitmap indexed by row number, so checking a row
+    on resume is O(1) and costs one bit per row of the recipient file.
+    """
+
+    def __init__(self, db, campaign_id, batch_size=100):
+        self.db = db
+        self.campaign_id = campaign_id
+        self.batch_size = max(1, batch_size)
+        self._sent = bytearray()
+        self._pending = []
+        self._lock = threading.Lock()
+        for row_index in db.get_campaign_sent_rows(campaign_id):
+            self._mark_sent(row_index)
+
+    def _mark_sent(self, row_index):
+        byte = row_index >> 3
+        if byte >= len(self._sent):
+            self._sent.extend(bytes(byte + 1 - len(self._sent)))
+        self._sent[byte] |= 1 << (row_index & 7)
+
+    def is_sent(self, row_index):
+        """Check whether a row was sent by an earlier run"""
+        byte = row_index >> 3
+        return byte < len(self._sent) and bool(self._sent[byte] & (1 << (row_index & 7)))
+
+    def record(self, row_index, status):
+        """Queue a row outcome, checkpointing once a batch has built up"""
+        with self._lock:
+            self._pending.append((row_index, status))
+            if status == 'sent':
+                self._mark_sent(row_index)
+            if len(self._pending) < self.batch_size:
+                return
+            pending, self._pending = self._pending, []
+        self.db.checkpoint_campaign_rows(self.campaign_id, pending)
+
+    def flush(self):
+        """Checkpoint any outcomes not yet written"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            self.db.checkpoint_campaign_rows(self.campaign_id, pending)
+
+
+class BulkSendPipeline:
+    """Streams bulk email through read/render, send and log stages.
+
+    A reader thread renders rows in batches onto a bounded job queue, a pool
+    of sender threads delivers them onto a bounded result queue, and the
+    calling thread logs each result. When a later stage falls behind, the
+    full queue blocks the stage before it, so memory stays flat no matter
+    how many rows the recipient file has.
+    """
+
+    def __init__(self, sender, workers=1, queue_size=1000, batch_size=50, envelope_size=1):
+        self.sender = sender
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.envelope_size = 1
+        self._max_envelope = max(1, envelope_size)
+        self.success_count = 0
+        self.failed_count = 0
+        self.skipped_count = 0
+        self.suppressed_count = 0
+        self.duplicate_count = 0
+        self._progress = None
+        self._filter = None
+        self._jobs = queue.Queue(maxsize=self.workers * 2)
+        self._results = queue.Queue(maxsize=max(1, queue_size))
+        self._stop = threading.Event()
+        self._error = None
+
+    def _put(self, q, item):
+        """Put an item, giving up if the pipeline is shutting down"""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        """Get an item, returning _DONE if the pipeline is shutting down"""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _render_stage(self, rows, subject_template, body_template):
+        """Read rows, drop skipped ones and personalize the rest a batch at a time"""
+        pending = []
+        try:
+            for row_index, row in rows:
+                if self._stop.is_set():
+                    return
+                if self._progress and self._progress.is_sent(row_index):
+                    self.skipped_count += 1
+                    if self._filter:
+                        self._filter.mark_seen(row.get('email'))
+                    continue
+                if self._filter and not self._filter.first_seen(row.get('email')):
+                    self.duplicate_count += 1
+                    continue
+                pending.append((row_index, row))
+                if len(pending) >= self.batch_size:
+                    if not self._queue_batch(pending, subject_template, body_template):
+                        return
+                    pending = []
+            if pending:
+                self._queue_batch(pending, subject_template, body_template)
+        except Exception as e:
+            self._error = e
+        finally:
+            for _ in range(self.workers):
+                self._put(self._jobs, _DONE)
+
+    def _queue_batch(self, pending, subject_template, body_template):
+        """Drop suppressed rows from a batch, render the rest and queue them"""
+        if self._filter:
+            suppressed = self._filter.suppressed([row.get('email') for _, row in pending])
+            if suppressed:
+                kept = [(row_index, row) for row_index, row in pending
+                        if normalize_address(row.get('email')) not in suppressed]
+                self.suppressed_count += len(pending) - len(kept)
+                pending = kept
+        if not pending:
+            return True
+        messages, failures = self._render_batch(pending, subject_template, body_template)
+        if messages and not self._put(self._jobs, messages):
+            return False
+        # Logged on the calling thread like any other failed delivery
+        for failure in failures:
+            if not self._put(self._results, failure):
+                return False
+        return True
+
+    def _render_batch(self, pending, subject_template, body_template):
+        """Render a batch row by row; returns (messages, failures).
+
+        A row that can't be rendered, such as a JSONL record missing a
+        field the templates use, becomes a failed result instead of
+        stopping the run.
+        """
+        messages, failures = [], []
+        for row_index, row in pending:
+            try:
+                messages.append((row_index, row['email'], subject_template.render(row), body_template.render(row)))
+            except Exception as e:
+                reason = f"missing field {e}" if isinstance(e, KeyError) else str(e)
+                failures.append((row_index, row.get('email') or '', subject_template.source,
+                                 f"Could not render row: {reason}"))
+        return messages, failures
+
+    def _send_stage(self, html, attachments):
+        """Deliver rendered messages and report each outcome.
+
+        Consecutive rows share an envelope of up to envelope_size recipients;
+        that is only above 1 when every row renders to the same message.
+        """
+        try:
+            while True:
+                batch = self._get(self._jobs)
+                if batch is _DONE:
+                    return
+                for envelope in chunked(batch, self.envelope_size):
+                    _, _, subject, body = envelope[0]
+                    recipients = [to_email for _, to_email, _, _ in envelope]
+                    try:
+                        msg = self.sender._build_message(recipients, subject, body, html=html, attachments=attachments)
+                        results = self.sender._deliver(msg)
+                    except Exception as e:
+                        results = {to_email: str(e) for to_email in recipients}
+                    for row_index, to_email, subject, _ in envelope:
+                        if not self._put(self._results, (row_index, to_email, subject, results.get(to_email))):
+                            return
+        finally:
+            self._put(self._results, _DONE)
+
+    def _log_result(self, row_index, to_email, subject, error):
+        """Record one delivery outcome in sent_emails and the campaign checkpoint"""
+        campaign_id = self._progress.campaign_id if self._progress else None
+        if error is None:
+            self.sender.db.log_sent_email(to_email, subject, status='sent', sync=False, campaign_id=campaign_id)
+            print(f"Email sent successfully to {to_email}")
+            self.success_count += 1
+        else:
+            self.sender.db.log_sent_email(to_email, subject, status='failed', error_message=error, sync=False,
+                                          campaign_id=campaign_id)
+            print(f"Failed to send email to {to_email}: {error}")
+            self.failed_count += 1
+        if self._progress:
+            self._progress.record(row_index, 'sent' if error is None else 'failed')
+
+    def run(self, rows, subject_template, body_template, html=False, progress=None, attachments=None,
+            recipient_filter=None):
+        """Send every (row_index, row) pair, logging on the calling thread.
+
+        Counts are kept on the pipeline as it goes, so they stay accurate
+        even if the run is aborted. Rows that fail to render are counted
+        and logged as failed, and the run carries on. With a
+        CampaignProgress, rows it already has as sent are skipped. With a
+        RecipientFilter, duplicate and suppressed addresses are dropped
+        before rendering. Templates may be strings or CompiledTemplates;
+        when neither has placeholders, rows are sent in multi-recipient
+        envelopes.
+        """
+        self._progress = progress
+        self._filter = recipient_filter
+        if not isinstance(subject_template, CompiledTemplate):
+            subject_template = compile_template(subject_template)
+        if not isinstance(body_template, CompiledTemplate):
+            body_template = compile_template(body_template)
+        if not subject_template.fields and not body_template.fields:
+            # Every row gets the same message, so rows can share envelopes
+            self.envelope_size = self._max_envelope
+            self.batch_size = max(self.batch_size, self.envelope_size)
+        threads = [threading.Thread(target=self._render_stage, args=(rows, subject_template, body_template), daemon=True)]
+        threads += [threading.Thread(target=self._send_stage, args=(html, attachments), daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            finished = 0
+            while finished < self.workers:
+                result = self._results.get()
+                if result is _DONE:
+                    finished += 1
+                    continue
+                self._log_result(*result)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            if progress:
+                progress.flush()
+
+        if self._error:
+            raise self._error
+        return self.success_count, self.failed_count
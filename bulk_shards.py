@@ -0,0 +1,105 @@
+import multiprocessing
+import zlib
+from config import Config
+from bulk_pipeline import BulkSendPipeline, CampaignProgress
+from recipients import iter_recipients, normalize_address
+from suppression import RecipientFilter
+
+_SETTING_TYPES = (str, int, float, bool, type(None))
+
+
+def config_overrides(processes=1):
+    """Snapshot the Config settings for worker processes.
+
+    Spawned workers re-read the environment, so settings changed in this
+    process (by tests or callers) are passed along explicitly. The SMTP
+    rate limit is split between the workers so their total stays the same.
+    """
+    overrides = {key: value for key, value in vars(Config).items()
+                 if key.isupper() and isinstance(value, _SETTING_TYPES)}
+    overrides['SMTP_RATE_LIMIT'] = Config.SMTP_RATE_LIMIT / max(1, processes)
+    return overrides
+
+
+def shard_of(row, shards):
+    """Worker a row belongs to, by its normalized address, so duplicates share one"""
+    return zlib.crc32(normalize_address(row.get('email')).encode('utf-8')) % shards
+
+
+def run_shard(shard, shards, overrides, csv_file, subject, body, html, campaign_id, start_row, workers, attachments):
+    """Send the rows of one shard; returns (sent, failed, skipped, suppressed, duplicates, error)"""
+    for key, value in overrides.items():
+        setattr(Config, key, value)
+    # Imported here: email_sender itself uses this module
+    from email_sender import EmailSender
+
+    sender = EmailSender()
+    pipeline = BulkSendPipeline(
+        sender,
+        workers=workers,
+        queue_size=Config.BULK_QUEUE_SIZE,
+        batch_size=Config.BULK_RENDER_BATCH,
+        envelope_size=Config.SMTP_MAX_RECIPIENTS
+    )
+    error = None
+    try:
+        progress = CampaignProgress(sender.db, campaign_id, batch_size=Config.CAMPAIGN_CHECKPOINT_BATCH)
+        rows = ((row_index, row) for row_index, row in iter_recipients(csv_file, start_row=start_row)
+                if shard_of(row, shards) == shard)
+        pipeline.run(rows, subject, body, html=html, progress=progress,
+                     attachments=sender._load_attachments(attachments),
+                     recipient_filter=RecipientFilter(sender.db))
+    except Exception as e:
+        error = f"shard {shard}: {e}"
+    finally:
+        sender.close()
+    return (pipeline.success_count, pipeline.failed_count, pipeline.skipped_count,
+            pipeline.suppressed_count, pipeline.duplicate_count, error)
+
+
+class ShardedBulkSend:
+    """Spreads one bulk campaign over several worker processes.
+
+    Rows are dealt out by a hash of their address, and every worker runs its
+    own BulkSendPipeline with its own SMTP pool and database writer, so
+    message rendering and encoding use more than one core. All workers
+    checkpoint the same campaign, so resuming works as for a single process.
+    """
+
+    def __init__(self, processes, workers=1):
+        self.processes = max(1, processes)
+        self.workers = max(1, workers)
+        self.success_count = 0
+        self.failed_count = 0
+        self.skipped_count = 0
+        self.suppressed_count = 0
+        self.duplicate_count = 0
+
+    def run(self, csv_file, subject, body, campaign_id, html=False, start_row=0, attachments=None):
+        """Send every row across the worker processes and total their counts.
+
+        subject and body are template source strings. If any worker fails,
+        the others still finish and a RuntimeError is raised afterwards.
+        """
+        overrides = config_overrides(self.processes)
+        jobs = [
+            (shard, self.processes, overrides, csv_file, subject, body, html,
+             campaign_id, start_row, self.workers, attachments)
+            for shard in range(self.processes)
+        ]
+        # spawn, not fork: the parent has writer and SMTP threads running
+        with multiprocessing.get_context('spawn').Pool(self.processes) as pool:
+            results = pool.starmap(run_shard, jobs)
+
+        errors = []
+        for sent, failed, skipped, suppressed, duplicates, error in results:
+            self.success_count += sent
+            self.failed_count += failed
+            self.skipped_count += skipped
+            self.suppressed_count += suppressed
+            self.duplicate_count += duplicates
+            if error:
+                errors.append(error)
+        if errors:
+            raise RuntimeError('; '.join(errors))
+        return self.success_count, self.failed_count
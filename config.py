@@ -9,10 +9,43 @@ class Config:
     # SMTP Configuration
     SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
     SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+    SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'true').lower() == 'true'
+    SMTP_TIMEOUT = int(os.getenv('SMTP_TIMEOUT', 30))
+    
+    # SMTP Connection Pool
+    SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 4))
+    SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', 100))
+    SMTP_CONNECTION_MAX_AGE = int(os.getenv('SMTP_CONNECTION_MAX_AGE', 300))
+    SMTP_HEALTH_CHECK_AFTER = int(os.getenv('SMTP_HEALTH_CHECK_AFTER', 30))
+    SMTP_MAX_RECIPIENTS = int(os.getenv('SMTP_MAX_RECIPIENTS', 100))
+    
+    # Bulk Sending
+    BULK_SEND_WORKERS = int(os.getenv('BULK_SEND_WORKERS', 1))
+    BULK_SEND_PROCESSES = int(os.getenv('BULK_SEND_PROCESSES', 1))
+    SMTP_RATE_LIMIT = float(os.getenv('SMTP_RATE_LIMIT', 0))
+    BULK_QUEUE_SIZE = int(os.getenv('BULK_QUEUE_SIZE', 1000))
+    BULK_RENDER_BATCH = int(os.getenv('BULK_RENDER_BATCH', 50))
+    CAMPAIGN_CHECKPOINT_BATCH = int(os.getenv('CAMPAIGN_CHECKPOINT_BATCH', 100))
+    ATTACHMENT_CACHE_MB = int(os.getenv('ATTACHMENT_CACHE_MB', 256))
+    
+    # Outbox (queued delivery with retries)
+    OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 2))
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+    OUTBOX_RETRY_BASE = float(os.getenv('OUTBOX_RETRY_BASE', 30))
+    OUTBOX_RETRY_MAX = float(os.getenv('OUTBOX_RETRY_MAX', 3600))
+    OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 5))
+    OUTBOX_LEASE = int(os.getenv('OUTBOX_LEASE', 300))
     
     # IMAP Configuration
     IMAP_SERVER = os.getenv('IMAP_SERVER', 'imap.gmail.com')
     IMAP_PORT = int(os.getenv('IMAP_PORT', 993))
+    IMAP_USE_SSL = os.getenv('IMAP_USE_SSL', 'true').lower() == 'true'
+    IMAP_USE_IDLE = os.getenv('IMAP_USE_IDLE', 'true').lower() == 'true'
+    IMAP_IDLE_TIMEOUT = int(os.getenv('IMAP_IDLE_TIMEOUT', 600))
+    IMAP_RECONNECT_DELAY = int(os.getenv('IMAP_RECONNECT_DELAY', 30))
+    IMAP_FETCH_BATCH_SIZE = int(os.getenv('IMAP_FETCH_BATCH_SIZE', 100))
+    IMAP_PREVIEW_BYTES = int(os.getenv('IMAP_PREVIEW_BYTES', 4096))
     
     # Email Credentials
     EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
@@ -20,10 +53,35 @@ class Config:
     
     # Notification Settings
     NOTIFICATION_EMAIL = os.getenv('NOTIFICATION_EMAIL')
+    NOTIFICATION_DIGEST_WINDOW = float(os.getenv('NOTIFICATION_DIGEST_WINDOW', 60))
+    NOTIFICATION_DIGEST_MAX = int(os.getenv('NOTIFICATION_DIGEST_MAX', 50))
     CHECK_INTERVAL = int(os.getenv('CHECK_INTERVAL', 300))
     
+    # Multi-account monitoring
+    MONITOR_TARGETS_FILE = os.getenv('MONITOR_TARGETS_FILE')
+    MONITOR_MAX_CONNECTIONS = int(os.getenv('MONITOR_MAX_CONNECTIONS', 10))
+    
     # Database
     DB_PATH = os.getenv('DB_PATH', 'emails.db')
+    DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', 500))
+    DB_FLUSH_INTERVAL = float(os.getenv('DB_FLUSH_INTERVAL', 1.0))
+    DB_BACKEND = os.getenv('DB_BACKEND', 'pooled')
+    DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', 30))
+    
+    # Retention (days to keep rows in the live database; 0 = forever)
+    RETENTION_SENT_DAYS = int(os.getenv('RETENTION_SENT_DAYS', 365))
+    RETENTION_MONITORED_DAYS = int(os.getenv('RETENTION_MONITORED_DAYS', 90))
+    RETENTION_OUTBOX_DAYS = int(os.getenv('RETENTION_OUTBOX_DAYS', 30))
+    RETENTION_CHUNK_SIZE = int(os.getenv('RETENTION_CHUNK_SIZE', 1000))
+    RETENTION_VACUUM_PAGES = int(os.getenv('RETENTION_VACUUM_PAGES', 1000))
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archives')
+    
+    # Full-text search
+    SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 20))
+    SEARCH_BACKFILL_CHUNK = int(os.getenv('SEARCH_BACKFILL_CHUNK', 5000))
+    
+    # Scheduler
+    SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', 4))
     
     @staticmethod
     def validate():
@@ -1,23 +1,274 @@
+import json
 import sqlite3
+import time
 from datetime import datetime
 from config import Config
+from db_writer import BatchedWriter
+from storage import create_backend
+from recipients import normalize_address
+
+def _search_index(table, columns):
+    """Statements creating an FTS5 index over table and the triggers keeping it in sync.
+
+    Rows that existed when the index was created are added later by
+    EmailSearch.backfill; search_index_state records that pending id range,
+    (backfilled_to, backfill_until], and the triggers leave rows in it alone
+    until the backfill reaches them.
+    """
+    names = ', '.join(columns)
+    new = ', '.join(f'NEW.{column}' for column in columns)
+    old = ', '.join(f'OLD.{column}' for column in columns)
+    indexed = (f"NOT ({{row}}.id > (SELECT backfilled_to FROM search_index_state WHERE name = '{table}') "
+               f"AND {{row}}.id <= (SELECT backfill_until FROM search_index_state WHERE name = '{table}'))")
+    return [
+        f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+            {names}, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        f'''
+        INSERT INTO search_index_state (name, backfilled_to, backfill_until)
+        SELECT '{table}', 0, COALESCE(MAX(id), 0) FROM {table}
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table}
+        WHEN {indexed.format(row='NEW')}
+        BEGIN
+            INSERT INTO {table}_fts (rowid, {names}) VALUES (NEW.id, {new});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table}
+        WHEN {indexed.format(row='OLD')}
+        BEGIN
+            INSERT INTO {table}_fts ({table}_fts, rowid, {names}) VALUES ('delete', OLD.id, {old});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF {names} ON {table}
+        WHEN {indexed.format(row='OLD')}
+        BEGIN
+            INSERT INTO {table}_fts ({table}_fts, rowid, {names}) VALUES ('delete', OLD.id, {old});
+            INSERT INTO {table}_fts (rowid, {names}) VALUES (NEW.id, {new});
+        END
+        ''',
+    ]
+
+
+# A permanent failure with a recipient-address status code (5.1.x, RFC 3463).
+# MAIL FROM and DATA rejections are copied onto every recipient of the
+# envelope, so other 5xx replies (auth, size, content policy) and the
+# sender-address codes 5.1.7/5.1.8 say nothing about the recipient.
+_HARD_BOUNCE = ("({error} GLOB '5[0-9][0-9][ -]5.1.[0-9]*' "
+                "AND NOT {error} GLOB '5[0-9][0-9][ -]5.1.[78]*')")
+
+# Schema changes applied in order on top of the tables created in
+# init_database. PRAGMA user_version records how many have run, so each
+# one runs exactly once per database file.
+MIGRATIONS = [
+    # 1: indexes for status counts, time windows and per-recipient lookups
+    [
+        'CREATE INDEX IF NOT EXISTS idx_sent_emails_status ON sent_emails (status)',
+        'CREATE INDEX IF NOT EXISTS idx_sent_emails_sent_at ON sent_emails (sent_at)',
+        'CREATE INDEX IF NOT EXISTS idx_sent_emails_recipient ON sent_emails (recipient)',
+        'CREATE INDEX IF NOT EXISTS idx_monitored_emails_received_at ON monitored_emails (received_at)',
+    ],
+    # 2: per-day counters kept up to date by triggers, so stats never scan
+    # the log tables. Rows are counted when logged; deleting log rows later
+    # (e.g. retention) leaves the totals alone.
+    [
+        'ALTER TABLE sent_emails ADD COLUMN campaign_id INTEGER',
+        '''
+        CREATE TABLE IF NOT EXISTS email_stats_daily (
+            day TEXT NOT NULL,
+            category TEXT NOT NULL,
+            campaign_id INTEGER NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, category, campaign_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT INTO email_stats_daily (day, category, campaign_id, count)
+        SELECT date(sent_at), COALESCE(status, 'unknown'), 0, COUNT(*)
+        FROM sent_emails GROUP BY 1, 2
+        ''',
+        '''
+        INSERT INTO email_stats_daily (day, category, campaign_id, count)
+        SELECT date(received_at), 'monitored', 0, COUNT(*)
+        FROM monitored_emails GROUP BY 1
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS sent_emails_stats_insert AFTER INSERT ON sent_emails
+        BEGIN
+            INSERT INTO email_stats_daily (day, category, campaign_id, count)
+            VALUES (date(NEW.sent_at), COALESCE(NEW.status, 'unknown'), COALESCE(NEW.campaign_id, 0), 1)
+            ON CONFLICT (day, category, campaign_id) DO UPDATE SET count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS sent_emails_stats_update AFTER UPDATE OF status ON sent_emails
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE email_stats_daily SET count = count - 1
+            WHERE day = date(OLD.sent_at) AND category = COALESCE(OLD.status, 'unknown')
+              AND campaign_id = COALESCE(OLD.campaign_id, 0);
+            INSERT INTO email_stats_daily (day, category, campaign_id, count)
+            VALUES (date(NEW.sent_at), COALESCE(NEW.status, 'unknown'), COALESCE(NEW.campaign_id, 0), 1)
+            ON CONFLICT (day, category, campaign_id) DO UPDATE SET count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS monitored_emails_stats_insert AFTER INSERT ON monitored_emails
+        BEGIN
+            INSERT INTO email_stats_daily (day, category, campaign_id, count)
+            VALUES (date(NEW.received_at), 'monitored', 0, 1)
+            ON CONFLICT (day, category, campaign_id) DO UPDATE SET count = count + 1;
+        END
+        ''',
+    ],
+    # 3: scheduled job definitions and run times, so restarts catch up
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            name TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            trigger TEXT NOT NULL,
+            params TEXT NOT NULL,
+            max_instances INTEGER NOT NULL DEFAULT 1,
+            catch_up INTEGER NOT NULL DEFAULT 1,
+            next_run_at REAL,
+            last_run_at REAL,
+            last_error TEXT
+        )
+        ''',
+    ],
+    # 4: full-text search over monitored mail and sent subjects
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS search_index_state (
+            name TEXT PRIMARY KEY,
+            backfilled_to INTEGER NOT NULL,
+            backfill_until INTEGER NOT NULL
+        )
+        ''',
+        *_search_index('monitored_emails', ('sender', 'subject', 'body_preview')),
+        *_search_index('sent_emails', ('recipient', 'subject')),
+    ],
+    # 5: addresses bulk sends skip. Recipients the server rejects permanently
+    # are added automatically; unsubscribes and manual entries via add_suppression
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS suppressions (
+            address TEXT PRIMARY KEY,
+            reason TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+        f'''
+        INSERT OR IGNORE INTO suppressions (address, reason)
+        SELECT lower(trim(recipient)), 'bounce' FROM sent_emails
+        WHERE status = 'failed' AND {_HARD_BOUNCE.format(error='error_message')}
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS sent_emails_bounce AFTER INSERT ON sent_emails
+        WHEN NEW.status = 'failed' AND {_HARD_BOUNCE.format(error='NEW.error_message')}
+        BEGIN
+            INSERT OR IGNORE INTO suppressions (address, reason) VALUES (lower(trim(NEW.recipient)), 'bounce');
+        END
+        ''',
+    ],
+    # 6: rule matches waiting for their digest, so a restart doesn't lose them
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS digest_entries (
+            rule_name TEXT NOT NULL,
+            email_id INTEGER NOT NULL,
+            mailbox TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (rule_name, email_id)
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 7: a version bumped on every rule change, so cached rules are dropped
+    # whichever process (or tool) made the change
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS rules_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        ''',
+        'INSERT OR IGNORE INTO rules_state (id, version) VALUES (1, 0)',
+        *(f'''
+        CREATE TRIGGER IF NOT EXISTS notification_rules_{event.lower()} AFTER {event} ON notification_rules
+        BEGIN
+            UPDATE rules_state SET version = version + 1 WHERE id = 1;
+        END
+        ''' for event in ('INSERT', 'UPDATE', 'DELETE')),
+    ],
+    # 8: the monitored emails each queued alert covers. They are marked
+    # notified when the alert is delivered; the links go once it is sent or dead
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS outbox_notifications (
+            outbox_id INTEGER NOT NULL,
+            email_id INTEGER NOT NULL,
+            PRIMARY KEY (outbox_id, email_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS outbox_notifications_done AFTER UPDATE OF status ON outbox
+        WHEN NEW.status IN ('sent', 'dead')
+        BEGIN
+            UPDATE monitored_emails SET notification_sent = 1
+            WHERE NEW.status = 'sent'
+              AND id IN (SELECT email_id FROM outbox_notifications WHERE outbox_id = NEW.id);
+            DELETE FROM outbox_notifications WHERE outbox_id = NEW.id;
+        END
+        ''',
+    ],
+]
+
 
 class EmailDatabase:
     """Manages SQLite database for email logs and tracking"""
     
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, backend=None):
         self.db_path = db_path or Config.DB_PATH
+        self.backend = backend or create_backend(self.db_path)
+        self._rules_cache = None
         self.init_database()
+        self.writer = BatchedWriter(
+            self.backend.connect,
+            batch_size=Config.DB_WRITE_BATCH_SIZE,
+            flush_interval=Config.DB_FLUSH_INTERVAL
+        )
     
     def get_connection(self):
-        """Create and return database connection"""
-        return sqlite3.connect(self.db_path)
+        """Open a dedicated database connection; the caller must close it"""
+        return self.backend.connect()
+    
+    def connection(self):
+        """Borrow a connection from the storage backend for a with block"""
+        return self.backend.connection()
+    
+    def flush(self):
+        """Commit any batched writes now"""
+        self.writer.flush()
+    
+    def close(self):
+        """Flush batched writes and close the writer and pooled connections"""
+        self.writer.close()
+        self.backend.close()
     
     def init_database(self):
         """Initialize database tables"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # WAL lets readers run alongside the long-lived writer connection
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Sent emails table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS sent_emails (
@@ -55,101 +306,489 @@ class EmailDatabase:
             )
         ''')
         
-        conn.commit()
-        conn.close()
-    
-    def log_sent_email(self, recipient, subject, status='sent', error_message=None):
-        """Log a sent email"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        # Bulk campaigns and their per-row checkpoints
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS campaigns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                source_hash TEXT NOT NULL,
+                template_hash TEXT NOT NULL,
+                status TEXT DEFAULT 'running',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                completed_at TIMESTAMP
+            )
+        ''')
         
         cursor.execute('''
-            INSERT INTO sent_emails (recipient, subject, status, error_message)
-            VALUES (?, ?, ?, ?)
-        ''', (recipient, subject, status, error_message))
+            CREATE TABLE IF NOT EXISTS campaign_rows (
+                campaign_id INTEGER NOT NULL,
+                row_index INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (campaign_id, row_index)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Per-folder IMAP sync position
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS mailbox_state (
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                last_uid INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (account, folder)
+            )
+        ''')
+        
+        # Durable outbound queue drained by the delivery workers in outbox.py
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                html BOOLEAN DEFAULT 0,
+                attachments TEXT,
+                status TEXT DEFAULT 'queued',
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                lease_until REAL,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)
+        ''')
         
         conn.commit()
-        email_id = cursor.lastrowid
+        self.migrate(conn)
         conn.close()
-        return email_id
     
-    def log_monitored_email(self, sender, subject, body_preview=None):
-        """Log a monitored email"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def migrate(self, conn):
+        """Apply pending MIGRATIONS, each in its own transaction"""
+        while True:
+            # IMMEDIATE takes the write lock up front, so two processes
+            # starting together can't both apply the same migration
+            conn.execute('BEGIN IMMEDIATE')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.rollback()
+                return
+            try:
+                for statement in MIGRATIONS[version]:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {version + 1}')
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+    
+    def log_sent_email(self, recipient, subject, status='sent', error_message=None, sync=True, campaign_id=None):
+        """Log a sent email; with sync=False the insert is batched and no id is returned"""
+        sql = '''
+            INSERT INTO sent_emails (recipient, subject, status, error_message, campaign_id)
+            VALUES (?, ?, ?, ?, ?)
+        '''
+        params = (recipient, subject, status, error_message, campaign_id)
         
-        cursor.execute('''
+        if not sync:
+            self.writer.submit(sql, params)
+            return None
+        return self.writer.execute(sql, params)
+    
+    def log_monitored_email(self, sender, subject, body_preview=None, sync=True):
+        """Log a monitored email; with sync=False the insert is batched and no id is returned"""
+        sql = '''
             INSERT INTO monitored_emails (sender, subject, body_preview)
             VALUES (?, ?, ?)
-        ''', (sender, subject, body_preview))
+        '''
+        params = (sender, subject, body_preview)
         
-        conn.commit()
-        email_id = cursor.lastrowid
-        conn.close()
-        return email_id
+        if not sync:
+            self.writer.submit(sql, params)
+            return None
+        return self.writer.execute(sql, params)
     
     def mark_notification_sent(self, email_id):
         """Mark that notification was sent for an email"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        self.writer.submit('''
             UPDATE monitored_emails
             SET notification_sent = 1
             WHERE id = ?
         ''', (email_id,))
-        
-        conn.commit()
-        conn.close()
     
+    def add_digest_entry(self, rule_name, email_id, mailbox=None):
+        """Persist a rule match until its digest has been queued"""
+        self.writer.submit('''
+            INSERT OR IGNORE INTO digest_entries (rule_name, email_id, mailbox) VALUES (?, ?, ?)
+        ''', (rule_name, email_id, mailbox))
+    
+    def remove_digest_entries(self, rule_name, email_ids, chunk_size=500):
+        """Drop persisted matches of a rule once its digest is queued"""
+        email_ids = list(email_ids)
+        for start in range(0, len(email_ids), chunk_size):
+            chunk = email_ids[start:start + chunk_size]
+            self.writer.submit(f'''
+                DELETE FROM digest_entries
+                WHERE rule_name = ? AND email_id IN ({', '.join('?' * len(chunk))})
+            ''', (rule_name, *chunk))
+    
+    def get_digest_entries(self):
+        """Get persisted matches as (rule_name, email_id, sender, subject, body_preview, mailbox), oldest first"""
+        self.writer.flush()
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT d.rule_name, d.email_id, m.sender, m.subject, COALESCE(m.body_preview, ''), d.mailbox
+                FROM digest_entries AS d
+                JOIN monitored_emails AS m ON m.id = d.email_id
+                ORDER BY d.created_at, d.email_id
+            ''').fetchall()
+    
+    @property
+    def rules_version(self):
+        """Counter that changes whenever notification rules are modified.
+        
+        Kept in the database by triggers (migration 7), so changes made by
+        other processes are seen too; reading it is one primary-key lookup.
+        """
+        with self.connection() as conn:
+            return conn.execute('SELECT version FROM rules_state WHERE id = 1').fetchone()[0]
+
     def add_notification_rule(self, rule_name, sender_filter=None, subject_filter=None, keyword_filter=None):
         """Add a notification rule"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        rule_id = self.writer.execute('''
             INSERT INTO notification_rules (rule_name, sender_filter, subject_filter, keyword_filter)
             VALUES (?, ?, ?, ?)
         ''', (rule_name, sender_filter, subject_filter, keyword_filter))
-        
-        conn.commit()
-        rule_id = cursor.lastrowid
-        conn.close()
         return rule_id
     
+    def set_rule_enabled(self, rule_id, enabled=True):
+        """Enable or disable a notification rule"""
+        self.writer.execute('''
+            UPDATE notification_rules
+            SET enabled = ?
+            WHERE id = ?
+        ''', (1 if enabled else 0, rule_id))
+    
     def get_active_rules(self):
-        """Get all active notification rules"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """Get all active notification rules, cached until the rules change"""
+        version = self.rules_version
+        if self._rules_cache and self._rules_cache[0] == version:
+            return list(self._rules_cache[1])
         
-        cursor.execute('''
-            SELECT id, rule_name, sender_filter, subject_filter, keyword_filter
-            FROM notification_rules
-            WHERE enabled = 1
-        ''')
+        self.writer.flush()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        rules = cursor.fetchall()
-        conn.close()
-        return rules
+            cursor.execute('''
+                SELECT id, rule_name, sender_filter, subject_filter, keyword_filter
+                FROM notification_rules
+                WHERE enabled = 1
+            ''')
+        
+            rules = cursor.fetchall()
+        self._rules_cache = (version, rules)
+        return list(rules)
+    
+    def create_campaign(self, name, source_hash, template_hash):
+        """Start a new bulk campaign"""
+        return self.writer.execute('''
+            INSERT INTO campaigns (name, source_hash, template_hash)
+            VALUES (?, ?, ?)
+        ''', (name, source_hash, template_hash))
+    
+    def find_incomplete_campaign(self, source_hash, template_hash):
+        """Get the latest unfinished campaign for the same recipient file and templates"""
+        self.writer.flush()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('''
+                SELECT id FROM campaigns
+                WHERE source_hash = ? AND template_hash = ? AND status = 'running'
+                ORDER BY id DESC
+                LIMIT 1
+            ''', (source_hash, template_hash))
+        
+            row = cursor.fetchone()
+        return row[0] if row else None
+    
+    def get_campaign_sent_rows(self, campaign_id):
+        """Yield the row indexes already sent in a campaign"""
+        self.writer.flush()
+        with self.connection() as conn:
+            cursor = conn.execute('''
+                SELECT row_index FROM campaign_rows
+                WHERE campaign_id = ? AND status = 'sent'
+            ''', (campaign_id,))
+            for (row_index,) in cursor:
+                yield row_index
+    
+    def checkpoint_campaign_rows(self, campaign_id, rows):
+        """Record a batch of (row_index, status) outcomes in one transaction"""
+        self.writer.executemany('''
+            INSERT OR REPLACE INTO campaign_rows (campaign_id, row_index, status)
+            VALUES (?, ?, ?)
+        ''', [(campaign_id, row_index, status) for row_index, status in rows])
+    
+    def complete_campaign(self, campaign_id):
+        """Mark a campaign as finished so it is no longer resumed"""
+        self.writer.execute('''
+            UPDATE campaigns
+            SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (campaign_id,))
+    
+    def get_mailbox_state(self, account, folder):
+        """Get the (uidvalidity, last_uid) high-water mark for a folder, or None"""
+        self.writer.flush()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('''
+                SELECT uidvalidity, last_uid FROM mailbox_state
+                WHERE account = ? AND folder = ?
+            ''', (account, folder))
+        
+            row = cursor.fetchone()
+        return row
+    
+    def save_mailbox_state(self, account, folder, uidvalidity, last_uid):
+        """Record the highest UID processed in a folder"""
+        self.writer.submit('''
+            INSERT OR REPLACE INTO mailbox_state (account, folder, uidvalidity, last_uid, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (account, folder, uidvalidity, last_uid))
+    
+    def enqueue_outbox(self, recipient, subject, body, html=False, attachments=None):
+        """Queue a message for the delivery workers; committed before returning"""
+        return self.writer.execute('''
+            INSERT INTO outbox (recipient, subject, body, html, attachments, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (recipient, subject, body, 1 if html else 0,
+              json.dumps(list(attachments)) if attachments else None, time.time()))
+    
+    def enqueue_notification(self, recipients, subject, body, email_ids, chunk_size=500):
+        """Queue an alert to each recipient, linked to the monitored emails it covers.
+        
+        A trigger marks the emails notified once a copy of the alert is
+        delivered rather than when it is queued, so a dead-lettered alert
+        leaves them unnotified. Committed in one transaction before returning.
+        """
+        email_ids = list(email_ids)
+        statements = []
+        for recipient in recipients:
+            statements.append(('''
+                INSERT INTO outbox (recipient, subject, body, next_attempt_at) VALUES (?, ?, ?, ?)
+            ''', (recipient, subject, body, time.time())))
+            # Still inside the writer's transaction, so the newest outbox row is this one
+            for start in range(0, len(email_ids), chunk_size):
+                chunk = email_ids[start:start + chunk_size]
+                statements.append((f'''
+                    INSERT OR IGNORE INTO outbox_notifications (outbox_id, email_id)
+                    SELECT (SELECT MAX(id) FROM outbox), id FROM monitored_emails
+                    WHERE id IN ({', '.join('?' * len(chunk))})
+                ''', tuple(chunk)))
+        self.writer.execute_all(statements)
+    
+    def claim_outbox(self, limit, lease):
+        """Atomically claim up to limit due messages for lease seconds.
+        
+        Messages whose earlier claim's lease ran out (e.g. the worker died)
+        are claimed again. Returns (id, recipient, subject, body, html,
+        attachments, attempts) tuples, oldest first.
+        """
+        now = time.time()
+        rows = self.writer.execute_returning('''
+            UPDATE outbox
+            SET status = 'sending', attempts = attempts + 1, lease_until = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM outbox
+                WHERE (status = 'queued' AND next_attempt_at <= ?)
+                   OR (status = 'sending' AND lease_until < ?)
+                ORDER BY next_attempt_at, id
+                LIMIT ?
+            )
+            RETURNING id, recipient, subject, body, html, attachments, attempts
+        ''', (now + lease, now, now, limit))
+        return sorted((row[:4] + (bool(row[4]), json.loads(row[5]) if row[5] else None, row[6]) for row in rows))
+    
+    def complete_outbox(self, outbox_id):
+        """Mark a claimed message as delivered"""
+        self.writer.execute('''
+            UPDATE outbox
+            SET status = 'sent', lease_until = NULL, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (outbox_id,))
+    
+    def retry_outbox(self, outbox_id, error, next_attempt_at):
+        """Put a claimed message back in the queue after a transient failure"""
+        self.writer.execute('''
+            UPDATE outbox
+            SET status = 'queued', lease_until = NULL, last_error = ?, next_attempt_at = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (error, next_attempt_at, outbox_id))
+    
+    def dead_letter_outbox(self, outbox_id, error):
+        """Give up on a claimed message after a permanent failure"""
+        self.writer.execute('''
+            UPDATE outbox
+            SET status = 'dead', lease_until = NULL, last_error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (error, outbox_id))
+    
+    def save_scheduled_job(self, name, kind, trigger, params, max_instances, catch_up, next_run_at):
+        """Create or replace a scheduled job definition, keeping its run history"""
+        self.writer.execute('''
+            INSERT INTO scheduled_jobs (name, kind, trigger, params, max_instances, catch_up, next_run_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                kind = excluded.kind, trigger = excluded.trigger, params = excluded.params,
+                max_instances = excluded.max_instances, catch_up = excluded.catch_up,
+                next_run_at = excluded.next_run_at
+        ''', (name, kind, json.dumps(trigger), json.dumps(params), max_instances, 1 if catch_up else 0, next_run_at))
+    
+    def get_scheduled_jobs(self):
+        """Get every scheduled job as a dict with its trigger and params decoded"""
+        self.writer.flush()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('''
+                SELECT name, kind, trigger, params, max_instances, catch_up, next_run_at, last_run_at, last_error
+                FROM scheduled_jobs
+                ORDER BY name
+            ''')
+        
+            jobs = [
+                {'name': name, 'kind': kind, 'trigger': json.loads(trigger), 'params': json.loads(params),
+                 'max_instances': max_instances, 'catch_up': bool(catch_up), 'next_run_at': next_run_at,
+                 'last_run_at': last_run_at, 'last_error': last_error}
+                for name, kind, trigger, params, max_instances, catch_up, next_run_at, last_run_at, last_error
+                in cursor.fetchall()
+            ]
+        return jobs
+    
+    def record_job_run(self, name, started_at, next_run_at, error=None):
+        """Record a finished run of a scheduled job and when it is next due"""
+        self.writer.execute('''
+            UPDATE scheduled_jobs
+            SET last_run_at = ?, next_run_at = ?, last_error = ?
+            WHERE name = ?
+        ''', (started_at, next_run_at, error, name))
+    
+    def delete_scheduled_job(self, name):
+        """Remove a scheduled job definition"""
+        self.writer.execute('DELETE FROM scheduled_jobs WHERE name = ?', (name,))
+    
+    def add_suppression(self, address, reason='unsubscribe'):
+        """Stop bulk sends to an address; keeps the first reason given"""
+        self.writer.execute('''
+            INSERT OR IGNORE INTO suppressions (address, reason) VALUES (?, ?)
+        ''', (normalize_address(address), reason))
+    
+    def remove_suppression(self, address):
+        """Allow bulk sends to an address again"""
+        self.writer.execute('DELETE FROM suppressions WHERE address = ?', (normalize_address(address),))
+    
+    def get_suppression(self, address):
+        """Get the reason an address is suppressed, or None"""
+        self.writer.flush()
+        with self.connection() as conn:
+            row = conn.execute(
+                'SELECT reason FROM suppressions WHERE address = ?', (normalize_address(address),)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def count_suppressions(self):
+        """Get the number of suppressed addresses"""
+        self.writer.flush()
+        with self.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM suppressions').fetchone()[0]
+    
+    def get_suppressions(self, addresses, chunk=500):
+        """Get {address: reason} for those of the given addresses that are suppressed.
+        
+        Called once per render batch of a bulk send, so queued log writes are
+        not flushed first: suppressions themselves are written synchronously.
+        """
+        addresses = list({normalize_address(address) for address in addresses})
+        found = {}
+        with self.connection() as conn:
+            for start in range(0, len(addresses), chunk):
+                batch = addresses[start:start + chunk]
+                found.update(conn.execute(f'''
+                    SELECT address, reason FROM suppressions
+                    WHERE address IN ({', '.join('?' * len(batch))})
+                ''', batch).fetchall())
+        return found
+    
+    def get_outbox_counts(self):
+        """Get the number of outbox messages in each status"""
+        self.writer.flush()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status')
+            counts = dict(cursor.fetchall())
+        
+        return counts
     
     def get_email_stats(self):
         """Get statistics about sent and monitored emails"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        self.writer.flush()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('SELECT COUNT(*) FROM sent_emails WHERE status = "sent"')
-        sent_count = cursor.fetchone()[0]
+            # Summed from the daily rollup: one row per day and category
+            cursor.execute('''
+                SELECT category, SUM(count) FROM email_stats_daily
+                GROUP BY category
+            ''')
+            totals = dict(cursor.fetchall())
         
-        cursor.execute('SELECT COUNT(*) FROM sent_emails WHERE status = "failed"')
-        failed_count = cursor.fetchone()[0]
+        return {
+            'sent': totals.get('sent', 0),
+            'failed': totals.get('failed', 0),
+            'monitored': totals.get('monitored', 0)
+        }
+    
+    def get_daily_stats(self, since=None, until=None):
+        """Get {day: {category: count}} from the rollup for days in [since, until].
         
-        cursor.execute('SELECT COUNT(*) FROM monitored_emails')
-        monitored_count = cursor.fetchone()[0]
+        Days are 'YYYY-MM-DD' strings (UTC); either bound may be left open.
+        """
+        self.writer.flush()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        conn.close()
+            cursor.execute('''
+                SELECT day, category, SUM(count) FROM email_stats_daily
+                WHERE day >= COALESCE(?, day) AND day <= COALESCE(?, day)
+                GROUP BY day, category
+                ORDER BY day
+            ''', (since, until))
         
-        return {
-            'sent': sent_count,
-            'failed': failed_count,
-            'monitored': monitored_count
-        }
\ No newline at end of file
+            daily = {}
+            for day, category, count in cursor.fetchall():
+                daily.setdefault(day, {})[category] = count
+        return daily
+    
+    def get_campaign_stats(self, campaign_id):
+        """Get {status: count} of the emails logged for one bulk campaign"""
+        self.writer.flush()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('''
+                SELECT category, SUM(count) FROM email_stats_daily
+                WHERE campaign_id = ?
+                GROUP BY category
+            ''', (campaign_id,))
+        
+            stats = dict(cursor.fetchall())
+        return stats
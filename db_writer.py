@@ -0,0 +1,136 @@
+import atexit
+import sqlite3
+import threading
+import weakref
+
+_open_writers = weakref.WeakSet()
+
+
+class BatchedWriter:
+    """Owns one long-lived database connection and groups writes into transactions.
+
+    Queued writes are committed together once batch_size of them build up,
+    every flush_interval seconds, and on close. Synchronous writes first
+    commit anything queued before them, so they keep their order relative
+    to queued writes and can return lastrowid. The queued batch gets its own
+    transaction, so a failing synchronous write can't roll it back.
+    """
+
+    def __init__(self, connect, batch_size=500, flush_interval=1.0):
+        self.connect = connect
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._pending = []
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def _connection(self):
+        """Open the connection and start the flusher on first use"""
+        if self._conn is None:
+            self._conn = self.connect()
+            self._closed.clear()
+            self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._thread.start()
+            _open_writers.add(self)
+        return self._conn
+
+    def _flush_loop(self):
+        """Flush on the time threshold, or sooner when a batch fills up"""
+        while not self._closed.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Failed to flush database writes: {e}")
+
+    def _write_pending(self, conn):
+        """Execute queued writes on an open transaction"""
+        for sql, params in self._pending:
+            conn.execute(sql, params)
+        self._pending = []
+
+    def submit(self, sql, params=()):
+        """Queue a write to be committed with the next batch"""
+        with self._lock:
+            self._connection()
+            self._pending.append((sql, params))
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def execute(self, sql, params=()):
+        """Commit queued writes, then this one, and return its lastrowid"""
+        with self._lock:
+            self.flush()
+            conn = self._connection()
+            with conn:
+                cursor = conn.execute(sql, params)
+            return cursor.lastrowid
+
+    def execute_returning(self, sql, params=()):
+        """Commit queued writes, then a statement with a RETURNING clause; return its rows"""
+        with self._lock:
+            self.flush()
+            conn = self._connection()
+            with conn:
+                return conn.execute(sql, params).fetchall()
+
+    def executemany(self, sql, seq_of_params):
+        """Commit queued writes, then a batch of rows in one transaction"""
+        with self._lock:
+            self.flush()
+            conn = self._connection()
+            with conn:
+                conn.executemany(sql, seq_of_params)
+
+    def execute_all(self, statements):
+        """Commit queued writes, then several (sql, params) statements atomically; return their rowcounts"""
+        with self._lock:
+            self.flush()
+            conn = self._connection()
+            with conn:
+                return [conn.execute(sql, params).rowcount for sql, params in statements]
+
+    def flush(self):
+        """Commit every queued write in one transaction"""
+        with self._lock:
+            if not self._pending:
+                return
+            conn = self._connection()
+            pending = list(self._pending)
+            try:
+                with conn:
+                    self._write_pending(conn)
+            except sqlite3.Error:
+                # One bad statement shouldn't take the whole batch down with it
+                self._pending = []
+                for sql, params in pending:
+                    try:
+                        with conn:
+                            conn.execute(sql, params)
+                    except sqlite3.Error as e:
+                        print(f"Failed to write database log entry: {e}")
+
+    def close(self):
+        """Flush queued writes and close the connection; later writes reopen it"""
+        self._closed.set()
+        self._wakeup.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        with self._lock:
+            self.flush()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            _open_writers.discard(self)
+
+
+@atexit.register
+def _flush_open_writers():
+    """Don't lose queued log entries when the process exits"""
+    for writer in list(_open_writers):
+        writer.close()
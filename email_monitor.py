@@ -1,10 +1,27 @@
+import codecs
 import imaplib
+import itertools
 import email
 from email.header import decode_header
+from email.parser import BytesHeaderParser
+import select
+import ssl
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
 from database import EmailDatabase
 from email_sender import EmailSender
+from outbox import OutboxWorkers
+from notification_digest import NotificationDigest
+from rule_matcher import RuleMatcher
+from monitor_targets import MonitorTarget, load_monitor_targets
+from imap_fetch import HEADER_FIELDS, HEADER_FIELDS_PREFIX, PARSE_ERRORS, parse_fetch_response, find_text_part
+from email_preview import PREVIEW_CHARS, extract_preview, preview_text
+
+# Seconds a compiled rule matcher is trusted between rules-version checks
+# outside monitor_inbox, which checks once per fetch batch
+RULES_RECHECK_SECONDS = 5.0
 
 class EmailMonitor:
     """Monitors incoming emails and triggers notifications"""
@@ -13,13 +30,23 @@ class EmailMonitor:
         self.config = Config
         self.db = EmailDatabase()
         self.sender = EmailSender()
-        self.processed_emails = set()
+        self.outbox = OutboxWorkers(self.sender)
+        self.digest = NotificationDigest(self.sender, self.db)
+        self._matcher = None
+        self._matcher_version = None
+        self._matcher_checked = 0.0
+        self._stop = threading.Event()
+        self._idle_tags = itertools.count(1)
     
-    def connect(self):
-        """Establish IMAP connection"""
+    def connect(self, target=None):
+        """Establish IMAP connection to a target account (default: the .env account)"""
+        target = target or MonitorTarget()
         try:
-            mail = imaplib.IMAP4_SSL(self.config.IMAP_SERVER, self.config.IMAP_PORT)
-            mail.login(self.config.EMAIL_ADDRESS, self.config.EMAIL_PASSWORD)
+            if target.use_ssl:
+                mail = imaplib.IMAP4_SSL(target.server, target.port)
+            else:
+                mail = imaplib.IMAP4(target.server, target.port)
+            mail.login(target.account, target.password)
             return mail
         except Exception as e:
             print(f"Failed to connect to IMAP server: {e}")
@@ -39,124 +66,381 @@ class EmailMonitor:
         return ""
     
     def get_email_body(self, msg):
-        """Extract email body"""
-        body = ""
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                if content_type == "text/plain":
-                    try:
-                        body = part.get_payload(decode=True).decode()
-                        break
-                    except:
-                        pass
+        """Extract a body preview from raw message bytes or a parsed Message.
+        
+        Plain text is preferred, HTML-only mail is stripped to text, and only
+        the first IMAP_PREVIEW_BYTES of the part are decoded, in its charset.
+        """
+        if isinstance(msg, (bytes, bytearray)):
+            return extract_preview(bytes(msg))
+        fallback = None
+        for part in msg.walk():
+            if part.is_multipart() or part.get_content_disposition() == 'attachment':
+                continue
+            if part.get_content_type() == 'text/plain':
+                break
+            if part.get_content_type() == 'text/html' and fallback is None:
+                fallback = part
         else:
-            try:
-                body = msg.get_payload(decode=True).decode()
-            except:
-                pass
-        return body[:500]  # Return preview
+            part = fallback
+        if part is None:
+            return ""
+        payload = part.get_payload()
+        if not isinstance(payload, str):
+            return ""
+        # get_payload() has already decoded 8bit bytes with the declared
+        # charset (ASCII if none or unknown); encoding back the same way
+        # recovers them for preview_text to decode once
+        charset = part.get_content_charset()
+        try:
+            codecs.lookup(charset or 'ascii')
+        except LookupError:
+            charset = None
+        data = payload[:self.config.IMAP_PREVIEW_BYTES].encode(charset or 'ascii', errors='replace')
+        return preview_text(data, part.get_content_subtype(), part.get('content-transfer-encoding', '7bit'),
+                            charset)
+    
+    def get_rule_matcher(self, refresh=False):
+        """Return the compiled rule matcher, rebuilding it when rules have changed.
+
+        The rules version is read when refresh is set or the last check is
+        RULES_RECHECK_SECONDS old, not for every email matched.
+        """
+        now = time.monotonic()
+        if self._matcher is None or refresh or now - self._matcher_checked >= RULES_RECHECK_SECONDS:
+            version = self.db.rules_version
+            if self._matcher is None or self._matcher_version != version:
+                self._matcher = RuleMatcher(self.db.get_active_rules())
+                self._matcher_version = version
+            self._matcher_checked = now
+        return self._matcher
     
     def check_notification_rules(self, sender, subject, body):
         """Check if email matches any notification rules"""
-        rules = self.db.get_active_rules()
-        matched_rules = []
-        
-        for rule in rules:
-            rule_id, rule_name, sender_filter, subject_filter, keyword_filter = rule
-            
-            match = True
-            
-            # Check sender filter
-            if sender_filter and sender_filter.lower() not in sender.lower():
-                match = False
-            
-            # Check subject filter
-            if subject_filter and subject_filter.lower() not in subject.lower():
-                match = False
-            
-            # Check keyword filter
-            if keyword_filter and keyword_filter.lower() not in body.lower():
-                match = False
-            
-            if match:
-                matched_rules.append(rule_name)
-        
-        return matched_rules
+        return self.get_rule_matcher().match(sender, subject, body)
     
-    def monitor_inbox(self, folder='INBOX', mark_as_read=False):
-        """Monitor inbox for new emails"""
+    def monitor_inbox(self, folder='INBOX', mark_as_read=False, mail=None, target=None):
+        """Monitor inbox for new emails.
+        
+        Only messages with a UID above the folder's persisted high-water mark
+        are fetched, so each cycle costs in proportion to new mail. Pass an
+        open session as mail to reuse it; it is left open, and connection
+        errors are raised so the caller can reconnect.
+        """
+        own_session = mail is None
+        target = target or MonitorTarget()
+        account = target.account
         try:
-            mail = self.connect()
+            if own_session:
+                mail = self.connect(target)
             mail.select(folder)
+            uidvalidity = int(mail.response('UIDVALIDITY')[1][0])
+            uidnext = mail.response('UIDNEXT')[1][0]
             
-            # Search for unseen emails
-            status, messages = mail.search(None, 'UNSEEN')
-            email_ids = messages[0].split()
+            # A new UIDVALIDITY means old UIDs no longer identify the same messages
+            state = self.db.get_mailbox_state(account, folder)
+            last_uid = state[1] if state and state[0] == uidvalidity else 0
+            
+            # Search for unseen emails above the high-water mark
+            if last_uid:
+                status, messages = mail.uid('SEARCH', 'UID', f'{last_uid + 1}:*', 'UNSEEN')
+            else:
+                status, messages = mail.uid('SEARCH', 'UNSEEN')
+            uids = sorted(uid for uid in map(int, messages[0].split()) if uid > last_uid)
             
             new_emails = 0
+            batch_size = self.config.IMAP_FETCH_BATCH_SIZE
             
-            for email_id in email_ids:
-                if email_id in self.processed_emails:
-                    continue
+            for start in range(0, len(uids), batch_size):
+                batch = uids[start:start + batch_size]
+                try:
+                    previews = self.fetch_previews(mail, batch)
+                except PARSE_ERRORS as e:
+                    # Move the mark past it anyway, or it would fail on every poll
+                    print(f"Skipping UIDs {batch[0]}-{batch[-1]} in {account}/{folder}: unparseable response ({e!r})")
+                    previews = []
+                # Pick up rule changes once per batch, then match from memory
+                self.get_rule_matcher(refresh=True)
+                for sender, subject, body in previews:
+                    self.process_email(sender, subject, body, mailbox=f"{account}/{folder}")
+                    new_emails += 1
                 
-                status, msg_data = mail.fetch(email_id, '(RFC822)')
-                
-                for response_part in msg_data:
-                    if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
-                        
-                        # Extract email details
-                        subject = self.decode_email_subject(msg['subject'])
-                        sender = msg['from']
-                        body = self.get_email_body(msg)
-                        
-                        # Log email
-                        email_db_id = self.db.log_monitored_email(sender, subject, body)
-                        
-                        # Check notification rules
-                        matched_rules = self.check_notification_rules(sender, subject, body)
-                        
-                        if matched_rules:
-                            # Send notification
-                            notification_subject = f"Email Alert: {', '.join(matched_rules)}"
-                            notification_body = f"""
-New email matching notification rules: {', '.join(matched_rules)}
-
-From: {sender}
-Subject: {subject}
-
-Preview:
-{body[:200]}...
-                            """
-                            
-                            self.sender.send_notification(notification_subject, notification_body)
-                            self.db.mark_notification_sent(email_db_id)
-                        
-                        self.processed_emails.add(email_id)
-                        new_emails += 1
-                        
-                        print(f"Processed email from {sender}: {subject}")
+                if mark_as_read:
+                    mail.uid('STORE', ','.join(map(str, batch)), '+FLAGS.SILENT', '(\\Seen)')
+                self.db.save_mailbox_state(account, folder, uidvalidity, batch[-1])
+            
+            # Without a background flusher (start_alerts), nothing else would
+            # send a partly filled digest
+            if not self.digest.running:
+                self.digest.flush()
             
-            mail.close()
-            mail.logout()
+            # Everything below UIDNEXT has now been searched, so the mark can
+            # move past messages that were already read elsewhere
+            high_water = max([last_uid] + uids + ([int(uidnext) - 1] if uidnext else []))
+            saved = uids[-1] if uids else (last_uid if state and state[0] == uidvalidity else None)
+            if high_water != saved:
+                self.db.save_mailbox_state(account, folder, uidvalidity, high_water)
+            self.db.flush()
+            
+            if own_session:
+                mail.close()
+                mail.logout()
             
             return new_emails
             
         except Exception as e:
-            print(f"Error monitoring inbox: {e}")
+            if not own_session and isinstance(e, (imaplib.IMAP4.abort, OSError)):
+                raise
+            print(f"Error monitoring {account}/{folder}: {e}")
             return 0
     
-    def start_monitoring(self, interval=None):
-        """Start continuous email monitoring"""
+    def fetch_previews(self, mail, uids):
+        """Fetch (sender, subject, body preview) for a batch of UIDs.
+        
+        One FETCH gets the From/Subject/Date headers and BODYSTRUCTURE of the
+        whole batch without marking anything read; a second FETCH per distinct
+        text-part section gets only the first IMAP_PREVIEW_BYTES of that part.
+        Plain text is preferred; HTML-only mail is stripped to text.
+        Attachments are never downloaded.
+        """
+        uid_set = ','.join(map(str, uids))
+        status, data = mail.uid('FETCH', uid_set, f'(UID BODYSTRUCTURE {HEADER_FIELDS})')
+        messages = parse_fetch_response(data)
+        
+        text_parts = {}
+        by_section = {}
+        for uid, fields in messages.items():
+            try:
+                part = find_text_part(fields.get('BODYSTRUCTURE') or [])
+            except PARSE_ERRORS as e:
+                print(f"No preview for UID {uid}: unparseable BODYSTRUCTURE ({e!r})")
+                part = None
+            if part:
+                text_parts[uid] = part
+                by_section.setdefault(part[0], []).append(uid)
+        
+        bodies = {}
+        limit = self.config.IMAP_PREVIEW_BYTES
+        for section, section_uids in by_section.items():
+            status, data = mail.uid('FETCH', ','.join(map(str, section_uids)), f'(UID BODY.PEEK[{section}]<0.{limit}>)')
+            for uid, fields in parse_fetch_response(data).items():
+                if uid not in text_parts:
+                    continue
+                raw = next((value for key, value in fields.items() if key.startswith(f'BODY[{section}]')), None)
+                _, subtype, encoding, charset = text_parts[uid]
+                bodies[uid] = preview_text(raw or b'', subtype, encoding, charset)
+        
+        previews = []
+        for uid in uids:
+            if uid not in messages:
+                continue
+            raw_headers = next((value for key, value in messages[uid].items()
+                                if key.startswith(HEADER_FIELDS_PREFIX)), None)
+            headers = BytesHeaderParser().parsebytes(raw_headers or b'')
+            subject = self.decode_email_subject(headers['subject'])
+            previews.append((headers['from'] or '', subject, bodies.get(uid, '')[:PREVIEW_CHARS]))
+        return previews
+    
+    def process_email(self, sender, subject, body, mailbox=None):
+        """Log a fetched email and buffer an alert for each rule it matches.
+        
+        Every watched account and folder feeds this one pipeline, so rules
+        and alerts are shared across all of them.
+        """
+        # Log email
+        email_db_id = self.db.log_monitored_email(sender, subject, body)
+        
+        # Check notification rules
+        matched_rules = self.check_notification_rules(sender, subject, body)
+        
+        # Alerts are buffered per rule and sent as digests off this thread
+        for rule_name in matched_rules:
+            self.digest.add(rule_name, email_db_id, sender, subject, body, mailbox=mailbox)
+        
+        print(f"Processed email from {sender}: {subject}")
+    
+    def supports_idle(self, mail):
+        """Check whether the server advertises IDLE (RFC 2177)"""
+        return 'IDLE' in mail.capabilities
+    
+    def _data_waiting(self, mail):
+        """Check, without blocking, whether a response line is ready to read.
+
+        imaplib reads the socket through a buffered file, so lines that
+        arrived together with an earlier one (and bytes TLS has already
+        decrypted) are invisible to select().
+        """
+        sock = mail.socket()
+        timeout = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            return bool(mail.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+
+    def wait_for_new_mail(self, mail, timeout):
+        """Idle on the selected folder until the server reports new mail.
+        
+        Returns True when new mail arrived and False when the timeout passed
+        or monitoring was stopped. IDLE is always ended with DONE before
+        returning, so the session is ready for the next command.
+        """
+        # Our own tag series, so it can't clash with the tags imaplib issues
+        tag = f'IDLE{next(self._idle_tags)}'.encode('ascii')
+        mail.send(tag + b' IDLE\r\n')
+        response = mail.readline()
+        if not response.startswith(b'+'):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {response.decode(errors='replace').strip()}")
+        
+        sock = mail.socket()
+        deadline = time.monotonic() + timeout
+        new_mail = False
+        while not new_mail and not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not self._data_waiting(mail):
+                ready, _, _ = select.select([sock], [], [], min(remaining, 1.0))
+                if not ready:
+                    continue
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            new_mail = line.rstrip().upper().endswith((b'EXISTS', b'RECENT'))
+        
+        mail.send(b'DONE\r\n')
+        while True:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed while ending IDLE")
+            if line.startswith(tag + b' '):
+                break
+        return new_mail
+    
+    def watch_folder(self, folder='INBOX', interval=None, idle=None, target=None):
+        """Keep one authenticated session open and process mail as it arrives.
+        
+        Uses IDLE when the server supports it, re-issuing it every
+        IMAP_IDLE_TIMEOUT seconds, and otherwise polls the same session every
+        interval seconds. Dropped connections are re-established. Alerts are
+        delivered by background outbox workers while watching.
+        """
+        self._stop.clear()
+        self.start_alerts()
+        try:
+            self._watch(folder, interval, idle, target or MonitorTarget())
+        finally:
+            self.stop_alerts()
+    
+    def _watch(self, folder, interval, idle, target):
+        """Run the watch loop for one folder until stop() is called"""
         interval = interval or self.config.CHECK_INTERVAL
+        idle = self.config.IMAP_USE_IDLE if idle is None else idle
+        label = f"{target.account}/{folder}"
+        
+        while not self._stop.is_set():
+            mail = None
+            try:
+                mail = self.connect(target)
+                use_idle = idle and self.supports_idle(mail)
+                if idle and not use_idle:
+                    print(f"[{label}] Server does not support IDLE; polling every {interval} seconds")
+                
+                while not self._stop.is_set():
+                    new_emails = self.monitor_inbox(folder, mail=mail, target=target)
+                    if new_emails > 0:
+                        print(f"[{label}] Found and processed {new_emails} new email(s)")
+                    
+                    if use_idle:
+                        self.wait_for_new_mail(mail, self.config.IMAP_IDLE_TIMEOUT)
+                    else:
+                        mail.noop()
+                        self._stop.wait(interval)
+            except (imaplib.IMAP4.error, OSError) as e:
+                if self._stop.is_set():
+                    break
+                print(f"[{label}] IMAP connection lost ({e}); reconnecting in {self.config.IMAP_RECONNECT_DELAY} seconds")
+                self._stop.wait(self.config.IMAP_RECONNECT_DELAY)
+            finally:
+                if mail is not None:
+                    try:
+                        mail.logout()
+                    except (imaplib.IMAP4.error, OSError):
+                        pass
+    
+    def watch_targets(self, targets=None, interval=None, idle=None):
+        """Watch every folder of every target at once, one session per folder.
+        
+        Each folder runs on its own thread with its own connection and
+        high-water mark, so a slow or failing mailbox doesn't hold up the rest.
+        Blocks until stop() is called.
+        """
+        targets = targets or load_monitor_targets()
+        self._stop.clear()
+        threads = [
+            threading.Thread(target=self._watch, args=(folder, interval, idle, target), daemon=True)
+            for target in targets for folder in target.folders
+        ]
+        self.start_alerts()
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1.0)
+        finally:
+            self._stop.set()
+            self.stop_alerts()
+    
+    def monitor_targets(self, targets=None, mark_as_read=False):
+        """Run one polling cycle over every folder of every target concurrently"""
+        targets = targets or load_monitor_targets()
+        jobs = [(target, folder) for target in targets for folder in target.folders]
+        with ThreadPoolExecutor(max_workers=min(len(jobs), self.config.MONITOR_MAX_CONNECTIONS) or 1) as executor:
+            results = executor.map(
+                lambda job: self.monitor_inbox(job[1], mark_as_read=mark_as_read, target=job[0]), jobs
+            )
+            return sum(results)
+    
+    def start_alerts(self):
+        """Start the background digest flusher and alert delivery workers"""
+        self.digest.start()
+        self.outbox.start()
+    
+    def stop_alerts(self):
+        """Queue any buffered digests and stop background alert delivery"""
+        self.digest.stop()
+        self.outbox.stop()
+    
+    def stop(self):
+        """Ask running watch loops to finish"""
+        self._stop.set()
+    
+    def start_monitoring(self, interval=None, idle=None, targets=None):
+        """Start continuous email monitoring of the configured targets"""
+        interval = interval or self.config.CHECK_INTERVAL
+        idle = self.config.IMAP_USE_IDLE if idle is None else idle
+        targets = targets or load_monitor_targets()
+        
+        if idle:
+            print("Starting email monitoring (push notifications via IMAP IDLE)...")
+            print("Press Ctrl+C to stop")
+            try:
+                self.watch_targets(targets, interval=interval, idle=True)
+            except KeyboardInterrupt:
+                self.stop()
+                print("\nMonitoring stopped")
+            return
         
         print(f"Starting email monitoring (checking every {interval} seconds)...")
         print("Press Ctrl+C to stop")
         
+        self.start_alerts()
         try:
             while True:
-                new_emails = self.monitor_inbox()
+                new_emails = self.monitor_targets(targets)
                 if new_emails > 0:
                     print(f"Found and processed {new_emails} new email(s)")
                 else:
@@ -165,4 +449,6 @@ Preview:
                 time.sleep(interval)
                 
         except KeyboardInterrupt:
-            print("\nMonitoring stopped")
\ No newline at end of file
+            print("\nMonitoring stopped")
+        finally:
+            self.stop_alerts()
\ No newline at end of file
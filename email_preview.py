@@ -0,0 +1,119 @@
+import html
+import re
+from email.parser import BytesHeaderParser
+from config import Config
+from imap_fetch import decode_partial
+
+PREVIEW_CHARS = 500
+
+# Parts nested deeper than this are not searched for text
+_MAX_DEPTH = 10
+
+_HEADER_END = re.compile(rb'\r?\n\r?\n')
+_INVISIBLE = re.compile(r'<(script|style|head|title)\b.*?(?:</\1\s*>|$)|<!--.*?(?:-->|$)', re.IGNORECASE | re.DOTALL)
+_BLOCK = re.compile(r'<(?:br|/?p|/?div|/?li|/?tr|/?h[1-6]|/?blockquote|/?table)\b[^>]*>', re.IGNORECASE)
+_TAG = re.compile(r'<[^>]*(?:>|$)')
+_SPACES = re.compile(r'[ \t\r\f\v\xa0]+')
+_BLANK_LINES = re.compile(r'\s*\n\s*')
+
+
+def html_to_text(markup):
+    """Reduce HTML to readable text with a few regex passes.
+
+    Meant for previews, not fidelity: scripts, styles and comments are
+    dropped, block tags become line breaks, other tags are removed and
+    entities unescaped. Tags cut off at the end of a partial body are
+    dropped too.
+    """
+    text = _INVISIBLE.sub('', markup)
+    text = _BLOCK.sub('\n', text)
+    text = html.unescape(_TAG.sub('', text))
+    text = _SPACES.sub(' ', text)
+    return _BLANK_LINES.sub('\n', text).strip()
+
+
+def _headers(raw, start, end):
+    """Parse the header block of the part in raw[start:end]; returns (headers, body_start)"""
+    if raw.startswith(b'\n', start) or raw.startswith(b'\r\n', start):
+        return BytesHeaderParser().parsebytes(b''), raw.index(b'\n', start) + 1
+    match = _HEADER_END.search(raw, start, end)
+    body_start = match.end() if match else end
+    return BytesHeaderParser().parsebytes(raw[start:body_start]), body_start
+
+
+def _subparts(raw, start, end, boundary):
+    """Yield (start, end) of each part of a multipart body, without copying them"""
+    delimiter = b'--' + boundary.encode('ascii', errors='replace')
+    if raw.startswith(delimiter, start):
+        position = start
+    else:
+        position = raw.find(b'\n' + delimiter, start, end)
+        if position == -1:
+            return
+        position += 1
+    while True:
+        after = position + len(delimiter)
+        if raw.startswith(b'--', after):
+            return
+        line_end = raw.find(b'\n', after, end)
+        if line_end == -1:
+            return
+        part_start = line_end + 1
+        following = raw.find(b'\n' + delimiter, part_start, end)
+        part_end = end if following == -1 else following
+        if part_end > part_start and raw[part_end - 1:part_end] == b'\r':
+            part_end -= 1
+        yield part_start, part_end
+        if following == -1:
+            return
+        position = following + 1
+
+
+def _find_text(raw, start, end, depth=0):
+    """Locate the best inline text part; returns (subtype, encoding, charset, start, end) or None.
+
+    Plain text is preferred over HTML. Only part headers are parsed, and
+    the search stops at the first plain-text part.
+    """
+    headers, body_start = _headers(raw, start, end)
+    if headers.get_content_disposition() == 'attachment':
+        return None
+    maintype, subtype = headers.get_content_maintype(), headers.get_content_subtype()
+    if maintype == 'multipart':
+        boundary = headers.get_param('boundary')
+        if not boundary or depth >= _MAX_DEPTH:
+            return None
+        fallback = None
+        for part_start, part_end in _subparts(raw, body_start, end, boundary):
+            found = _find_text(raw, part_start, part_end, depth + 1)
+            if found and found[0] == 'plain':
+                return found
+            fallback = fallback or found
+        return fallback
+    if maintype == 'text' and subtype in ('plain', 'html'):
+        encoding = (headers.get('content-transfer-encoding') or '7bit').strip().lower()
+        return subtype, encoding, headers.get_content_charset(), body_start, end
+    return None
+
+
+def extract_preview(raw, chars=PREVIEW_CHARS, max_bytes=None):
+    """Preview text of a raw RFC 822 message.
+
+    Only header blocks are parsed, and only the first max_bytes (default
+    IMAP_PREVIEW_BYTES) of the chosen text part are decoded, in its
+    declared charset. HTML-only mail is stripped to text.
+    """
+    max_bytes = max_bytes or Config.IMAP_PREVIEW_BYTES
+    found = _find_text(raw, 0, len(raw))
+    if not found:
+        return ''
+    subtype, encoding, charset, start, end = found
+    return preview_text(raw[start:min(end, start + max_bytes)], subtype, encoding, charset, chars)
+
+
+def preview_text(data, subtype, encoding, charset, chars=PREVIEW_CHARS):
+    """Decode the leading bytes of a text part into at most chars characters of preview"""
+    text = decode_partial(data, encoding, charset)
+    if subtype == 'html':
+        text = html_to_text(text)
+    return text[:chars]
@@ -1,11 +1,19 @@
 import smtplib
-import csv
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
+import socket
+import hashlib
+import os
+import threading
 from config import Config
 from database import EmailDatabase
+from smtp_pool import SMTPConnectionPool
+from mime_cache import AttachmentCache, serialize_message
+from smtp_batch import send_envelope, chunked
+from rate_limiter import get_rate_limiter
+from recipients import iter_recipients, file_hash, read_fieldnames
+from templates import TemplateError, compile_template, load_template
+from bulk_pipeline import BulkSendPipeline, CampaignProgress
+from bulk_shards import ShardedBulkSend
+from suppression import RecipientFilter
 
 class EmailSender:
     """Handles sending emails via SMTP"""
@@ -13,12 +21,27 @@ class EmailSender:
     def __init__(self):
         self.config = Config
         self.db = EmailDatabase()
+        self.pool = SMTPConnectionPool(
+            self.connect,
+            max_size=self.config.SMTP_POOL_SIZE,
+            max_messages=self.config.SMTP_MAX_MESSAGES_PER_CONNECTION,
+            max_age=self.config.SMTP_CONNECTION_MAX_AGE,
+            health_check_after=self.config.SMTP_HEALTH_CHECK_AFTER
+        )
+        self.rate_limiter = get_rate_limiter(self.config.SMTP_SERVER, self.config.SMTP_RATE_LIMIT)
+        self.attachment_cache = AttachmentCache(self.config.ATTACHMENT_CACHE_MB * 1024 * 1024)
+        # Set on enqueue so idle OutboxWorkers pick new mail up straight away
+        self.outbox_wakeup = threading.Event()
     
     def connect(self):
         """Establish SMTP connection"""
         try:
-            server = smtplib.SMTP(self.config.SMTP_SERVER, self.config.SMTP_PORT)
-            server.starttls()
+            server = smtplib.SMTP(self.config.SMTP_SERVER, self.config.SMTP_PORT, timeout=self.config.SMTP_TIMEOUT)
+            # Cached attachment parts are written separately from the headers
+            # around them; don't let Nagle hold them back waiting for an ACK
+            server.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.config.SMTP_USE_TLS:
+                server.starttls()
             server.login(self.config.EMAIL_ADDRESS, self.config.EMAIL_PASSWORD)
             return server
         except Exception as e:
@@ -28,24 +51,12 @@ class EmailSender:
     def send_email(self, to_email, subject, body, html=False, attachments=None):
         """Send a single email"""
         try:
-            msg = MIMEMultipart()
-            msg['From'] = self.config.EMAIL_ADDRESS
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            
-            # Add body
-            mime_type = 'html' if html else 'plain'
-            msg.attach(MIMEText(body, mime_type))
-            
-            # Add attachments if any
-            if attachments:
-                for file_path in attachments:
-                    self._attach_file(msg, file_path)
+            msg = self._build_message(to_email, subject, body, html=html, attachments=attachments)
             
             # Send email
-            server = self.connect()
-            server.send_message(msg)
-            server.quit()
+            error = self._deliver(msg).get(to_email)
+            if error:
+                raise smtplib.SMTPException(error)
             
             # Log success
             self.db.log_sent_email(to_email, subject, status='sent')
@@ -58,53 +69,205 @@ class EmailSender:
             print(f"Failed to send email to {to_email}: {error_msg}")
             return False
     
-    def _attach_file(self, msg, file_path):
-        """Attach a file to the email"""
+    def enqueue_email(self, to_email, subject, body, html=False, attachments=None):
+        """Queue an email for the background delivery workers and return at once.
+        
+        The message is committed to the outbox before this returns, so it
+        survives restarts; OutboxWorkers deliver and retry it.
+        """
+        outbox_id = self.db.enqueue_outbox(to_email, subject, body, html=html, attachments=attachments)
+        self.outbox_wakeup.set()
+        print(f"Email to {to_email} queued for delivery")
+        return outbox_id
+    
+    def _build_message(self, to_email, subject, body, html=False, attachments=None):
+        """Serialize the message for one recipient, or a list sharing one envelope.
+        
+        attachments may be file paths or parts already encoded by
+        _load_attachments; either way each file is encoded only once.
+        """
+        parts = self._load_attachments(attachments)
+        if isinstance(to_email, str):
+            to_email = [to_email]
+        to_header = to_email[0] if len(to_email) == 1 else 'undisclosed-recipients:;'
+        return serialize_message(self.config.EMAIL_ADDRESS, to_header, subject, body, html=html,
+                                 attachments=parts, envelope=to_email)
+    
+    def _load_attachments(self, attachments):
+        """Resolve attachment paths to cached encoded parts, skipping unreadable files"""
+        parts = []
+        for attachment in attachments or ():
+            if isinstance(attachment, bytes):
+                parts.append(attachment)
+                continue
+            try:
+                parts.append(self.attachment_cache.get(attachment))
+            except Exception as e:
+                print(f"Failed to attach file {attachment}: {e}")
+        return parts
+    
+    def _deliver(self, msg):
+        """Send a message over a pooled session, reconnecting once if the server dropped it.
+        
+        Returns {recipient: None if accepted, else the server's error}.
+        """
+        if self.rate_limiter:
+            # The limit counts recipients, so an envelope takes one token per recipient
+            self.rate_limiter.acquire(len(msg.to_addrs))
         try:
-            with open(file_path, 'rb') as file:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(file.read())
-                encoders.encode_base64(part)
-                part.add_header('Content-Disposition', f'attachment; filename={file_path.split("/")[-1]}')
-                msg.attach(part)
-        except Exception as e:
-            print(f"Failed to attach file {file_path}: {e}")
+            with self.pool.connection() as server:
+                return send_envelope(server, msg.from_addr, msg.to_addrs, msg.chunks)
+        except smtplib.SMTPServerDisconnected:
+            with self.pool.connection() as server:
+                return send_envelope(server, msg.from_addr, msg.to_addrs, msg.chunks)
+    
+    def send_batch(self, recipients, subject, body, html=False, attachments=None):
+        """Send one identical message to many recipients.
+        
+        Recipients share envelopes of up to SMTP_MAX_RECIPIENTS, so one SMTP
+        transaction covers many of them. Each recipient's accept or reject is
+        logged to sent_emails. Returns {recipient: None if sent, else the error}.
+        """
+        parts = self._load_attachments(attachments)
+        results = {}
+        for envelope in chunked(list(dict.fromkeys(recipients)), self.config.SMTP_MAX_RECIPIENTS):
+            try:
+                envelope_results = self._deliver(self._build_message(envelope, subject, body, html=html, attachments=parts))
+            except Exception as e:
+                envelope_results = {rcpt: str(e) for rcpt in envelope}
+            for rcpt, error in envelope_results.items():
+                if error is None:
+                    self.db.log_sent_email(rcpt, subject, status='sent', sync=False)
+                else:
+                    self.db.log_sent_email(rcpt, subject, status='failed', error_message=error, sync=False)
+                    print(f"Failed to send email to {rcpt}: {error}")
+            results.update(envelope_results)
+        self.db.flush()
+        
+        sent = sum(1 for error in results.values() if error is None)
+        print(f"Email sent successfully to {sent} of {len(results)} recipient(s)")
+        return results
     
-    def send_bulk_emails(self, csv_file, subject_template, body_template, html=False):
-        """Send bulk emails from CSV file with personalization"""
-        success_count = 0
-        failed_count = 0
+    def close(self):
+        """Close pooled SMTP sessions and flush batched log writes"""
+        self.pool.close()
+        self.db.close()
+    
+    def send_bulk_emails(self, csv_file, subject_template, body_template, html=False, workers=None,
+                         start_row=0, campaign_name=None, resume=True, body_template_file=None, attachments=None,
+                         processes=None):
+        """Send bulk emails from a CSV, JSONL or gzip'd recipient file with personalization.
+        
+        Each run is tracked as a campaign. If an earlier run over the same file
+        and templates did not finish, it is resumed and rows it already sent
+        are skipped; pass resume=False to start over.
+        
+        Templates are compiled once and their placeholders checked against the
+        file's columns before anything is sent. body_template_file loads the
+        body (e.g. a reusable HTML template) from disk instead. Attachments are
+        encoded once up front and shared by every message in the run.
+        
+        Repeated addresses and addresses in the suppressions table (earlier
+        hard bounces, unsubscribes) are skipped before rendering.
+        
+        With processes above 1 the rows are sharded across that many worker
+        processes, each with its own SMTP pool and database writer.
+        """
+        workers = workers or self.config.BULK_SEND_WORKERS
+        processes = processes or self.config.BULK_SEND_PROCESSES
+        if processes > 1:
+            pipeline = ShardedBulkSend(processes, workers=workers)
+        else:
+            pipeline = BulkSendPipeline(
+                self,
+                workers=workers,
+                queue_size=self.config.BULK_QUEUE_SIZE,
+                batch_size=self.config.BULK_RENDER_BATCH,
+                envelope_size=self.config.SMTP_MAX_RECIPIENTS
+            )
         
         try:
-            with open(csv_file, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                
-                for row in reader:
-                    # Personalize subject and body
-                    subject = subject_template.format(**row)
-                    body = body_template.format(**row)
-                    
-                    # Send email
-                    if self.send_email(row['email'], subject, body, html=html):
-                        success_count += 1
-                    else:
-                        failed_count += 1
+            subject = compile_template(subject_template)
+            body = load_template(body_template_file) if body_template_file else compile_template(body_template)
+            self._validate_templates(csv_file, subject, body)
+            
+            campaign_id = self._start_campaign(csv_file, subject.source, body.source, campaign_name, resume)
+            
+            if processes > 1:
+                pipeline.run(csv_file, subject.source, body.source, campaign_id,
+                             html=html, start_row=start_row, attachments=attachments)
+            else:
+                progress = CampaignProgress(self.db, campaign_id, batch_size=self.config.CAMPAIGN_CHECKPOINT_BATCH)
+                pipeline.run(iter_recipients(csv_file, start_row=start_row), subject, body,
+                             html=html, progress=progress, attachments=self._load_attachments(attachments),
+                             recipient_filter=RecipientFilter(self.db))
+            self.db.complete_campaign(campaign_id)
             
             print(f"\nBulk email summary:")
-            print(f"Successfully sent: {success_count}")
-            print(f"Failed: {failed_count}")
+            print(f"Successfully sent: {pipeline.success_count}")
+            print(f"Failed: {pipeline.failed_count}")
+            if pipeline.skipped_count:
+                print(f"Skipped (sent by an earlier run): {pipeline.skipped_count}")
+            if pipeline.suppressed_count:
+                print(f"Suppressed (bounced or unsubscribed): {pipeline.suppressed_count}")
+            if pipeline.duplicate_count:
+                print(f"Duplicate addresses skipped: {pipeline.duplicate_count}")
             
-            return success_count, failed_count
+            return pipeline.success_count, pipeline.failed_count
             
         except Exception as e:
-            print(f"Error processing CSV file: {e}")
-            return success_count, failed_count
+            print(f"Error processing recipient file: {e}")
+            return pipeline.success_count, pipeline.failed_count
+    
+    def _validate_templates(self, csv_file, subject, body):
+        """Fail before sending if the file lacks an email column or a template field"""
+        fieldnames = read_fieldnames(csv_file)
+        if 'email' not in fieldnames:
+            raise TemplateError("Recipient file has no 'email' column")
+        subject.validate(fieldnames)
+        body.validate(fieldnames)
+    
+    def _start_campaign(self, csv_file, subject_template, body_template, campaign_name, resume):
+        """Resume the unfinished campaign for this file and templates, or create one"""
+        source_hash = file_hash(csv_file)
+        template_hash = hashlib.sha256(f"{subject_template}\0{body_template}".encode('utf-8')).hexdigest()
+        
+        if resume:
+            campaign_id = self.db.find_incomplete_campaign(source_hash, template_hash)
+            if campaign_id:
+                print(f"Resuming campaign {campaign_id}")
+                return campaign_id
+        
+        return self.db.create_campaign(campaign_name or os.path.basename(csv_file), source_hash, template_hash)
     
     def send_notification(self, subject, body):
-        """Send notification email to configured recipient"""
-        notification_email = self.config.NOTIFICATION_EMAIL
-        if notification_email:
-            return self.send_email(notification_email, subject, body)
+        """Send notification email to the configured recipient(s)
+        
+        NOTIFICATION_EMAIL may list several comma-separated addresses; they
+        are sent one shared message rather than a copy each.
+        """
+        recipients = [address.strip() for address in (self.config.NOTIFICATION_EMAIL or '').split(',') if address.strip()]
+        if len(recipients) == 1:
+            return self.send_email(recipients[0], subject, body)
+        elif recipients:
+            results = self.send_batch(recipients, subject, body)
+            return all(error is None for error in results.values())
         else:
             print("No notification email configured")
-            return False
\ No newline at end of file
+            return False
+    
+    def queue_notification(self, subject, body, email_ids=()):
+        """Queue a notification to the configured recipient(s) for background delivery.
+        
+        The monitored emails in email_ids are marked notified once the
+        notification is delivered.
+        """
+        recipients = [address.strip() for address in (self.config.NOTIFICATION_EMAIL or '').split(',') if address.strip()]
+        if not recipients:
+            print("No notification email configured")
+            return False
+        self.db.enqueue_notification(recipients, subject, body, email_ids)
+        self.outbox_wakeup.set()
+        for recipient in recipients:
+            print(f"Email to {recipient} queued for delivery")
+        return True
\ No newline at end of file
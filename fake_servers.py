@@ -0,0 +1,526 @@
+import email
+import re
+import socketserver
+import threading
+import time
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough ESMTP for smtplib to deliver through it"""
+
+    # Replies are written line by line; with Nagle on, each pipelined
+    # envelope would stall on the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write(line.encode('utf-8') + b'\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server.fake
+        with server.lock:
+            server.connections += 1
+        messages_on_connection = 0
+        mail_from = None
+        rcpts = []
+
+        self.reply('220 fake-smtp ESMTP ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', errors='replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            argument = command[len(verb):].strip()
+
+            if server.latency:
+                time.sleep(server.latency)
+
+            if verb in ('EHLO', 'HELO'):
+                extensions = ['fake-smtp', 'AUTH PLAIN LOGIN', '8BITMIME']
+                if server.pipelining:
+                    extensions.append('PIPELINING')
+                for extension in extensions[:-1]:
+                    self.reply(f'250-{extension}')
+                self.reply(f'250 {extensions[-1]}')
+            elif verb == 'AUTH':
+                with server.lock:
+                    server.logins += 1
+                self.reply('235 2.7.0 Authentication successful')
+            elif verb == 'NOOP':
+                with server.lock:
+                    server.noops += 1
+                self.reply('250 OK')
+            elif verb == 'RSET':
+                mail_from, rcpts = None, []
+                self.reply('250 OK')
+            elif verb == 'MAIL':
+                mail_from = argument.split(':', 1)[1].strip().strip('<>').split('>')[0]
+                rcpts = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = argument.split(':', 1)[1].strip().strip('<>').split('>')[0]
+                if address in server.reject_recipients:
+                    self.reply('550 5.1.1 No such user')
+                elif address in server.defer_recipients:
+                    self.reply('451 4.3.0 Try again later')
+                else:
+                    rcpts.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                if not rcpts:
+                    self.reply('554 5.5.1 No valid recipients')
+                    continue
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                chunks = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line == b'.\r\n':
+                        break
+                    if data_line.startswith(b'..'):
+                        data_line = data_line[1:]
+                    chunks.append(data_line)
+                if server.reject_data:
+                    mail_from, rcpts = None, []
+                    self.reply(server.reject_data)
+                    continue
+                with server.lock:
+                    server.messages.append((mail_from, list(rcpts), b''.join(chunks)))
+                mail_from, rcpts = None, []
+                messages_on_connection += 1
+                self.reply('250 OK queued')
+                if server.drop_after and messages_on_connection >= server.drop_after:
+                    return
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 5.5.2 Command not recognized')
+
+
+class FakeSMTPServer:
+    """In-process SMTP server for tests and benchmarks.
+
+    Accepts any credentials and records every delivered message as a
+    ``(mail_from, recipients, data)`` tuple in ``messages``. reject_data is
+    a reply line sent instead of accepting message data.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, pipelining=True,
+                 drop_after=None, reject_recipients=None, defer_recipients=None, reject_data=None):
+        self.latency = latency
+        self.pipelining = pipelining
+        self.drop_after = drop_after
+        self.reject_recipients = set(reject_recipients or ())
+        self.defer_recipients = set(defer_recipients or ())
+        self.reject_data = reject_data
+        self.messages = []
+        self.connections = 0
+        self.logins = 0
+        self.noops = 0
+        self.lock = threading.Lock()
+        self._server = _ThreadingServer((host, port), _SMTPHandler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        """Start serving on a background thread"""
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and release the listening socket"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def _parse_set(message_set, highest):
+    """Expand an IMAP sequence set like '1,4:6,9:*' into a set of numbers"""
+    numbers = set()
+    for part in message_set.split(','):
+        if ':' in part:
+            start, end = part.split(':')
+            start = highest if start == '*' else int(start)
+            end = highest if end == '*' else int(end)
+            numbers.update(range(min(start, end), max(start, end) + 1))
+        else:
+            numbers.add(highest if part == '*' else int(part))
+    return numbers
+
+
+_FETCH_ITEM = re.compile(r'BODY(?:\.PEEK)?\[[^\]]*\](?:<\d+\.\d+>)?|[A-Z0-9.]+', re.IGNORECASE)
+
+
+_BODY_ITEM = re.compile(r'BODY(?:\.PEEK)?\[(.*?)\](?:<(\d+)\.(\d+)>)?$', re.IGNORECASE)
+
+
+def _quote(value):
+    return 'NIL' if value is None else '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _bodystructure(part):
+    """Render a parsed message part as an IMAP BODYSTRUCTURE"""
+    disposition = part.get_content_disposition()
+    disposition = f'({_quote(disposition.upper())} NIL)' if disposition else 'NIL'
+    if part.is_multipart():
+        # Subtype, then the extension data servers send for multiparts:
+        # parameters, disposition and language
+        children = ''.join(_bodystructure(child) for child in part.get_payload())
+        boundary = f'("BOUNDARY" {_quote(part.get_boundary())})' if part.get_boundary() else 'NIL'
+        return f'({children} {_quote(part.get_content_subtype().upper())} {boundary} {disposition} NIL)'
+    params = part.get_params() or []
+    params = ' '.join(f'{_quote(key.upper())} {_quote(value)}' for key, value in params[1:])
+    payload = part.get_payload()
+    payload = payload.encode('utf-8', errors='replace') if isinstance(payload, str) else b''
+    fields = [_quote(part.get_content_maintype().upper()), _quote(part.get_content_subtype().upper()),
+              f'({params})' if params else 'NIL', 'NIL', 'NIL',
+              _quote(part.get('Content-Transfer-Encoding', '7BIT').upper()), str(len(payload))]
+    if part.get_content_maintype() == 'text':
+        fields.append(str(payload.count(b'\n') + 1))
+    fields += ['NIL', disposition]
+    return '(' + ' '.join(fields) + ')'
+
+
+def _section(parsed, raw, section):
+    """Return the raw bytes of a BODY[section] for a message"""
+    upper = section.upper()
+    if upper.startswith('HEADER.FIELDS'):
+        wanted = {name.lower() for name in re.findall(r'[A-Za-z-]+', upper[len('HEADER.FIELDS'):])}
+        headers = ''.join(f'{name}: {value}\r\n' for name, value in parsed.items() if name.lower() in wanted)
+        return (headers + '\r\n').encode('utf-8')
+    if not section:
+        return raw
+    part = parsed
+    for index in section.split('.'):
+        if part.is_multipart():
+            part = part.get_payload()[int(index) - 1]
+        elif index != '1':
+            return b''
+    payload = part.get_payload()
+    return payload.encode('utf-8', errors='replace') if isinstance(payload, str) else b''
+
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    """Speaks enough IMAP4rev1 for imaplib-based monitoring"""
+
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.selected = None
+        self.reported = 0
+
+    def send_line(self, line):
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        with self.write_lock:
+            self.wfile.write(line + b'\r\n')
+            self.wfile.flush()
+
+    def send_literal(self, prefix, data, suffix=')'):
+        with self.write_lock:
+            self.wfile.write(f'{prefix} {{{len(data)}}}\r\n'.encode('utf-8') + data + suffix.encode('utf-8') + b'\r\n')
+            self.wfile.flush()
+
+    def handle(self):
+        server = self.server.fake
+        with server.lock:
+            server.connections += 1
+        self.send_line('* OK fake-imap ready')
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                parts = line.decode('utf-8', errors='replace').rstrip('\r\n').split(' ', 2)
+                if len(parts) < 2:
+                    self.send_line('* BAD missing command')
+                    continue
+                tag, command = parts[0], parts[1].upper()
+                argument = parts[2] if len(parts) > 2 else ''
+                with server.lock:
+                    server.commands.append(command if command != 'UID' else f'UID {argument.split(" ", 1)[0].upper()}')
+
+                if server.latency:
+                    time.sleep(server.latency)
+
+                handler = getattr(self, f'do_{command}', None)
+                if handler is None:
+                    self.send_line(f'{tag} BAD unknown command')
+                elif handler(tag, argument) is False:
+                    return
+        finally:
+            server.stop_idling(self)
+
+    def do_CAPABILITY(self, tag, argument):
+        capabilities = 'IMAP4rev1 AUTH=PLAIN'
+        if self.server.fake.idle:
+            capabilities += ' IDLE'
+        self.send_line(f'* CAPABILITY {capabilities}')
+        self.send_line(f'{tag} OK CAPABILITY completed')
+
+    def do_LOGIN(self, tag, argument):
+        with self.server.fake.lock:
+            self.server.fake.logins += 1
+        self.send_line(f'{tag} OK LOGIN completed')
+
+    def do_NOOP(self, tag, argument):
+        self.send_line(f'{tag} OK NOOP completed')
+
+    def do_SELECT(self, tag, argument):
+        server = self.server.fake
+        folder = argument.strip().strip('"')
+        with server.lock:
+            mailbox = server.mailboxes.get(folder)
+            if mailbox is None:
+                self.send_line(f'{tag} NO no such mailbox')
+                return
+            self.selected = folder
+            self.reported = len(mailbox['messages'])
+            self.send_line('* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)')
+            self.send_line(f'* {self.reported} EXISTS')
+            self.send_line('* 0 RECENT')
+            self.send_line(f'* OK [UIDVALIDITY {mailbox["uidvalidity"]}] UIDs valid')
+            self.send_line(f'* OK [UIDNEXT {mailbox["uidnext"]}] Predicted next UID')
+        self.send_line(f'{tag} OK [READ-WRITE] SELECT completed')
+
+    do_EXAMINE = do_SELECT
+
+    def _search(self, argument, by_uid):
+        messages = self.server.fake.mailboxes[self.selected]['messages']
+        tokens = argument.upper().split()
+        uid_range = None
+        if 'UID' in tokens:
+            uid_range = tokens[tokens.index('UID') + 1]
+        highest = messages[-1]['uid'] if messages else 0
+        results = []
+        for number, message in enumerate(messages, 1):
+            if 'UNSEEN' in tokens and '\\Seen' in message['flags']:
+                continue
+            if uid_range and message['uid'] not in _parse_set(uid_range, highest):
+                continue
+            results.append(message['uid'] if by_uid else number)
+        # Like real servers, "n:*" always includes the highest UID
+        if uid_range and uid_range.endswith(':*') and messages and highest not in results:
+            if 'UNSEEN' not in tokens or '\\Seen' not in messages[-1]['flags']:
+                results.append(highest if by_uid else len(messages))
+        return results
+
+    def _fetch(self, argument, by_uid):
+        messages = self.server.fake.mailboxes[self.selected]['messages']
+        message_set, items = argument.split(' ', 1)
+        items = _FETCH_ITEM.findall(items.strip()[1:-1] if items.strip().startswith('(') else items)
+        highest = (messages[-1]['uid'] if by_uid else len(messages)) if messages else 0
+        wanted = _parse_set(message_set, highest)
+        for number, message in enumerate(messages, 1):
+            if (message['uid'] if by_uid else number) not in wanted:
+                continue
+            pieces = [f'* {number} FETCH (UID {message["uid"]}']
+            parsed = email.message_from_bytes(message['data'])
+            for item in items:
+                name = item.upper()
+                if name == 'UID':
+                    continue
+                if name == 'RFC822':
+                    message['flags'].add('\\Seen')
+                    pieces += [' RFC822', message['data']]
+                elif name == 'BODYSTRUCTURE':
+                    pieces.append(f' BODYSTRUCTURE {_bodystructure(parsed)}')
+                elif name.startswith('BODY'):
+                    if not name.startswith('BODY.PEEK'):
+                        message['flags'].add('\\Seen')
+                    section, start, count = _BODY_ITEM.match(item).groups()
+                    data = _section(parsed, message['data'], section)
+                    label = f' BODY[{section}]'
+                    if self.server.fake.quote_field_names and section.upper().startswith('HEADER.FIELDS'):
+                        # Some servers echo the field list quoted and in the case stored
+                        names = re.findall(r'[A-Za-z-]+', section[len('HEADER.FIELDS'):])
+                        quoted = ' '.join(f'"{name.title()}"' for name in names)
+                        label = f' BODY[HEADER.FIELDS ({quoted})]'
+                    if start is not None:
+                        data = data[int(start):int(start) + int(count)]
+                        label += f'<{start}>'
+                    pieces += [label, data]
+            self._send_pieces(pieces)
+
+    def _send_pieces(self, pieces):
+        """Write a FETCH response, sending bytes pieces as literals"""
+        out = b''
+        for piece in pieces:
+            if isinstance(piece, bytes):
+                out += f' {{{len(piece)}}}\r\n'.encode('utf-8') + piece
+            else:
+                out += piece.encode('utf-8')
+        with self.write_lock:
+            self.wfile.write(out + b')\r\n')
+            self.wfile.flush()
+
+    def _store(self, argument):
+        messages = self.server.fake.mailboxes[self.selected]['messages']
+        message_set, action, flags = argument.split(' ', 2)
+        wanted = _parse_set(message_set, messages[-1]['uid'] if messages else 0)
+        flags = set(flags.strip('()').split())
+        for message in messages:
+            if message['uid'] in wanted:
+                if action.upper().startswith('+'):
+                    message['flags'] |= flags
+                else:
+                    message['flags'] -= flags
+
+    def do_SEARCH(self, tag, argument):
+        numbers = self._search(argument, by_uid=False)
+        self.send_line('* SEARCH' + ''.join(f' {number}' for number in numbers))
+        self.send_line(f'{tag} OK SEARCH completed')
+
+    def do_FETCH(self, tag, argument):
+        self._fetch(argument, by_uid=False)
+        self.send_line(f'{tag} OK FETCH completed')
+
+    def do_UID(self, tag, argument):
+        command, rest = (argument.split(' ', 1) + [''])[:2]
+        command = command.upper()
+        if command == 'SEARCH':
+            uids = self._search(rest, by_uid=True)
+            self.send_line('* SEARCH' + ''.join(f' {uid}' for uid in uids))
+        elif command == 'FETCH':
+            self._fetch(rest, by_uid=True)
+        elif command == 'STORE':
+            self._store(rest)
+        else:
+            self.send_line(f'{tag} BAD unsupported UID command')
+            return
+        self.send_line(f'{tag} OK UID {command} completed')
+
+    def do_IDLE(self, tag, argument):
+        server = self.server.fake
+        # Like real servers, report mail that arrived since the last EXISTS
+        # straight away, in the same packet as the continuation
+        with self.write_lock:
+            exists = server.start_idling(self)
+            grown, self.reported = exists > self.reported, max(exists, self.reported)
+            self.wfile.write(b'+ idling\r\n' + (f'* {exists} EXISTS\r\n'.encode('utf-8') if grown else b''))
+            self.wfile.flush()
+        try:
+            line = self.rfile.readline()
+        finally:
+            server.stop_idling(self)
+        if not line:
+            return False
+        if line.strip().upper() != b'DONE':
+            self.send_line(f'{tag} BAD expected DONE')
+        else:
+            self.send_line(f'{tag} OK IDLE terminated')
+
+    def do_CLOSE(self, tag, argument):
+        self.selected = None
+        self.send_line(f'{tag} OK CLOSE completed')
+
+    def do_LOGOUT(self, tag, argument):
+        self.send_line('* BYE logging out')
+        self.send_line(f'{tag} OK LOGOUT completed')
+        return False
+
+
+class FakeIMAPServer:
+    """In-process IMAP server for tests and benchmarks.
+
+    Holds messages in memory per folder; deliver() adds one and notifies
+    any session idling on that folder. quote_field_names makes FETCH echo
+    HEADER.FIELDS lists quoted and title-cased, as some servers do.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, idle=True, folders=('INBOX',),
+                 quote_field_names=False):
+        self.latency = latency
+        self.quote_field_names = quote_field_names
+        self.idle = idle
+        self.mailboxes = {folder: {'uidvalidity': 1, 'uidnext': 1, 'messages': []} for folder in folders}
+        self.commands = []
+        self.connections = 0
+        self.logins = 0
+        self.lock = threading.Lock()
+        self._idlers = set()
+        self._server = _ThreadingServer((host, port), _IMAPHandler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def deliver(self, data, folder='INBOX', seen=False):
+        """Add a message (bytes) to a folder and return its UID"""
+        with self.lock:
+            mailbox = self.mailboxes[folder]
+            uid = mailbox['uidnext']
+            mailbox['uidnext'] += 1
+            mailbox['messages'].append({'uid': uid, 'flags': {'\\Seen'} if seen else set(), 'data': data})
+            exists = len(mailbox['messages'])
+            idlers = [handler for handler in self._idlers if handler.selected == folder]
+            for handler in idlers:
+                handler.reported = exists
+        for handler in idlers:
+            try:
+                handler.send_line(f'* {exists} EXISTS')
+            except OSError:
+                pass
+        return uid
+
+    def expunge(self, uid, folder='INBOX'):
+        """Remove a message, shifting the sequence numbers of later ones"""
+        with self.lock:
+            messages = self.mailboxes[folder]['messages']
+            messages[:] = [message for message in messages if message['uid'] != uid]
+
+    def start_idling(self, handler):
+        """Notify handler of new mail from now on; returns its folder's message count"""
+        with self.lock:
+            self._idlers.add(handler)
+            mailbox = self.mailboxes.get(handler.selected)
+            return len(mailbox['messages']) if mailbox else 0
+
+    def stop_idling(self, handler):
+        with self.lock:
+            self._idlers.discard(handler)
+
+    def start(self):
+        """Start serving on a background thread"""
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and release the listening socket"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
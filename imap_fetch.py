@@ -0,0 +1,182 @@
+import base64
+import binascii
+import codecs
+import quopri
+import re
+
+# The FETCH item requesting just the headers the monitor uses, and the
+# start of the name the server answers it under (servers differ in how
+# they echo the field list)
+HEADER_FIELDS = 'BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE)]'
+HEADER_FIELDS_PREFIX = 'BODY[HEADER.FIELDS'
+_LITERAL = re.compile(rb'\{(\d+)\}$')
+
+# What a malformed FETCH response or BODYSTRUCTURE can raise while parsing
+PARSE_ERRORS = (ValueError, TypeError, AttributeError, IndexError, KeyError)
+
+
+class _Literal(bytes):
+    """Marks a literal string so the tokenizer doesn't scan inside it"""
+
+
+def _chunks(data):
+    """Flatten an imaplib FETCH response into text and literal chunks"""
+    for item in data:
+        if isinstance(item, tuple):
+            text, literal = item
+            yield _LITERAL.sub(b'', text)
+            yield _Literal(literal)
+        elif item:
+            yield item
+
+
+def _tokenize(data):
+    """Yield '(' / ')' markers, atoms (str) and strings (bytes) from a response"""
+    for chunk in _chunks(data):
+        if isinstance(chunk, _Literal):
+            yield bytes(chunk)
+            continue
+        i, length = 0, len(chunk)
+        while i < length:
+            ch = chunk[i:i + 1]
+            if ch in (b' ', b'\r', b'\n'):
+                i += 1
+            elif ch in (b'(', b')'):
+                yield ch.decode()
+                i += 1
+            elif ch == b'"':
+                j = i + 1
+                value = bytearray()
+                while j < length and chunk[j:j + 1] != b'"':
+                    if chunk[j:j + 1] == b'\\':
+                        j += 1
+                    value += chunk[j:j + 1]
+                    j += 1
+                yield bytes(value)
+                i = j + 1
+            else:
+                # Atoms may contain bracketed section specs with spaces and parens
+                j, depth = i, 0
+                while j < length:
+                    c = chunk[j:j + 1]
+                    if c == b'[':
+                        depth += 1
+                    elif c == b']':
+                        depth -= 1
+                    elif depth == 0 and c in (b' ', b'(', b')', b'\r', b'\n'):
+                        break
+                    j += 1
+                yield chunk[i:j].decode('utf-8', errors='replace')
+                i = j
+
+
+def _parse_list(tokens):
+    """Build nested lists from tokens following an opening '('"""
+    items = []
+    for token in tokens:
+        if token == '(':
+            items.append(_parse_list(tokens))
+        elif token == ')':
+            return items
+        elif token == 'NIL':
+            items.append(None)
+        else:
+            items.append(token)
+    return items
+
+
+def parse_fetch_response(data):
+    """Parse imaplib FETCH data into {uid: {item name: value}}.
+
+    Values are nested lists for BODYSTRUCTURE, bytes for body sections and
+    strings for atoms; item names are upper-cased, e.g. 'BODY[1]<0>'.
+    """
+    messages = {}
+    tokens = _tokenize(data)
+    for token in tokens:
+        if token != '(':
+            continue
+        items = _parse_list(tokens)
+        fields = {}
+        for name, value in zip(items[::2], items[1::2]):
+            fields[name.upper() if isinstance(name, str) else name] = value
+        if 'UID' in fields:
+            messages[int(fields['UID'])] = fields
+    return messages
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return value.decode('utf-8', errors='replace') if isinstance(value, bytes) else value
+
+
+def _is_attachment(part, disposition_index):
+    disposition = part[disposition_index] if len(part) > disposition_index else None
+    return isinstance(disposition, list) and disposition and _text(disposition[0]).lower() == 'attachment'
+
+
+def find_text_part(bodystructure, prefer=('plain', 'html')):
+    """Locate the best inline text part in a BODYSTRUCTURE.
+
+    Returns (section, subtype, transfer_encoding, charset) or None. Plain
+    text is preferred over HTML; attachments and nested messages are skipped.
+    """
+    candidates = {}
+
+    def walk(part, section):
+        if part and isinstance(part[0], list):
+            # Body parts come first; the subtype ends them, and any lists
+            # after it are extension data (parameters, disposition, language)
+            children = []
+            for child in part:
+                if not isinstance(child, list):
+                    break
+                children.append(child)
+            for index, child in enumerate(children, 1):
+                walk(child, f'{section}.{index}' if section else str(index))
+            return
+        maintype, subtype = _text(part[0]).lower(), _text(part[1]).lower()
+        if maintype != 'text' or subtype in candidates or _is_attachment(part, 9):
+            return
+        params = part[2] or []
+        charset = None
+        for key, value in zip(params[::2], params[1::2]):
+            if _text(key).lower() == 'charset':
+                charset = _text(value)
+        encoding = _text(part[5] or '7bit').lower()
+        candidates[subtype] = (section or '1', subtype, encoding, charset)
+
+    walk(bodystructure, '')
+    for subtype in prefer:
+        if subtype in candidates:
+            return candidates[subtype]
+    return None
+
+
+def decode_partial(data, encoding, charset):
+    """Decode the leading bytes of a transfer-encoded body part.
+
+    Incomplete base64 quads, quoted-printable escapes and multi-byte
+    characters cut off at the end of the partial are dropped.
+    """
+    encoding = (encoding or '').lower()
+    if encoding == 'base64':
+        data = re.sub(rb'[^A-Za-z0-9+/=]', b'', data)
+        data = data[:len(data) - len(data) % 4]
+        try:
+            data = base64.b64decode(data)
+        except binascii.Error:
+            data = b''
+    elif encoding == 'quoted-printable':
+        cut = data.rfind(b'=', max(0, len(data) - 2))
+        if cut != -1:
+            data = data[:cut]
+        data = quopri.decodestring(data)
+
+    try:
+        decoder = codecs.getincrementaldecoder(charset or 'utf-8')(errors='replace')
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    return decoder.decode(data, final=False)
+
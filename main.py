@@ -4,6 +4,11 @@ from email_sender import EmailSender
 from email_monitor import EmailMonitor
 from database import EmailDatabase
 from scheduler import EmailScheduler
+from outbox import OutboxWorkers
+from search import EmailSearch
+
+# Background delivery for mail queued from the menu, started by main()
+delivery = None
 
 def print_menu():
     """Display main menu"""
@@ -16,19 +21,33 @@ def print_menu():
     print("4. Add Notification Rule")
     print("5. View Email Statistics")
     print("6. Schedule Tasks")
-    print("7. Exit")
+    print("7. Search Emails")
+    print("8. Exit")
     print("="*50)
 
+def start_delivery():
+    """Start the outbox workers, which also pick up mail queued by earlier runs"""
+    global delivery
+    if delivery is None:
+        delivery = OutboxWorkers(EmailSender()).start()
+    return delivery
+
+def stop_delivery():
+    """Stop the outbox workers; anything undelivered is sent on the next run"""
+    if delivery is not None:
+        delivery.stop()
+        delivery.sender.close()
+
 def send_single_email():
-    """Send a single email"""
-    sender = EmailSender()
+    """Queue a single email for background delivery"""
+    sender = start_delivery().sender
     
     to_email = input("Recipient email: ")
     subject = input("Subject: ")
     body = input("Body: ")
     html = input("Send as HTML? (y/n): ").lower() == 'y'
     
-    sender.send_email(to_email, subject, body, html=html)
+    sender.enqueue_email(to_email, subject, body, html=html)
 
 def send_bulk_emails():
     """Send bulk emails from CSV"""
@@ -36,10 +55,15 @@ def send_bulk_emails():
     
     csv_file = input("CSV file path: ")
     subject_template = input("Subject template (use {fieldname} for personalization): ")
-    body_template = input("Body template (use {fieldname} for personalization): ")
+    body_template_file = input("Body template file (leave empty to type the body): ").strip()
+    body_template = None
+    if not body_template_file:
+        body_template = input("Body template (use {fieldname} for personalization): ")
     html = input("Send as HTML? (y/n): ").lower() == 'y'
     
-    sender.send_bulk_emails(csv_file, subject_template, body_template, html=html)
+    sender.send_bulk_emails(csv_file, subject_template, body_template, html=html,
+                            body_template_file=body_template_file or None)
+    sender.close()
 
 def start_monitoring():
     """Start email monitoring"""
@@ -72,8 +96,37 @@ def view_statistics():
     print(f"Sent emails: {stats['sent']}")
     print(f"Failed emails: {stats['failed']}")
     print(f"Monitored emails: {stats['monitored']}")
+    outbox = db.get_outbox_counts()
+    print(f"Queued for delivery: {outbox.get('queued', 0) + outbox.get('sending', 0)}")
+    print(f"Undeliverable (dead-lettered): {outbox.get('dead', 0)}")
     print("="*50)
 
+def search_emails():
+    """Search monitored or sent emails, a page at a time"""
+    search = EmailSearch()
+    table = 'sent_emails' if input("Search sent emails instead of received? (y/n): ").lower() == 'y' else 'monitored_emails'
+    query = input("Search for: ")
+    
+    total = search.count(query, table=table)
+    pending = search.pending_backfill(table)
+    if pending:
+        print(f"Note: {pending} older email(s) are not indexed yet; run 'python search.py --backfill'")
+    if not total:
+        print("No matches found")
+        return
+    
+    page = 1
+    while True:
+        matches = search.search(query, table=table, page=page)
+        print(f"\n{total} match(es), page {page}:")
+        for match in matches:
+            address = match.get('sender') or match.get('recipient')
+            print(f"- [{match.get('received_at') or match.get('sent_at')}] {address}: {match['subject']}")
+            print(f"    {match['snippet']}")
+        if page * Config.SEARCH_PAGE_SIZE >= total or input("Next page? (y/n): ").lower() != 'y':
+            return
+        page += 1
+
 def schedule_tasks():
     """Schedule tasks"""
     scheduler = EmailScheduler()
@@ -82,6 +135,7 @@ def schedule_tasks():
     print("1. Schedule bulk email")
     print("2. Schedule email monitoring")
     print("3. Schedule weekly report")
+    print("4. Schedule log retention")
     
     choice = input("Select option: ")
     
@@ -104,6 +158,10 @@ def schedule_tasks():
         time_str = input("Time (HH:MM format, 24-hour): ")
         scheduler.schedule_weekly_report(day, time_str)
     
+    elif choice == '4':
+        time_str = input("Time (HH:MM format, 24-hour, default 03:00): ") or '03:00'
+        scheduler.schedule_retention(time_str)
+    
     scheduler.run()
 
 def main():
@@ -111,6 +169,7 @@ def main():
     try:
         # Validate configuration
         Config.validate()
+        start_delivery()
         
         while True:
             print_menu()
@@ -129,7 +188,10 @@ def main():
             elif choice == '6':
                 schedule_tasks()
             elif choice == '7':
+                search_emails()
+            elif choice == '8':
                 print("Exiting...")
+                stop_delivery()
                 sys.exit(0)
             else:
                 print("Invalid option. Please try again.")
@@ -140,6 +202,7 @@ def main():
         sys.exit(1)
     except KeyboardInterrupt:
         print("\n\nExiting...")
+        stop_delivery()
         sys.exit(0)
     except Exception as e:
         print(f"\nError: {e}")
@@ -0,0 +1,142 @@
+import base64
+import mmap
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from email.header import Header
+from email.mime.base import MIMEBase
+from email.mime.text import MIMEText
+
+# Files at least this large are memory-mapped and encoded a chunk at a time
+MMAP_THRESHOLD = 1024 * 1024
+# Multiple of 57 bytes, so each chunk encodes to whole 76-character lines
+_ENCODE_CHUNK = 57 * 1024
+CRLF = b'\r\n'
+
+
+def _encode_base64(data):
+    """Base64-encode a bytes-like object into CRLF-terminated 76-character lines"""
+    out = bytearray()
+    view = memoryview(data)
+    for start in range(0, len(view), _ENCODE_CHUNK):
+        out += base64.encodebytes(view[start:start + _ENCODE_CHUNK]).replace(b'\n', CRLF)
+    return bytes(out)
+
+
+def encode_attachment(path):
+    """Serialize a file as a base64 MIME attachment part, headers included"""
+    part = MIMEBase('application', 'octet-stream')
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(path))
+    headers = b''.join(f'{name}: {value}'.encode('utf-8') + CRLF for name, value in part.items())
+
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                body = _encode_base64(mapped)
+        else:
+            body = _encode_base64(file.read())
+    return headers + CRLF + body
+
+
+class AttachmentCache:
+    """Encoded attachment parts shared across messages.
+
+    Entries are keyed by path, mtime and size, so a file edited mid-campaign
+    is re-encoded rather than served stale. Least recently used entries are
+    evicted once the encoded bytes held exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Return the encoded part for a file, encoding it on first use"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            encoded = self._entries.get(key)
+            if encoded is not None:
+                self._entries.move_to_end(key)
+                return encoded
+
+        encoded = encode_attachment(path)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = encoded
+                self._size += len(encoded)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return encoded
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class SerializedMessage:
+    """A message already flattened to wire format, ready for sendmail.
+
+    The wire format is kept as (chunk, stuff) pairs: per-message bytes that
+    still need SMTP dot-stuffing, and cached attachment parts that don't.
+    The cached parts are referenced, not copied.
+    """
+
+    def __init__(self, from_addr, to_addrs, chunks):
+        self.from_addr = from_addr
+        self.to_addrs = to_addrs
+        self.chunks = chunks
+
+    @property
+    def data(self):
+        return b''.join(chunk for chunk, _ in self.chunks)
+
+    def as_bytes(self):
+        return self.data
+
+
+def _header(name, value):
+    encoded = Header(value, header_name=name).encode(linesep='\r\n')
+    return f'{name}: {encoded}'.encode('ascii') + CRLF
+
+
+def serialize_message(from_addr, to_addr, subject, body, html=False, attachments=(), envelope=None):
+    """Flatten a multipart message from personalized fields and pre-encoded parts.
+
+    Only the headers and the text part are built per message; attachment
+    parts are referenced as already-encoded bytes, in chunks of their own.
+    envelope overrides the recipients the message is delivered to, which
+    default to to_addr.
+    """
+    boundary = f'=_{uuid.uuid4().hex}'
+    text = MIMEText(body, 'html' if html else 'plain')
+    chunks = []
+    out = [
+        b'Content-Type: multipart/mixed; boundary="' + boundary.encode('ascii') + b'"' + CRLF,
+        b'MIME-Version: 1.0' + CRLF,
+        _header('From', from_addr or ''),
+        _header('To', to_addr),
+        _header('Subject', subject),
+        CRLF,
+    ]
+    delimiter = b'--' + boundary.encode('ascii')
+    text_part = text.as_bytes(policy=text.policy.clone(linesep='\r\n'))
+    out += [delimiter, CRLF, text_part]
+    if not text_part.endswith(CRLF):
+        out.append(CRLF)
+    for part in attachments:
+        # Base64 parts never have a line starting with '.', so they skip dot-stuffing
+        out += [delimiter, CRLF]
+        chunks += [(b''.join(out), True), (part, False)]
+        out = [] if part.endswith(CRLF) else [CRLF]
+    out += [delimiter, b'--', CRLF]
+    chunks.append((b''.join(out), True))
+    return SerializedMessage(from_addr, list(envelope or [to_addr]), chunks)
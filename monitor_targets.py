@@ -0,0 +1,36 @@
+import json
+from config import Config
+
+
+class MonitorTarget:
+    """One IMAP account and the folders to watch in it"""
+
+    def __init__(self, account=None, password=None, server=None, port=None, use_ssl=None, folders=None):
+        self.account = account or Config.EMAIL_ADDRESS
+        self.password = password or Config.EMAIL_PASSWORD
+        self.server = server or Config.IMAP_SERVER
+        self.port = int(port or Config.IMAP_PORT)
+        self.use_ssl = Config.IMAP_USE_SSL if use_ssl is None else use_ssl
+        self.folders = list(folders or ['INBOX'])
+
+    def __repr__(self):
+        return f"MonitorTarget({self.account}@{self.server}, folders={self.folders})"
+
+
+def default_targets():
+    """The single account configured in .env, watching INBOX"""
+    return [MonitorTarget()]
+
+
+def load_monitor_targets(path=None):
+    """Load targets from a JSON list of account objects.
+
+    Each object may set account, password, server, port, use_ssl and
+    folders; anything left out falls back to the .env settings. Without a
+    targets file, the single configured account is watched.
+    """
+    path = path or Config.MONITOR_TARGETS_FILE
+    if not path:
+        return default_targets()
+    with open(path, 'r', encoding='utf-8') as file:
+        return [MonitorTarget(**entry) for entry in json.load(file)]
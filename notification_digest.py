@@ -0,0 +1,153 @@
+import threading
+import time
+from config import Config
+
+
+class NotificationDigest:
+    """Buffers rule matches and sends one alert per rule per window.
+
+    Matches are held per rule until the rule's oldest buffered match is
+    window seconds old or max_items have built up, then flushed as a single
+    digest alert. Flushing runs on a background thread so the fetch loop
+    only appends to a list; with a window of 0, each match gets its own
+    alert. Buffered matches are also kept in the digest_entries table and
+    reloaded by start(), so a crash or restart doesn't lose them.
+    """
+
+    def __init__(self, sender, db, window=None, max_items=None):
+        self.sender = sender
+        self.db = db
+        self.window = Config.NOTIFICATION_DIGEST_WINDOW if window is None else window
+        self.max_items = max(1, max_items or Config.NOTIFICATION_DIGEST_MAX)
+        self._buffers = {}
+        self._opened = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, rule_name, email_id, sender, subject, body, mailbox=None):
+        """Buffer one matching email for a rule's next digest"""
+        self.db.add_digest_entry(rule_name, email_id, mailbox)
+        with self._lock:
+            entries = self._buffers.setdefault(rule_name, [])
+            if not entries:
+                self._opened[rule_name] = time.monotonic()
+            entries.append((email_id, sender, subject, body, mailbox))
+            full = len(entries) >= self.max_items
+        if self.window <= 0 or (full and self._thread is None):
+            self.flush(rule_name)
+        elif full:
+            self._wakeup.set()
+
+    def _take(self, rule_names):
+        """Remove and return the buffered entries of the given rules"""
+        with self._lock:
+            taken = [(name, self._buffers.pop(name)) for name in rule_names if self._buffers.get(name)]
+            for name, _ in taken:
+                self._opened.pop(name, None)
+        return taken
+
+    def flush(self, rule_name=None):
+        """Send the digest for one rule, or for every rule with buffered matches"""
+        with self._lock:
+            names = [rule_name] if rule_name else list(self._buffers)
+        for name, entries in self._take(names):
+            self._send(name, entries)
+
+    def flush_due(self):
+        """Send digests whose window has passed or that are full"""
+        now = time.monotonic()
+        with self._lock:
+            names = [
+                name for name, entries in self._buffers.items()
+                if len(entries) >= self.max_items or now - self._opened[name] >= self.window
+            ]
+        for name, entries in self._take(names):
+            self._send(name, entries)
+
+    def restore(self):
+        """Buffer matches persisted by an earlier run that weren't sent; returns how many"""
+        restored = 0
+        now = time.monotonic()
+        with self._lock:
+            buffered = {(name, entry[0]) for name, entries in self._buffers.items() for entry in entries}
+            for rule_name, email_id, sender, subject, body, mailbox in self.db.get_digest_entries():
+                if (rule_name, email_id) in buffered:
+                    continue
+                entries = self._buffers.setdefault(rule_name, [])
+                if not entries:
+                    self._opened[rule_name] = now
+                entries.append((email_id, sender, subject, body, mailbox))
+                restored += 1
+        return restored
+
+    @property
+    def running(self):
+        """Whether the background flusher is running"""
+        return self._thread is not None
+
+    def pending(self):
+        """Number of buffered matches across all rules"""
+        with self._lock:
+            return sum(len(entries) for entries in self._buffers.values())
+
+    def _send(self, rule_name, entries):
+        """Queue one alert covering entries; their emails are marked notified on delivery"""
+        if len(entries) == 1:
+            _, sender, subject, body, mailbox = entries[0]
+            alert_subject = f"Email Alert: {rule_name}"
+            alert_body = f"""
+New email matching notification rule: {rule_name}
+
+Mailbox: {mailbox or 'INBOX'}
+From: {sender}
+Subject: {subject}
+
+Preview:
+{body[:200]}...
+            """
+        else:
+            alert_subject = f"Email Alert: {rule_name} ({len(entries)} new emails)"
+            lines = [f"{len(entries)} new emails matched notification rule: {rule_name}", ""]
+            for _, sender, subject, body, mailbox in entries:
+                lines += [
+                    f"Mailbox: {mailbox or 'INBOX'}",
+                    f"From: {sender}",
+                    f"Subject: {subject}",
+                    f"Preview: {' '.join(body[:100].split())}...",
+                    ""
+                ]
+            alert_body = '\n'.join(lines)
+
+        email_ids = [entry[0] for entry in entries]
+        self.sender.queue_notification(alert_subject, alert_body, email_ids=email_ids)
+        self.db.remove_digest_entries(rule_name, email_ids)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(min(self.window, 1.0))
+            self._wakeup.clear()
+            self.flush_due()
+
+    def start(self):
+        """Reload persisted matches and start flushing due digests in the background"""
+        restored = self.restore()
+        if restored:
+            print(f"Restored {restored} pending alert(s)")
+        if self.window <= 0:
+            self.flush()
+        elif self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the background flusher and send whatever is still buffered"""
+        if self._thread is not None:
+            self._stop.set()
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
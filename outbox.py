@@ -0,0 +1,136 @@
+import random
+import re
+import smtplib
+import sqlite3
+import threading
+import time
+from config import Config
+from smtp_batch import chunked
+
+_REPLY_CODE = re.compile(r'^\s*(\d{3})\b')
+
+
+def reply_code(error):
+    """Extract the SMTP reply code from an error string, or None"""
+    match = _REPLY_CODE.match(error or '')
+    return int(match.group(1)) if match else None
+
+
+def retry_delay(attempts, base, maximum):
+    """Exponential backoff for the given attempt number, with jitter.
+
+    The delay doubles per attempt up to maximum, and a random point in its
+    upper half is chosen so messages deferred together don't retry together.
+    """
+    delay = min(maximum, base * 2 ** max(0, attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class OutboxWorkers:
+    """Background threads delivering mail queued in the outbox table.
+
+    Each worker claims a batch of due messages, sends identical ones in
+    shared envelopes, and records every recipient's outcome: delivered
+    mail is logged to sent_emails, 4xx replies and connection errors are
+    retried with backoff, and 5xx replies are dead-lettered. A claim is a
+    lease, so messages held by a worker that died are picked up again.
+    """
+
+    def __init__(self, sender, workers=None, batch_size=None, max_attempts=None, poll_interval=None):
+        self.sender = sender
+        self.db = sender.db
+        self.workers = max(1, workers or Config.OUTBOX_WORKERS)
+        self.batch_size = max(1, batch_size or Config.OUTBOX_BATCH_SIZE)
+        self.max_attempts = max_attempts or Config.OUTBOX_MAX_ATTEMPTS
+        self.poll_interval = Config.OUTBOX_POLL_INTERVAL if poll_interval is None else poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start the delivery threads"""
+        if self._threads:
+            return self
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Stop the delivery threads; undelivered mail stays queued for next time"""
+        self._stop.set()
+        self.sender.outbox_wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                handled = self.process_once()
+            except sqlite3.Error as e:
+                print(f"Failed to read the outbox: {e}")
+                handled = 0
+            if not handled:
+                self.sender.outbox_wakeup.wait(self.poll_interval)
+                self.sender.outbox_wakeup.clear()
+
+    def run_pending(self):
+        """Deliver everything currently due on the calling thread; returns the count handled"""
+        total = 0
+        while True:
+            handled = self.process_once()
+            if not handled:
+                return total
+            total += handled
+
+    def process_once(self):
+        """Claim one batch of due messages and deliver it"""
+        claimed = self.db.claim_outbox(self.batch_size, Config.OUTBOX_LEASE)
+        groups = {}
+        for row in claimed:
+            _, _, subject, body, html, attachments, _ = row
+            groups.setdefault((subject, body, html, tuple(attachments or ())), []).append(row)
+
+        for (subject, body, html, attachments), rows in groups.items():
+            for envelope in chunked(rows, Config.SMTP_MAX_RECIPIENTS):
+                self._deliver(envelope, subject, body, html, list(attachments))
+        self.db.flush()
+        return len(claimed)
+
+    def _deliver(self, rows, subject, body, html, attachments):
+        recipients = [row[1] for row in rows]
+        try:
+            msg = self.sender._build_message(recipients, subject, body, html=html, attachments=attachments)
+            results = self.sender._deliver(msg)
+        except smtplib.SMTPAuthenticationError as e:
+            # Bad credentials aren't the message's fault; keep it queued
+            results = {rcpt: f"Authentication failed: {e}" for rcpt in recipients}
+        except smtplib.SMTPResponseException as e:
+            error = e.smtp_error.decode('utf-8', errors='replace') if isinstance(e.smtp_error, bytes) else e.smtp_error
+            results = {rcpt: f"{e.smtp_code} {error}" for rcpt in recipients}
+        except Exception as e:
+            results = {rcpt: str(e) or e.__class__.__name__ for rcpt in recipients}
+
+        for row in rows:
+            self._record(row, results.get(row[1]))
+
+    def _record(self, row, error):
+        """Apply one recipient's outcome to its outbox entry"""
+        outbox_id, recipient, subject, _, _, _, attempts = row
+        if error is None:
+            self.db.complete_outbox(outbox_id)
+            self.db.log_sent_email(recipient, subject, status='sent', sync=False)
+            print(f"Email sent successfully to {recipient}")
+            return
+
+        code = reply_code(error)
+        if (code is not None and 500 <= code < 600) or attempts >= self.max_attempts:
+            self.db.dead_letter_outbox(outbox_id, error)
+            self.db.log_sent_email(recipient, subject, status='failed', error_message=error, sync=False)
+            print(f"Failed to send email to {recipient}: {error}")
+            return
+
+        delay = retry_delay(attempts, Config.OUTBOX_RETRY_BASE, Config.OUTBOX_RETRY_MAX)
+        self.db.retry_outbox(outbox_id, error, time.time() + delay)
+        print(f"Delivery to {recipient} deferred (attempt {attempts}), retrying in {delay:.0f}s: {error}")
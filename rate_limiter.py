@@ -0,0 +1,65 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket that paces callers to a steady rate.
+
+    The default capacity of one token allows no bursts, so the rate is never
+    exceeded over any window. Requests for more tokens than the capacity
+    wait for a full bucket and then leave it in debt, so later callers wait
+    until the whole request has been paid for.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        """Add the tokens earned since the last refill"""
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if they are available right now"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= min(tokens, self.capacity):
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available, then take them"""
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                needed = min(tokens, self.capacity)
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(host, rate):
+    """Return the shared limiter for an SMTP host, or None when unlimited.
+
+    Every sender in the process that talks to the same host draws from the
+    same bucket, so the provider quota holds across senders and workers.
+    """
+    if not rate or rate <= 0:
+        return None
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None or limiter.rate != float(rate):
+            limiter = TokenBucket(rate)
+            _limiters[host] = limiter
+        return limiter
@@ -0,0 +1,85 @@
+import csv
+import gzip
+import hashlib
+import json
+import string
+from email.utils import parseaddr
+
+# ASCII-only, to match SQLite's lower() used by the bounce trigger
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _open_text(path):
+    """Open a recipient file as text, transparently un-gzipping .gz files"""
+    if path.lower().endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def recipient_format(path):
+    """Return 'jsonl' or 'csv' based on the file name"""
+    name = path.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    if name.endswith('.jsonl') or name.endswith('.ndjson'):
+        return 'jsonl'
+    return 'csv'
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 of a file's raw bytes, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_recipients(path, start_row=0):
+    """Yield (row_index, row) pairs from a CSV, JSONL or gzip'd recipient file.
+
+    Rows are read lazily one at a time; rows before start_row are skipped
+    without being parsed into dicts where the format allows it.
+    """
+    with _open_text(path) as file:
+        if recipient_format(path) == 'jsonl':
+            row_index = 0
+            for line in file:
+                if not line.strip():
+                    continue
+                if row_index >= start_row:
+                    yield row_index, json.loads(line)
+                row_index += 1
+        else:
+            reader = csv.DictReader(file)
+            for row_index, row in enumerate(reader):
+                if row_index >= start_row:
+                    yield row_index, row
+
+
+def read_fieldnames(path):
+    """Return the column names of a recipient file without reading it all.
+
+    For CSV this is the header row; for JSONL, the keys of the first record
+    only. A later record missing one of them is caught when it is rendered,
+    and that row alone is logged as failed.
+    """
+    with _open_text(path) as file:
+        if recipient_format(path) == 'jsonl':
+            for line in file:
+                if line.strip():
+                    return list(json.loads(line))
+            return []
+        return csv.DictReader(file).fieldnames or []
+
+
+def normalize_address(address):
+    """Reduce an address to the form used for dedup and suppression.
+
+    Display names and surrounding whitespace are dropped and ASCII letters
+    lower-cased, so 'Ann <Ann@Example.com>' and 'ann@example.com' match.
+    """
+    address = (address or '').strip()
+    if '<' in address:
+        address = parseaddr(address)[1] or address
+    return address.strip().translate(_ASCII_LOWER)
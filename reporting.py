@@ -0,0 +1,204 @@
+import argparse
+import csv
+import gzip
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+from database import EmailDatabase
+
+# Columns exported for each log table, in output order
+LOG_COLUMNS = {
+    'sent_emails': ('id', 'recipient', 'subject', 'sent_at', 'status', 'error_message', 'campaign_id'),
+    'monitored_emails': ('id', 'sender', 'subject', 'received_at', 'body_preview', 'notification_sent'),
+}
+_TIME_COLUMNS = {'sent_emails': 'sent_at', 'monitored_emails': 'received_at'}
+
+
+def _timestamp(value):
+    """Format a bound the way SQLite's CURRENT_TIMESTAMP stores times (UTC)"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value.strftime('%Y-%m-%d 00:00:00')
+
+
+def _day(value):
+    return _timestamp(value)[:10] if value is not None else None
+
+
+def last_days(days, today=None):
+    """Return (since, until) covering the last N whole days, today included (UTC)"""
+    today = today or datetime.now(timezone.utc).date()
+    return today - timedelta(days=days - 1), today + timedelta(days=1)
+
+
+class EmailReports:
+    """Windowed report queries and streaming exports over the email logs.
+
+    Windows are half-open, [since, until), and take dates, datetimes or
+    'YYYY-MM-DD[ HH:MM:SS]' strings in UTC; either end may be left open.
+    """
+
+    def __init__(self, db=None):
+        self.db = db or EmailDatabase()
+
+    def summary(self, since=None, until=None):
+        """Sent, failed and monitored counts for a window, from the daily rollup.
+
+        The rollup is kept per UTC day, so the window is taken in whole days.
+        """
+        last_day = None
+        if until is not None:
+            last_day = (datetime.strptime(_day(until), '%Y-%m-%d').date() - timedelta(days=1)).isoformat()
+        totals = {'sent': 0, 'failed': 0, 'monitored': 0}
+        for counts in self.db.get_daily_stats(since=_day(since), until=last_day).values():
+            for category, count in counts.items():
+                totals[category] = totals.get(category, 0) + count
+        return totals
+
+    def _window(self, column, since, until):
+        """SQL condition and params limiting a time column to [since, until)"""
+        conditions, params = ['1'], ()
+        if since is not None:
+            conditions.append(f'{column} >= ?')
+            params += (_timestamp(since),)
+        if until is not None:
+            conditions.append(f'{column} < ?')
+            params += (_timestamp(until),)
+        return ' AND '.join(conditions), params
+
+    def top_failing_recipients(self, since=None, until=None, limit=10):
+        """Recipients with the most failed sends in a window, as (recipient, failures)"""
+        where, params = self._window('sent_at', since, until)
+        return self._query(f'''
+            SELECT recipient, COUNT(*) AS failures FROM sent_emails
+            WHERE status = 'failed' AND {where}
+            GROUP BY recipient
+            ORDER BY failures DESC, recipient
+            LIMIT ?
+        ''', params + (limit,))
+
+    def error_breakdown(self, since=None, until=None, limit=10):
+        """Most common failure messages in a window, as (error_message, count)"""
+        where, params = self._window('sent_at', since, until)
+        return self._query(f'''
+            SELECT COALESCE(error_message, ''), COUNT(*) AS occurrences FROM sent_emails
+            WHERE status = 'failed' AND {where}
+            GROUP BY 1
+            ORDER BY occurrences DESC
+            LIMIT ?
+        ''', params + (limit,))
+
+    def _query(self, sql, params):
+        self.db.flush()
+        with self.db.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def iter_rows(self, table='sent_emails', since=None, until=None, status=None, page_size=1000):
+        """Yield log rows as dicts in time order, one keyset page at a time.
+
+        Each page resumes after the last (time, id) seen, using the time
+        index, so memory use and per-page cost stay flat however large the
+        window is.
+        """
+        columns = LOG_COLUMNS[table]
+        time_column = _TIME_COLUMNS[table]
+        where, window = self._window(time_column, since, until)
+        if status is not None:
+            if table != 'sent_emails':
+                raise ValueError("status filter only applies to sent_emails")
+            where += ' AND status = ?'
+            window += (status,)
+
+        self.db.flush()
+        with self.db.connection() as conn:
+            last = None
+            while True:
+                keyset = f'AND ({time_column}, id) > (?, ?)' if last else ''
+                rows = conn.execute(f'''
+                    SELECT {', '.join(columns)} FROM {table}
+                    WHERE {where} {keyset}
+                    ORDER BY {time_column}, id
+                    LIMIT ?
+                ''', window + (last or ()) + (page_size,)).fetchall()
+                for row in rows:
+                    yield dict(zip(columns, row))
+                if len(rows) < page_size:
+                    return
+                last = (rows[-1][columns.index(time_column)], rows[-1][0])
+
+    def export(self, output, fmt='csv', table='sent_emails', since=None, until=None, status=None, page_size=1000):
+        """Stream log rows to a CSV or JSONL file (gzip'd if it ends in .gz) and return the count.
+
+        output may also be an open text file.
+        """
+        if fmt not in ('csv', 'jsonl'):
+            raise ValueError(f"Unknown export format: {fmt}")
+        rows = self.iter_rows(table, since=since, until=until, status=status, page_size=page_size)
+
+        if isinstance(output, str):
+            opener = gzip.open if output.lower().endswith('.gz') else open
+            with opener(output, 'wt', encoding='utf-8', newline='') as file:
+                return self._write(file, fmt, table, rows)
+        return self._write(output, fmt, table, rows)
+
+    def _write(self, file, fmt, table, rows):
+        count = 0
+        if fmt == 'csv':
+            writer = csv.DictWriter(file, fieldnames=LOG_COLUMNS[table])
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                file.write(json.dumps(row) + '\n')
+                count += 1
+        return count
+
+    def weekly_report(self, today=None):
+        """Plain-text report for the last 7 days"""
+        since, until = last_days(7, today)
+        totals = self.summary(since, until)
+        lines = [
+            f"Email Statistics for {since.isoformat()} to {(until - timedelta(days=1)).isoformat()}:",
+            "",
+            f"Sent: {totals['sent']}",
+            f"Failed: {totals['failed']}",
+            f"Monitored: {totals['monitored']}",
+        ]
+        failing = self.top_failing_recipients(since, until, limit=5)
+        if failing:
+            lines += ["", "Top failing recipients:"]
+            lines += [f"  {recipient}: {failures}" for recipient, failures in failing]
+        errors = self.error_breakdown(since, until, limit=5)
+        if errors:
+            lines += ["", "Most common errors:"]
+            lines += [f"  {count} x {message or '(no message)'}" for message, count in errors]
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    """Export email logs from the command line without loading them into memory"""
+    parser = argparse.ArgumentParser(description="Export email log rows for a time window")
+    parser.add_argument('--table', choices=sorted(LOG_COLUMNS), default='sent_emails')
+    parser.add_argument('--since', help="Start of the window, inclusive (YYYY-MM-DD[ HH:MM:SS], UTC)")
+    parser.add_argument('--until', help="End of the window, exclusive")
+    parser.add_argument('--days', type=int, help="Last N days instead of --since/--until")
+    parser.add_argument('--status', help="Only sent_emails rows with this status")
+    parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+    parser.add_argument('--output', default='-', help="Output file (.gz to compress); '-' for stdout")
+    args = parser.parse_args(argv)
+
+    since, until = (last_days(args.days) if args.days else (args.since, args.until))
+    reports = EmailReports()
+    output = sys.stdout if args.output == '-' else args.output
+    count = reports.export(output, fmt=args.format, table=args.table, since=since, until=until, status=args.status)
+    print(f"Exported {count} row(s)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import argparse
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from config import Config
+from database import EmailDatabase
+
+# Ids bound per DELETE statement, so a RETENTION_CHUNK_SIZE above SQLite's
+# parameter limit (SQLITE_MAX_VARIABLE_NUMBER) still deletes
+DELETE_BATCH = 500
+
+# Table, timestamp column, extra condition on which rows may be removed,
+# and the Config setting holding its TTL in days
+RETENTION_TABLES = (
+    ('sent_emails', 'sent_at', '', 'RETENTION_SENT_DAYS'),
+    ('monitored_emails', 'received_at', '', 'RETENTION_MONITORED_DAYS'),
+    ('outbox', 'updated_at', "AND status IN ('sent', 'dead')", 'RETENTION_OUTBOX_DAYS'),
+)
+
+
+class LogRetention:
+    """Archives and removes log rows older than each table's TTL.
+
+    Expired rows are appended to gzip'd JSONL files, one per table and
+    month (archive_dir/<table>/<table>-YYYY-MM.jsonl.gz), and deleted from
+    the live database a chunk at a time. Every chunk is its own short
+    transaction, so other writers only ever wait for one chunk. Freed pages
+    are then returned to the filesystem with incremental vacuum.
+    Databases created before incremental auto-vacuum was enabled have to
+    be converted once with enable_incremental_vacuum() first.
+    """
+
+    def __init__(self, db=None, archive_dir=None, chunk_size=None):
+        self.db = db or EmailDatabase()
+        self.archive_dir = archive_dir or Config.ARCHIVE_DIR
+        self.chunk_size = max(1, chunk_size or Config.RETENTION_CHUNK_SIZE)
+
+    def run(self, now=None):
+        """Apply every table's TTL; returns {table: rows archived}"""
+        now = now or datetime.now(timezone.utc)
+        archived = {}
+        for table, time_column, condition, setting in RETENTION_TABLES:
+            days = getattr(Config, setting)
+            if days <= 0:
+                continue
+            cutoff = (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+            archived[table] = self.archive_table(table, time_column, cutoff, condition)
+        self.vacuum()
+        return archived
+
+    def archive_table(self, table, time_column, cutoff, condition=''):
+        """Archive and delete rows older than cutoff, chunk by chunk"""
+        self.db.flush()
+        total = 0
+        while True:
+            with self.db.connection() as conn:
+                cursor = conn.execute(f'''
+                    SELECT * FROM {table}
+                    WHERE {time_column} < ? {condition}
+                    ORDER BY {time_column}, id
+                    LIMIT ?
+                ''', (cutoff, self.chunk_size))
+                columns = [description[0] for description in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            if not rows:
+                return total
+
+            # Archive first: a crash before the delete leaves the rows in
+            # place to be archived again, never deleted unarchived
+            self._append_archive(table, time_column, rows)
+            ids = [row['id'] for row in rows]
+            self.db.writer.execute_all([
+                (f"DELETE FROM {table} WHERE id IN ({', '.join('?' * len(batch))})", tuple(batch))
+                for batch in (ids[start:start + DELETE_BATCH] for start in range(0, len(ids), DELETE_BATCH))
+            ])
+            total += len(rows)
+
+    def _append_archive(self, table, time_column, rows):
+        """Append rows to their monthly archives and sync them to disk"""
+        by_month = {}
+        for row in rows:
+            by_month.setdefault((row[time_column] or 'unknown')[:7], []).append(row)
+
+        directory = os.path.join(self.archive_dir, table)
+        os.makedirs(directory, exist_ok=True)
+        for month, month_rows in by_month.items():
+            path = os.path.join(directory, f'{table}-{month}.jsonl.gz')
+            # Appending adds a gzip member; gzip readers see one stream
+            with open(path, 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb') as file:
+                    for row in month_rows:
+                        file.write(json.dumps(row).encode('utf-8') + b'\n')
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    def vacuum(self, pages=None):
+        """Return free pages to the filesystem a batch at a time.
+
+        Only incremental vacuum is run, so writers wait for at most one
+        batch. Databases without incremental auto-vacuum are left alone and
+        a message says to convert them with enable_incremental_vacuum().
+        """
+        pages = pages or Config.RETENTION_VACUUM_PAGES
+        self.db.flush()
+        # A dedicated connection: PRAGMAs that free pages can't run inside a
+        # pooled connection's open transaction
+        conn = self.db.get_connection()
+        try:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                print("Freed space can't be reclaimed: incremental auto-vacuum is off for this "
+                      "database. Convert it once with `python retention.py --enable-incremental-vacuum`.")
+                return
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            while free > 0:
+                conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+                remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if remaining >= free:
+                    break
+                free = remaining
+        finally:
+            conn.close()
+
+    def enable_incremental_vacuum(self):
+        """Switch an older database to incremental auto-vacuum; returns False if it already was.
+
+        This runs a full VACUUM, which rewrites the whole file: writers are
+        locked out until it finishes and it needs free disk space of about
+        twice the database size. Run it once, at a quiet time.
+        """
+        self.db.flush()
+        conn = self.db.get_connection()
+        try:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                return False
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            return True
+        finally:
+            conn.close()
+
+
+def main(argv=None):
+    """Archive expired log rows, or convert the database to incremental vacuum"""
+    parser = argparse.ArgumentParser(description="Archive and delete log rows past their retention period")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="One-off: convert an older database with a full VACUUM (blocks writers)")
+    args = parser.parse_args(argv)
+
+    retention = LogRetention()
+    if args.enable_incremental_vacuum:
+        if retention.enable_incremental_vacuum():
+            print("Database converted to incremental auto-vacuum")
+        else:
+            print("Incremental auto-vacuum is already enabled")
+        return
+    for table, count in retention.run().items():
+        print(f"Archived {count} row(s) from {table}")
+
+
+if __name__ == '__main__':
+    main()
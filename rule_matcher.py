@@ -0,0 +1,97 @@
+class AhoCorasick:
+    """Multi-pattern substring matcher that scans text once for all patterns"""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+
+        for pattern_id, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][ch] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                state = next_state
+            self._output[state] += (pattern_id,)
+
+        # Breadth-first pass to link each state to its longest proper suffix
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(ch, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def search(self, text):
+        """Return the ids of every pattern that occurs in text"""
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+class RuleMatcher:
+    """Notification rules compiled into one automaton per filtered field.
+
+    A rule matches when every filter it sets occurs, case-insensitively, in
+    its field. Each field is scanned once per message no matter how many
+    rules there are; matched filters are then counted against each rule.
+    """
+
+    FIELDS = ('sender', 'subject', 'body')
+
+    def __init__(self, rules):
+        self._names = []
+        self._required = []
+        self._always = []
+        self._automata = {}
+        self._pattern_rules = {}
+
+        patterns = {field: {} for field in self.FIELDS}
+        for index, (rule_id, rule_name, sender_filter, subject_filter, keyword_filter) in enumerate(rules):
+            self._names.append(rule_name)
+            filters = zip(self.FIELDS, (sender_filter, subject_filter, keyword_filter))
+            required = 0
+            for field, value in filters:
+                if not value:
+                    continue
+                pattern_id = patterns[field].setdefault(value.lower(), len(patterns[field]))
+                self._pattern_rules.setdefault((field, pattern_id), []).append(index)
+                required += 1
+            self._required.append(required)
+            if not required:
+                self._always.append(index)
+
+        for field, field_patterns in patterns.items():
+            if field_patterns:
+                self._automata[field] = AhoCorasick(list(field_patterns))
+
+    def __len__(self):
+        return len(self._names)
+
+    def match(self, sender, subject, body):
+        """Return the names of matching rules, in rule order"""
+        texts = {'sender': sender, 'subject': subject, 'body': body}
+        hits = {}
+        for field, automaton in self._automata.items():
+            for pattern_id in automaton.search((texts[field] or '').lower()):
+                for index in self._pattern_rules[(field, pattern_id)]:
+                    hits[index] = hits.get(index, 0) + 1
+
+        matched = [index for index, count in hits.items() if count == self._required[index]]
+        matched.extend(self._always)
+        return [self._names[index] for index in sorted(matched)]
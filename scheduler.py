@@ -1,61 +1,85 @@
-import schedule
-import time
 from email_sender import EmailSender
 from email_monitor import EmailMonitor
+from scheduling import JobScheduler, DailyTrigger, WeeklyTrigger, IntervalTrigger
 
 class EmailScheduler:
-    """Schedule email sending and monitoring tasks"""
+    """Schedule email sending and monitoring tasks
+    
+    Jobs are kept in the database, so ones scheduled by an earlier run are
+    restored (and any runs missed while stopped are caught up) when the
+    scheduler starts. Each job runs on a worker thread, so a long bulk send
+    doesn't hold up monitoring.
+    """
     
     def __init__(self):
         self.sender = EmailSender()
         self.monitor = EmailMonitor()
+        self.engine = JobScheduler(self.sender.db, {
+            'bulk_email': self._bulk_email_job,
+            'email_monitoring': self._monitoring_job,
+            'weekly_report': self._weekly_report_job,
+            'log_retention': self._retention_job,
+        })
+        restored = self.engine.load_jobs()
+        if restored:
+            print(f"Restored {restored} scheduled job(s)")
     
     def schedule_bulk_email(self, csv_file, subject_template, body_template, time_str, html=False):
         """Schedule bulk email sending at specific time"""
-        def job():
-            print(f"\nExecuting scheduled bulk email task at {time_str}")
-            self.sender.send_bulk_emails(csv_file, subject_template, body_template, html=html)
-        
-        schedule.every().day.at(time_str).do(job)
+        self.engine.add_job(
+            f"bulk_email {csv_file} {time_str}", 'bulk_email', DailyTrigger(time_str),
+            {'csv_file': csv_file, 'subject_template': subject_template,
+             'body_template': body_template, 'html': html, 'time_str': time_str}
+        )
         print(f"Scheduled bulk email task for {time_str} daily")
     
     def schedule_email_monitoring(self, interval_minutes=5):
         """Schedule periodic email monitoring"""
-        def job():
-            self.monitor.monitor_inbox()
-        
-        schedule.every(interval_minutes).minutes.do(job)
+        self.engine.add_job('email_monitoring', 'email_monitoring', IntervalTrigger(interval_minutes * 60))
         print(f"Scheduled email monitoring every {interval_minutes} minutes")
     
     def schedule_weekly_report(self, day, time_str):
         """Schedule weekly email statistics report"""
-        def job():
-            from database import EmailDatabase
-            db = EmailDatabase()
-            stats = db.get_email_stats()
-            
-            subject = "Weekly Email Report"
-            body = f"""
-Weekly Email Statistics:
-
-Sent: {stats['sent']}
-Failed: {stats['failed']}
-Monitored: {stats['monitored']}
-            """
-            
-            self.sender.send_notification(subject, body)
-        
-        getattr(schedule.every(), day.lower()).at(time_str).do(job)
+        self.engine.add_job('weekly_report', 'weekly_report', WeeklyTrigger(day, time_str))
         print(f"Scheduled weekly report for {day} at {time_str}")
     
+    def schedule_retention(self, time_str='03:00'):
+        """Schedule daily archival of log rows past their retention period"""
+        self.engine.add_job('log_retention', 'log_retention', DailyTrigger(time_str), {'time_str': time_str})
+        print(f"Scheduled log retention for {time_str} daily")
+    
+    def _bulk_email_job(self, csv_file, subject_template, body_template, html=False, time_str=None):
+        print(f"\nExecuting scheduled bulk email task at {time_str}")
+        self.sender.send_bulk_emails(csv_file, subject_template, body_template, html=html)
+    
+    def _monitoring_job(self):
+        self.monitor.monitor_targets()
+    
+    def _weekly_report_job(self):
+        from reporting import EmailReports
+        subject = "Weekly Email Report"
+        body = EmailReports(self.sender.db).weekly_report()
+        
+        self.sender.send_notification(subject, body)
+    
+    def _retention_job(self, time_str=None):
+        from retention import LogRetention
+        print(f"\nRunning log retention at {time_str}")
+        archived = LogRetention(self.sender.db).run()
+        for table, count in archived.items():
+            print(f"Archived {count} row(s) from {table}")
+    
     def run(self):
         """Start the scheduler"""
         print("Starting scheduler...")
         print("Press Ctrl+C to stop")
         
+        # Scheduled monitoring queues its alerts; deliver them in the background
+        self.monitor.start_alerts()
         try:
-            while True:
-                schedule.run_pending()
-                time.sleep(1)
+            self.engine.run()
         except KeyboardInterrupt:
-            print("\nScheduler stopped")
\ No newline at end of file
+            print("\nScheduler stopped")
+        finally:
+            self.engine.stop()
+            self.monitor.stop_alerts()
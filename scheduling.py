@@ -0,0 +1,249 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from config import Config
+
+DAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+# Longest single sleep; the wall clock can jump (suspend, NTP) while waiting
+_MAX_SLEEP = 60
+
+
+def _parse_time(time_str):
+    """Parse 'HH:MM' or 'HH:MM:SS' into (hour, minute, second)"""
+    try:
+        parts = [int(part) for part in time_str.split(':')]
+        if len(parts) not in (2, 3):
+            raise ValueError
+        hour, minute, second = (parts + [0])[:3]
+        datetime(2000, 1, 1, hour, minute, second)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid time '{time_str}' (expected HH:MM, 24-hour)") from None
+    return hour, minute, second
+
+
+class DailyTrigger:
+    """Fires every day at a local time"""
+
+    def __init__(self, time_str):
+        self.time_str = time_str
+        self._time = _parse_time(time_str)
+
+    def next_after(self, timestamp):
+        current = datetime.fromtimestamp(timestamp)
+        hour, minute, second = self._time
+        candidate = current.replace(hour=hour, minute=minute, second=second, microsecond=0)
+        if candidate <= current:
+            candidate += timedelta(days=1)
+        return candidate.timestamp()
+
+    def to_dict(self):
+        return {'type': 'daily', 'at': self.time_str}
+
+
+class WeeklyTrigger(DailyTrigger):
+    """Fires once a week on a given day at a local time"""
+
+    def __init__(self, day, time_str):
+        super().__init__(time_str)
+        if day.lower() not in DAYS:
+            raise ValueError(f"Invalid day '{day}' (expected one of: {', '.join(DAYS)})")
+        self.day = day.lower()
+
+    def next_after(self, timestamp):
+        current = datetime.fromtimestamp(timestamp)
+        hour, minute, second = self._time
+        candidate = current.replace(hour=hour, minute=minute, second=second, microsecond=0)
+        candidate += timedelta(days=(DAYS.index(self.day) - current.weekday()) % 7)
+        if candidate <= current:
+            candidate += timedelta(days=7)
+        return candidate.timestamp()
+
+    def to_dict(self):
+        return {'type': 'weekly', 'day': self.day, 'at': self.time_str}
+
+
+class IntervalTrigger:
+    """Fires every N seconds"""
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError("Interval must be positive")
+        self.seconds = seconds
+
+    def next_after(self, timestamp):
+        return timestamp + self.seconds
+
+    def to_dict(self):
+        return {'type': 'interval', 'seconds': self.seconds}
+
+
+def trigger_from_dict(data):
+    """Rebuild a trigger from its to_dict() form"""
+    if data['type'] == 'daily':
+        return DailyTrigger(data['at'])
+    if data['type'] == 'weekly':
+        return WeeklyTrigger(data['day'], data['at'])
+    if data['type'] == 'interval':
+        return IntervalTrigger(data['seconds'])
+    raise ValueError(f"Unknown trigger type: {data['type']}")
+
+
+class Job:
+    """One scheduled job and its in-memory run state"""
+
+    def __init__(self, name, kind, trigger, params, max_instances=1, catch_up=True, next_run=None):
+        self.name = name
+        self.kind = kind
+        self.trigger = trigger
+        self.params = params
+        self.max_instances = max(1, max_instances)
+        self.catch_up = catch_up
+        self.next_run = next_run
+        self.running = 0
+
+
+class JobScheduler:
+    """Runs persisted jobs on a thread pool when their triggers come due.
+
+    Jobs are stored in the scheduled_jobs table by name, with the kind of
+    work (a key into handlers), its parameters and its trigger, so they
+    survive restarts. A job's next due time is only moved on in the
+    database once a run finishes: runs that were due while the process was
+    down, or that a crash interrupted, are run once on startup (or skipped
+    forward, for jobs with catch_up off). Each job has at most
+    max_instances runs in flight; an occurrence that comes due while the
+    job is still at its limit is skipped. Between runs the loop sleeps
+    until the next job is due.
+    """
+
+    def __init__(self, db, handlers, workers=None):
+        self.db = db
+        self.handlers = handlers
+        self.jobs = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers or Config.SCHEDULER_WORKERS))
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_job(self, name, kind, trigger, params=None, max_instances=1, catch_up=True):
+        """Register or update a job and persist it.
+
+        Re-adding a job with the same trigger keeps its pending due time, so
+        a run missed before a restart is still caught up.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        params = params or {}
+        existing = next((row for row in self.db.get_scheduled_jobs() if row['name'] == name), None)
+        if existing and existing['trigger'] == trigger.to_dict() and existing['next_run_at'] is not None:
+            next_run = existing['next_run_at']
+        else:
+            next_run = trigger.next_after(time.time())
+        self.db.save_scheduled_job(name, kind, trigger.to_dict(), params, max_instances, catch_up, next_run)
+
+        with self._lock:
+            job = self.jobs.get(name)
+            if job is None:
+                job = self.jobs[name] = Job(name, kind, trigger, params, max_instances, catch_up)
+            else:
+                job.kind, job.trigger, job.params = kind, trigger, params
+                job.max_instances, job.catch_up = max(1, max_instances), catch_up
+            job.next_run = next_run
+        self._wakeup.set()
+        return job
+
+    def remove_job(self, name):
+        """Unschedule a job; a run already in progress finishes"""
+        with self._lock:
+            self.jobs.pop(name, None)
+        self.db.delete_scheduled_job(name)
+        self._wakeup.set()
+
+    def load_jobs(self, now=None):
+        """Restore persisted jobs, scheduling missed runs to run now.
+
+        Returns the number of jobs restored. Jobs whose kind has no handler
+        are left in the database untouched.
+        """
+        now = now or time.time()
+        restored = 0
+        for row in self.db.get_scheduled_jobs():
+            if row['kind'] not in self.handlers:
+                print(f"Skipping scheduled job {row['name']}: unknown kind {row['kind']}")
+                continue
+            trigger = trigger_from_dict(row['trigger'])
+            next_run = row['next_run_at'] or trigger.next_after(now)
+            if next_run <= now:
+                missed = datetime.fromtimestamp(next_run).strftime('%Y-%m-%d %H:%M:%S')
+                if row['catch_up']:
+                    print(f"Catching up missed run of {row['name']} (due {missed})")
+                    next_run = now
+                else:
+                    print(f"Skipping missed run of {row['name']} (due {missed})")
+                    next_run = trigger.next_after(now)
+            with self._lock:
+                self.jobs[row['name']] = Job(row['name'], row['kind'], trigger, row['params'],
+                                             row['max_instances'], row['catch_up'], next_run)
+            restored += 1
+        self._wakeup.set()
+        return restored
+
+    def run_pending(self, now=None):
+        """Hand every due job to the thread pool; returns seconds until the next one is due"""
+        now = now or time.time()
+        with self._lock:
+            due = [job for job in self.jobs.values() if job.next_run is not None and job.next_run <= now]
+            for job in due:
+                job.next_run = job.trigger.next_after(now)
+                if job.running >= job.max_instances:
+                    print(f"Skipping run of {job.name}: {job.running} run(s) still in progress")
+                    continue
+                job.running += 1
+                self._executor.submit(self._run_job, job, now)
+            upcoming = [job.next_run for job in self.jobs.values() if job.next_run is not None]
+        return max(0.0, min(upcoming) - now) if upcoming else None
+
+    def _run_job(self, job, started_at):
+        error = None
+        try:
+            self.handlers[job.kind](**job.params)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            print(f"Scheduled job {job.name} failed: {error}")
+        try:
+            with self._lock:
+                next_run = job.next_run
+                current = self.jobs.get(job.name) is job
+            if current:
+                self.db.record_job_run(job.name, started_at, next_run, error)
+        finally:
+            with self._lock:
+                job.running -= 1
+
+    def run(self):
+        """Dispatch jobs on the calling thread until stop() is called"""
+        while not self._stop.is_set():
+            # Cleared before checking, so a job added meanwhile wakes the wait
+            self._wakeup.clear()
+            delay = self.run_pending()
+            self._wakeup.wait(_MAX_SLEEP if delay is None else min(delay, _MAX_SLEEP))
+
+    def start(self):
+        """Dispatch jobs from a background thread"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, wait=True):
+        """Stop dispatching; with wait, let running jobs finish first"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._executor.shutdown(wait=wait)
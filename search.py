@@ -0,0 +1,161 @@
+import argparse
+import re
+from config import Config
+from database import EmailDatabase
+
+# Indexed columns of each searchable table, in FTS column order, and the
+# time column shown with each match
+SEARCH_COLUMNS = {
+    'monitored_emails': ('sender', 'subject', 'body_preview'),
+    'sent_emails': ('recipient', 'subject'),
+}
+_TIME_COLUMNS = {'monitored_emails': 'received_at', 'sent_emails': 'sent_at'}
+_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def match_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix.
+
+    Quoted phrases are kept together; FTS operators and punctuation in the
+    input are treated as plain text, so any input is a valid query.
+    """
+    terms = []
+    for phrase, word in _TERM.findall(text or ''):
+        value = (phrase or word).replace('"', '')
+        if not re.search(r'\w', value):
+            continue
+        terms.append(f'"{value}"' if phrase else f'"{value}"*')
+    return ' '.join(terms)
+
+
+class EmailSearch:
+    """Ranked full-text search over the email logs.
+
+    Matches come from the FTS5 indexes created by migration 4 and are
+    ordered by bm25 relevance. Rows logged before the index existed are
+    searchable once backfill() has indexed them.
+    """
+
+    def __init__(self, db=None):
+        self.db = db or EmailDatabase()
+
+    def _table(self, table):
+        if table not in SEARCH_COLUMNS:
+            raise ValueError(f"Unknown search table: {table}")
+        return SEARCH_COLUMNS[table], _TIME_COLUMNS[table]
+
+    def search(self, query, table='monitored_emails', page=1, page_size=None, raw=False):
+        """Return one page of matches as dicts, best first.
+
+        query is free text (see match_query); pass raw=True to use FTS5
+        query syntax directly. Each match has the row's id, indexed
+        columns, time and a highlighted snippet.
+        """
+        columns, time_column = self._table(table)
+        page_size = page_size or Config.SEARCH_PAGE_SIZE
+        expression = query if raw else match_query(query)
+        if not expression:
+            return []
+        self.db.flush()
+        with self.db.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT t.id, {', '.join(f't.{column}' for column in columns)}, t.{time_column},
+                       snippet({table}_fts, -1, '[', ']', '...', 12)
+                FROM {table}_fts
+                JOIN {table} AS t ON t.id = {table}_fts.rowid
+                WHERE {table}_fts MATCH ?
+                ORDER BY {table}_fts.rank
+                LIMIT ? OFFSET ?
+            ''', (expression, page_size, (max(1, page) - 1) * page_size)).fetchall()
+        keys = ('id',) + columns + (time_column, 'snippet')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def count(self, query, table='monitored_emails', raw=False):
+        """Number of rows matching query"""
+        self._table(table)
+        expression = query if raw else match_query(query)
+        if not expression:
+            return 0
+        self.db.flush()
+        with self.db.connection() as conn:
+            return conn.execute(
+                f'SELECT COUNT(*) FROM {table}_fts WHERE {table}_fts MATCH ?', (expression,)
+            ).fetchone()[0]
+
+    def pending_backfill(self, table='monitored_emails'):
+        """Rows logged before the index existed that are not indexed yet"""
+        self._table(table)
+        self.db.flush()
+        with self.db.connection() as conn:
+            return conn.execute(f'''
+                SELECT COUNT(*) FROM {table}
+                WHERE id > (SELECT backfilled_to FROM search_index_state WHERE name = ?)
+                  AND id <= (SELECT backfill_until FROM search_index_state WHERE name = ?)
+            ''', (table, table)).fetchone()[0]
+
+    def backfill(self, table=None, chunk_size=None, progress=None):
+        """Index rows that predate the search index, a chunk per transaction.
+
+        Each chunk is indexed and the watermark moved in one transaction,
+        so an interrupted backfill picks up where it stopped. Returns
+        {table: rows indexed}.
+        """
+        chunk_size = max(1, chunk_size or Config.SEARCH_BACKFILL_CHUNK)
+        tables = [table] if table else list(SEARCH_COLUMNS)
+        indexed = {}
+        for name in tables:
+            columns, _ = self._table(name)
+            names = ', '.join(columns)
+            # Rows in (backfilled_to, backfill_until] of the next chunk
+            window = f'''
+                SELECT id, {names} FROM {name}
+                WHERE id > (SELECT backfilled_to FROM search_index_state WHERE name = :table)
+                  AND id <= (SELECT backfill_until FROM search_index_state WHERE name = :table)
+                ORDER BY id
+                LIMIT :chunk
+            '''
+            indexed[name] = 0
+            while True:
+                counts = self.db.writer.execute_all([
+                    (f'INSERT INTO {name}_fts (rowid, {names}) {window}', {'table': name, 'chunk': chunk_size}),
+                    (f'''
+                        UPDATE search_index_state
+                        SET backfilled_to = CASE
+                            WHEN (SELECT COUNT(*) FROM ({window})) < :chunk THEN backfill_until
+                            ELSE (SELECT MAX(id) FROM ({window}))
+                        END
+                        WHERE name = :table
+                    ''', {'table': name, 'chunk': chunk_size}),
+                ])
+                indexed[name] += counts[0]
+                if progress:
+                    progress(name, indexed[name])
+                if counts[0] < chunk_size:
+                    break
+        return indexed
+
+
+def main(argv=None):
+    """Search the email logs, or backfill the search index, from the command line"""
+    parser = argparse.ArgumentParser(description="Full-text search over email logs")
+    parser.add_argument('query', nargs='?', help="Words to search for (quote phrases)")
+    parser.add_argument('--table', choices=sorted(SEARCH_COLUMNS), default='monitored_emails')
+    parser.add_argument('--page', type=int, default=1)
+    parser.add_argument('--page-size', type=int)
+    parser.add_argument('--backfill', action='store_true', help="Index rows logged before search was enabled")
+    args = parser.parse_args(argv)
+
+    search = EmailSearch()
+    if args.backfill:
+        indexed = search.backfill(progress=lambda table, count: print(f"{table}: {count} row(s) indexed"))
+        print(f"Backfill complete: {sum(indexed.values())} row(s) indexed")
+        return
+    if not args.query:
+        parser.error("a query is required unless --backfill is given")
+
+    for match in search.search(args.query, table=args.table, page=args.page, page_size=args.page_size):
+        print(f"{match['id']}\t{match[_TIME_COLUMNS[args.table]]}\t{match['subject']}\t{match['snippet']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import re
+import smtplib
+
+_LEADING_DOT = re.compile(rb'(?m)^\.')
+
+
+def _send_data(server, data):
+    """Send a message's content, dot-stuffed, then the end-of-data marker.
+
+    data is the message bytes, or a list of (chunk, stuff) pairs that each
+    start at the beginning of a line. Chunks with stuff false can't hold a
+    line starting with '.' (base64 attachment parts), so they are written
+    to the socket as they are, without being scanned or copied.
+    """
+    chunks = [(data, True)] if isinstance(data, (bytes, bytearray)) else list(data)
+    last = b''
+    for i, (chunk, stuff) in enumerate(chunks, 1):
+        if stuff:
+            chunk = _LEADING_DOT.sub(b'..', chunk)
+        if chunk:
+            last = chunk
+        if i == len(chunks):
+            # The marker rides in the last write, so a plain message is still one send
+            chunk += b'.\r\n' if last.endswith(b'\r\n') else b'\r\n.\r\n'
+        if chunk:
+            server.send(chunk)
+
+
+def _error(code, message):
+    if isinstance(message, bytes):
+        message = message.decode('utf-8', errors='replace')
+    return f"{code} {message}"
+
+
+def send_envelope(server, from_addr, recipients, data):
+    """Deliver one message to several recipients in a single SMTP transaction.
+
+    data is the message bytes or its chunks (see _send_data). When the
+    server advertises PIPELINING (RFC 2920), MAIL, every RCPT and DATA go
+    out in one write and their replies are read back together; otherwise
+    the commands are sent one at a time. Returns
+    {recipient: None if accepted, else the server's error}.
+    """
+    server.ehlo_or_helo_if_needed()
+    if server.has_extn('pipelining'):
+        commands = [f'MAIL FROM:{smtplib.quoteaddr(from_addr)}']
+        commands += [f'RCPT TO:{smtplib.quoteaddr(rcpt)}' for rcpt in recipients]
+        commands.append('DATA')
+        server.send(''.join(command + '\r\n' for command in commands))
+        mail_reply = server.getreply()
+        rcpt_replies = [server.getreply() for _ in recipients]
+        data_reply = server.getreply()
+    else:
+        mail_reply = server.mail(from_addr)
+        if mail_reply[0] != 250:
+            rcpt_replies = [mail_reply] * len(recipients)
+        else:
+            rcpt_replies = [server.rcpt(rcpt) for rcpt in recipients]
+        accepted = any(code in (250, 251) for code, _ in rcpt_replies)
+        data_reply = server.docmd('DATA') if accepted else None
+
+    if mail_reply[0] != 250:
+        error = _error(*mail_reply)
+        server.rset()
+        return {rcpt: error for rcpt in recipients}
+
+    results = {}
+    for rcpt, (code, message) in zip(recipients, rcpt_replies):
+        results[rcpt] = None if code in (250, 251) else _error(code, message)
+
+    if data_reply is None or data_reply[0] != 354:
+        # Nothing was accepted, or the server refused DATA; accepted
+        # recipients (if any) fail with the DATA error
+        if data_reply is not None:
+            error = _error(*data_reply)
+            results = {rcpt: error if result is None else result for rcpt, result in results.items()}
+        server.rset()
+        return results
+
+    if all(result is not None for result in results.values()):
+        # The server wants data despite refusing every recipient; send none
+        server.send(b'.\r\n')
+        server.getreply()
+        return results
+
+    _send_data(server, data)
+    code, message = server.getreply()
+    if code != 250:
+        error = _error(code, message)
+        results = {rcpt: error if result is None else result for rcpt, result in results.items()}
+    return results
+
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most size items"""
+    size = max(1, size)
+    return [items[i:i + size] for i in range(0, len(items), size)]
@@ -0,0 +1,116 @@
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+
+class _PooledConnection:
+    """An authenticated SMTP session plus the bookkeeping used to recycle it"""
+
+    def __init__(self, server):
+        self.server = server
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages_sent = 0
+
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP sessions alive and reuses them across sends"""
+
+    def __init__(self, connect, max_size=4, max_messages=100, max_age=300, health_check_after=30):
+        self._connect = connect
+        self.max_size = max_size
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.health_check_after = health_check_after
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _expired(self, conn):
+        """Check whether a session has reached its message or age limit"""
+        if self.max_messages and conn.messages_sent >= self.max_messages:
+            return True
+        if self.max_age and time.monotonic() - conn.created_at >= self.max_age:
+            return True
+        return False
+
+    def _healthy(self, conn):
+        """Probe a session that has been idle for a while with NOOP"""
+        if time.monotonic() - conn.last_used < self.health_check_after:
+            return True
+        try:
+            return conn.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _discard(self, conn):
+        """Close a session without caring whether the server is still there"""
+        try:
+            conn.server.quit()
+        except (smtplib.SMTPException, OSError):
+            try:
+                conn.server.close()
+            except OSError:
+                pass
+
+    def acquire(self):
+        """Take a healthy session from the pool, connecting if none is idle"""
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return _PooledConnection(self._connect())
+                if not self._expired(conn) and self._healthy(conn):
+                    return conn
+                self._discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn, reusable=True):
+        """Return a session to the pool, or close it if it can't be reused"""
+        try:
+            conn.last_used = time.monotonic()
+            if reusable and not self._expired(conn):
+                with self._lock:
+                    self._idle.append(conn)
+            else:
+                self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a session for one message; broken sessions are not returned"""
+        conn = self.acquire()
+        reusable = True
+        try:
+            yield conn.server
+            conn.messages_sent += 1
+        except BaseException as e:
+            reusable = is_session_reusable(e)
+            raise
+        finally:
+            self.release(conn, reusable=reusable)
+
+    def close(self):
+        """Close every idle session"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
+def is_session_reusable(error):
+    """Decide whether a session survived the given send error.
+
+    smtplib resets the transaction itself when a sender or recipient is
+    refused, so those leave the session usable; disconnects, socket errors
+    and 421 "closing channel" replies do not.
+    """
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+        return getattr(error, 'smtp_code', None) != 421
+    return False
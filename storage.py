@@ -0,0 +1,141 @@
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from config import Config
+
+
+class StorageBackend(ABC):
+    """Where EmailDatabase gets its connections from.
+
+    connection() lends a DB-API connection for one unit of work and commits
+    it (or rolls back on error) when the outermost use ends; connect() opens
+    a dedicated connection that the caller owns and closes, such as the
+    batched writer's. A server database would implement the same two
+    methods.
+    """
+
+    def __init__(self, path, busy_timeout=None):
+        self.path = path
+        self.busy_timeout = Config.DB_BUSY_TIMEOUT if busy_timeout is None else busy_timeout
+
+    @abstractmethod
+    def connect(self):
+        """Open a new connection owned by the caller"""
+
+    @abstractmethod
+    def connection(self):
+        """Lend a connection for the duration of a with block (a context manager)"""
+
+    def close(self):
+        """Release any connections the backend is holding"""
+
+
+class SQLiteBackend(StorageBackend):
+    """Opens a fresh SQLite connection for every unit of work"""
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+        # Lets retention hand freed pages back a batch at a time. It only
+        # takes effect on a new file, and only if set before WAL mode is
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self.connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+
+class PooledSQLiteBackend(SQLiteBackend):
+    """Keeps one WAL connection per thread and reuses it.
+
+    Connections wait up to busy_timeout seconds for locks held by other
+    threads or processes instead of failing with "database is locked".
+    Nested uses on one thread share the connection and only the outermost
+    one commits. Connections of threads that have exited are closed the
+    next time a thread opens one. A connection is only ever closed by its
+    own thread or once that thread has exited, so close() never pulls one
+    out from under a thread that is using it.
+    """
+
+    def __init__(self, path, busy_timeout=None):
+        super().__init__(path, busy_timeout)
+        self._local = threading.local()
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def _thread_connection(self):
+        local = self._local
+        current = getattr(local, 'conn', None)
+        if current is not None:
+            # Keep a connection mid-use, even if close() has retired it since
+            if local.depth or local.generation == self._generation:
+                return current
+            current.close()
+
+        conn = self.connect()
+        with self._lock:
+            for thread, stale in list(self._connections.items()):
+                if not thread.is_alive():
+                    del self._connections[thread]
+                    stale.close()
+            self._connections[threading.current_thread()] = conn
+            local.conn, local.generation, local.depth = conn, self._generation, 0
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._thread_connection()
+        local = self._local
+        local.depth += 1
+        try:
+            yield conn
+            if local.depth == 1 and conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if local.depth == 1 and conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            local.depth -= 1
+
+    def close(self):
+        """Close this thread's connection and those of exited threads.
+
+        Other live threads may be using theirs, so they are only retired:
+        each thread closes its own and opens a new one on its next use.
+        """
+        current = threading.current_thread()
+        in_use = getattr(self._local, 'depth', 0)
+        with self._lock:
+            self._generation += 1
+            closable = [
+                thread for thread in self._connections
+                if not thread.is_alive() or (thread is current and not in_use)
+            ]
+            connections = [self._connections.pop(thread) for thread in closable]
+        for conn in connections:
+            conn.close()
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'pooled': PooledSQLiteBackend,
+}
+
+
+def create_backend(path, kind=None):
+    """Build the storage backend named by kind (default: Config.DB_BACKEND)"""
+    kind = kind or Config.DB_BACKEND
+    try:
+        return BACKENDS[kind](path)
+    except KeyError:
+        raise ValueError(f"Unknown DB_BACKEND '{kind}' (expected one of: {', '.join(BACKENDS)})") from None
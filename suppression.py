@@ -0,0 +1,70 @@
+import argparse
+from database import EmailDatabase
+from recipients import normalize_address, iter_recipients
+
+
+class RecipientFilter:
+    """Decides which bulk recipients to skip before their rows are rendered.
+
+    Addresses are normalized, then checked against those already seen in
+    this run, kept as 64-bit hashes so even large files stay compact. The
+    suppressions table is not loaded into memory: each render batch is
+    checked with one indexed IN query, which costs the same with ten
+    addresses suppressed or ten million.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._seen = set()
+
+    def mark_seen(self, address):
+        """Remember an address sent by an earlier run of the campaign"""
+        self._seen.add(hash(normalize_address(address)))
+
+    def first_seen(self, address):
+        """Record an address; False if it already appeared in this run"""
+        key = hash(normalize_address(address))
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        return True
+
+    def suppressed(self, addresses):
+        """Get {normalized address: reason} for the suppressed ones among addresses"""
+        return self.db.get_suppressions(addresses)
+
+
+def main(argv=None):
+    """Manage the suppression list from the command line"""
+    parser = argparse.ArgumentParser(description="Manage addresses excluded from bulk sends")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help="Suppress addresses")
+    add.add_argument('addresses', nargs='+')
+    add.add_argument('--reason', default='unsubscribe')
+    remove = commands.add_parser('remove', help="Allow addresses again")
+    remove.add_argument('addresses', nargs='+')
+    load = commands.add_parser('import', help="Suppress every address in a recipient file's email column")
+    load.add_argument('file')
+    load.add_argument('--reason', default='unsubscribe')
+    commands.add_parser('count', help="Show how many addresses are suppressed")
+    args = parser.parse_args(argv)
+
+    db = EmailDatabase()
+    if args.command == 'add':
+        for address in args.addresses:
+            db.add_suppression(address, args.reason)
+    elif args.command == 'remove':
+        for address in args.addresses:
+            db.remove_suppression(address)
+    elif args.command == 'import':
+        db.writer.executemany(
+            'INSERT OR IGNORE INTO suppressions (address, reason) VALUES (?, ?)',
+            ((normalize_address(row.get('email')), args.reason) for _, row in iter_recipients(args.file)
+             if row.get('email'))
+        )
+    print(f"{db.count_suppressions()} address(es) suppressed")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import os
+import re
+import string
+import threading
+from functools import lru_cache
+
+_formatter = string.Formatter()
+_SIMPLE_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class TemplateError(ValueError):
+    """Raised when a template can't be compiled or doesn't fit the recipient data"""
+
+
+class CompiledTemplate:
+    """A str.format template parsed once into a render plan.
+
+    The plan is a list of literal strings and (field, conversion, spec)
+    steps, so rendering a row is a lookup and a format() per placeholder
+    instead of re-parsing the template. Output matches template.format(**row).
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.fields = set()
+        self._plan = []
+        self._full_format = False
+
+        try:
+            parsed = list(_formatter.parse(source))
+        except ValueError as e:
+            raise TemplateError(f"Invalid template: {e}") from None
+
+        for literal, field_name, format_spec, conversion in parsed:
+            if literal:
+                self._plan.append(literal)
+            if field_name is None:
+                continue
+            base = re.split(r'[.\[]', field_name, maxsplit=1)[0]
+            if not base or base.isdigit():
+                raise TemplateError(f"Template placeholders must be named, got '{{{field_name}}}'")
+            self.fields.add(base)
+            if format_spec and '{' in format_spec:
+                # Nested placeholders in the spec: leave those to str.format
+                self.fields.update(name for _, name, _, _ in _formatter.parse(format_spec) if name)
+                self._full_format = True
+            self._plan.append((field_name, _SIMPLE_NAME.match(field_name) is not None, conversion, format_spec))
+
+    def render(self, row):
+        """Render the template for one row"""
+        if self._full_format:
+            return self.source.format(**row)
+        out = []
+        for step in self._plan:
+            if step.__class__ is str:
+                out.append(step)
+                continue
+            field_name, simple, conversion, format_spec = step
+            value = row[field_name] if simple else _formatter.get_field(field_name, (), row)[0]
+            if conversion:
+                value = _formatter.convert_field(value, conversion)
+            out.append(format(value, format_spec))
+        return ''.join(out)
+
+    def missing_fields(self, fieldnames):
+        """Return the placeholders not provided by the given column names"""
+        return sorted(self.fields - set(fieldnames or ()))
+
+    def validate(self, fieldnames):
+        """Raise TemplateError if any placeholder has no matching column"""
+        missing = self.missing_fields(fieldnames)
+        if missing:
+            raise TemplateError(f"Template uses fields missing from the recipient file: {', '.join(missing)}")
+
+
+@lru_cache(maxsize=256)
+def compile_template(source):
+    """Compile a template string, reusing the compiled plan for repeat sources"""
+    return CompiledTemplate(source)
+
+
+_file_cache = {}
+_file_cache_lock = threading.Lock()
+
+
+def load_template(path):
+    """Load and compile a template file (e.g. reusable HTML), cached until the file changes"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _file_cache_lock:
+        cached = _file_cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+    with open(path, 'r', encoding='utf-8') as file:
+        template = CompiledTemplate(file.read())
+    with _file_cache_lock:
+        _file_cache[path] = (key, template)
+    return template
@@ -1,7 +1,42 @@
 import pytest
 import os
-from database import EmailDatabase
+from database import EmailDatabase, MIGRATIONS
+import sqlite3
 from config import Config
+from email_sender import EmailSender
+from email_monitor import EmailMonitor
+from fake_servers import FakeSMTPServer, FakeIMAPServer
+from monitor_targets import MonitorTarget
+from outbox import OutboxWorkers, retry_delay
+from notification_digest import NotificationDigest
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.mime.application import MIMEApplication
+from imap_fetch import parse_fetch_response, find_text_part, decode_partial
+from email_preview import extract_preview, html_to_text
+import threading
+from rule_matcher import AhoCorasick, RuleMatcher
+from rate_limiter import TokenBucket, get_rate_limiter
+from recipients import iter_recipients, file_hash, read_fieldnames, normalize_address
+from suppression import RecipientFilter
+from templates import CompiledTemplate, TemplateError, load_template
+import hashlib
+import smtplib
+import mime_cache
+import smtp_batch
+from email import message_from_bytes, policy
+import gzip
+import csv
+from datetime import date, datetime, timezone
+from retention import LogRetention
+from reporting import EmailReports
+from search import EmailSearch, match_query
+from storage import PooledSQLiteBackend, SQLiteBackend, StorageBackend, create_backend
+from scheduler import EmailScheduler
+from scheduling import JobScheduler, DailyTrigger, WeeklyTrigger, IntervalTrigger
+from benchmark import SCENARIOS, percentile, run_scenario
+import json
+import time
 
 class TestEmailDatabase:
     """Test cases for EmailDatabase"""
@@ -13,6 +48,7 @@ class TestEmailDatabase:
     
     def teardown_method(self):
         """Clean up test database"""
+        self.db.close()
         if os.path.exists(self.test_db_path):
             os.remove(self.test_db_path)
     
@@ -79,6 +115,1643 @@ class TestEmailDatabase:
         assert stats['sent'] == 2
         assert stats['failed'] == 1
         assert stats['monitored'] == 0
+    
+    def test_migrations_upgrade_existing_database(self, tmp_path):
+        """Test an old database gets indexes and a backfilled rollup, once"""
+        path = str(tmp_path / 'old.db')
+        conn = sqlite3.connect(path)
+        conn.execute('''
+            CREATE TABLE sent_emails (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, recipient TEXT NOT NULL, subject TEXT NOT NULL,
+                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, status TEXT DEFAULT 'sent', error_message TEXT
+            )
+        ''')
+        conn.executemany('INSERT INTO sent_emails (recipient, subject, sent_at, status) VALUES (?, ?, ?, ?)', [
+            ('a@example.com', 'S', '2024-01-01 10:00:00', 'sent'),
+            ('b@example.com', 'S', '2024-01-01 11:00:00', 'failed'),
+            ('c@example.com', 'S', '2024-01-02 09:00:00', 'sent'),
+        ])
+        conn.commit()
+        conn.close()
+        
+        db = EmailDatabase(path)
+        db.log_sent_email('d@example.com', 'S')
+        EmailDatabase(path).close()
+        
+        conn = sqlite3.connect(path)
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {'idx_sent_emails_status', 'idx_sent_emails_sent_at', 'idx_sent_emails_recipient'} <= indexes
+        conn.close()
+        assert db.get_email_stats() == {'sent': 3, 'failed': 1, 'monitored': 0}
+        assert db.get_daily_stats(until='2024-01-01') == {'2024-01-01': {'sent': 1, 'failed': 1}}
+        db.close()
+    
+    def test_rollup_counts_per_campaign(self):
+        """Test the rollup tracks counts per campaign and ignores later deletes"""
+        campaign_id = self.db.create_campaign('launch', 'source', 'template')
+        self.db.log_sent_email('a@example.com', 'S', campaign_id=campaign_id, sync=False)
+        self.db.log_sent_email('b@example.com', 'S', status='failed', campaign_id=campaign_id, sync=False)
+        self.db.log_sent_email('c@example.com', 'S', sync=False)
+        self.db.log_monitored_email('x@example.com', 'Hi', 'Body')
+        
+        assert self.db.get_campaign_stats(campaign_id) == {'sent': 1, 'failed': 1}
+        conn = self.db.get_connection()
+        conn.execute('DELETE FROM sent_emails')
+        conn.commit()
+        conn.close()
+        assert self.db.get_email_stats() == {'sent': 2, 'failed': 1, 'monitored': 1}
+    
+    def test_batched_writes_commit_on_flush(self):
+        """Test unsynced log entries are grouped until the batch is flushed"""
+        self.db.writer.flush_interval = 60
+        for i in range(3):
+            assert self.db.log_sent_email(f'user{i}@example.com', 'Subject', sync=False) is None
+        
+        conn = self.db.get_connection()
+        assert conn.execute('SELECT COUNT(*) FROM sent_emails').fetchone()[0] == 0
+        self.db.flush()
+        assert conn.execute('SELECT COUNT(*) FROM sent_emails').fetchone()[0] == 3
+        conn.close()
+    
+    def test_batched_writes_flush_on_size(self):
+        """Test a full batch is committed without waiting for the interval"""
+        self.db.writer.flush_interval = 60
+        self.db.writer.batch_size = 5
+        for i in range(5):
+            self.db.log_sent_email(f'user{i}@example.com', 'Subject', sync=False)
+        
+        conn = self.db.get_connection()
+        deadline = time.monotonic() + 2
+        while conn.execute('SELECT COUNT(*) FROM sent_emails').fetchone()[0] < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert conn.execute('SELECT COUNT(*) FROM sent_emails').fetchone()[0] == 5
+        conn.close()
+    
+    def test_sync_write_commits_queued_writes_first(self):
+        """Test a synchronous write returns its id and commits earlier queued writes"""
+        self.db.writer.flush_interval = 60
+        self.db.log_sent_email('queued@example.com', 'Subject', sync=False)
+        email_id = self.db.log_sent_email('sync@example.com', 'Subject')
+        
+        assert email_id == 2
+        conn = self.db.get_connection()
+        assert conn.execute('SELECT COUNT(*) FROM sent_emails').fetchone()[0] == 2
+        conn.close()
+
+    def test_failed_sync_write_keeps_queued_writes(self):
+        """Test a synchronous write that fails doesn't roll back earlier queued writes"""
+        self.db.writer.flush_interval = 60
+        for i in range(3):
+            self.db.log_sent_email(f'user{i}@example.com', 'Subject', sync=False)
+        
+        with pytest.raises(sqlite3.IntegrityError):
+            self.db.writer.execute('INSERT INTO sent_emails (id, recipient, subject) VALUES (1, ?, ?)',
+                                   ('dup@example.com', 'Subject'))
+        
+        conn = self.db.get_connection()
+        assert conn.execute('SELECT COUNT(*) FROM sent_emails').fetchone()[0] == 3
+        conn.close()
+    
+    def test_active_rules_cached_until_changed(self):
+        """Test rules are served from cache and refreshed after a change"""
+        rule_id = self.db.add_notification_rule('Rule 1', sender_filter='boss@example.com')
+        other = EmailDatabase(self.test_db_path)
+        
+        assert len(other.get_active_rules()) == 1
+        version = other.rules_version
+        assert other.get_active_rules() == other.get_active_rules()
+        
+        self.db.set_rule_enabled(rule_id, False)
+        
+        assert other.rules_version != version
+        assert other.get_active_rules() == []
+        other.close()
+    
+    def test_rule_changes_from_other_processes_seen(self):
+        """Test cached rules are refreshed after a change made on another connection"""
+        self.db.add_notification_rule('Rule 1', sender_filter='boss@example.com')
+        assert len(self.db.get_active_rules()) == 1
+        
+        # Stands in for the menu editing rules while a monitor process runs
+        conn = sqlite3.connect(self.test_db_path)
+        conn.execute("INSERT INTO notification_rules (rule_name, subject_filter) VALUES ('Rule 2', 'urgent')")
+        conn.commit()
+        conn.close()
+        
+        assert [rule[1] for rule in self.db.get_active_rules()] == ['Rule 1', 'Rule 2']
+
+class TestStorage:
+    """Test cases for the pluggable storage backends"""
+    
+    def test_pooled_backend_reuses_connection_per_thread(self, tmp_path):
+        """Test each thread keeps one connection and nested uses share it"""
+        backend = PooledSQLiteBackend(str(tmp_path / 'pool.db'))
+        with backend.connection() as conn:
+            with backend.connection() as inner:
+                assert inner is conn
+                inner.execute('CREATE TABLE t (x)')
+                inner.execute('INSERT INTO t VALUES (1)')
+            # Only the outermost use commits
+            assert conn.in_transaction
+        with backend.connection() as again:
+            assert again is conn
+            assert again.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 1
+        
+        seen = []
+        def borrow():
+            with backend.connection() as other:
+                seen.append(other)
+        thread = threading.Thread(target=borrow)
+        thread.start()
+        thread.join()
+        assert seen[0] is not conn
+        
+        backend.close()
+        with backend.connection() as reopened:
+            assert reopened is not conn
+        backend.close()
+    
+    def test_close_leaves_other_threads_connections_usable(self, tmp_path):
+        """Test close() doesn't close a connection another thread is using"""
+        backend = PooledSQLiteBackend(str(tmp_path / 'pool.db'))
+        borrowed, closed, results = threading.Event(), threading.Event(), []
+        def worker():
+            with backend.connection() as conn:
+                conn.execute('CREATE TABLE t (x)')
+                borrowed.set()
+                closed.wait()
+                conn.execute('INSERT INTO t VALUES (1)')
+            with backend.connection() as again:
+                results.append(again is conn)
+                results.append(again.execute('SELECT COUNT(*) FROM t').fetchone()[0])
+        thread = threading.Thread(target=worker)
+        thread.start()
+        borrowed.wait()
+        backend.close()
+        closed.set()
+        thread.join()
+        
+        # The worker finished its transaction, then reopened on next use
+        assert results == [False, 1]
+        backend.close()
+        with pytest.raises(TypeError):
+            StorageBackend(str(tmp_path / 'abstract.db'))
+    
+    def test_concurrent_databases_write_without_locking(self, tmp_path):
+        """Test several handles on one file log from many threads without 'database is locked'"""
+        path = str(tmp_path / 'shared.db')
+        databases = [EmailDatabase(path) for _ in range(3)]
+        errors = []
+        def log(db, worker):
+            try:
+                for i in range(50):
+                    db.log_sent_email(f'user{worker}-{i}@example.com', 'Subject', sync=i % 2 == 0)
+                    db.get_email_stats()
+                db.flush()
+            except sqlite3.Error as e:
+                errors.append(e)
+        threads = [
+            threading.Thread(target=log, args=(databases[worker % 3], worker))
+            for worker in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert errors == []
+        assert databases[0].get_email_stats()['sent'] == 300
+        for db in databases:
+            db.close()
+    
+    def test_backend_selected_by_name(self, tmp_path):
+        """Test DB_BACKEND picks the backend and unknown names are rejected"""
+        path = str(tmp_path / 'plain.db')
+        assert isinstance(create_backend(path, 'pooled'), PooledSQLiteBackend)
+        with pytest.raises(ValueError):
+            create_backend(path, 'postgres')
+        
+        db = EmailDatabase(path, backend=create_backend(path, 'sqlite'))
+        assert type(db.backend) is SQLiteBackend
+        db.log_sent_email('a@example.com', 'Subject')
+        assert db.get_email_stats()['sent'] == 1
+        db.close()
+
+class TestRuleMatcher:
+    """Test cases for compiled notification rule matching"""
+    
+    def test_aho_corasick_finds_overlapping_patterns(self):
+        """Test every pattern is found in one pass, including overlaps"""
+        automaton = AhoCorasick(['he', 'she', 'his', 'hers'])
+        
+        assert automaton.search('ushers') == {0, 1, 3}
+        assert automaton.search('nothing') == set()
+    
+    def test_rule_requires_every_filter(self):
+        """Test a rule matches only when all of its filters match"""
+        matcher = RuleMatcher([
+            (1, 'Boss', 'boss@example.com', None, None),
+            (2, 'Urgent from boss', 'boss@example.com', 'URGENT', None),
+            (3, 'Invoices', None, None, 'invoice'),
+            (4, 'Everything', None, None, None),
+        ])
+        
+        assert matcher.match('Boss <BOSS@example.com>', 'Urgent: call me', 'hi') == ['Boss', 'Urgent from boss', 'Everything']
+        assert matcher.match('someone@example.com', 'Hello', 'Your Invoice is ready') == ['Invoices', 'Everything']
+    
+    def test_matches_naive_scan(self):
+        """Test compiled matching agrees with checking each rule separately"""
+        rules = [(i, f'rule{i}', f'user{i % 7}@', f'topic {i % 5}' if i % 2 else None, f'word{i % 11}' if i % 3 else None)
+                 for i in range(200)]
+        matcher = RuleMatcher(rules)
+        
+        sender, subject, body = 'User3@example.com', 'About topic 1 and topic 4', 'word2 word9 word10'
+        expected = [name for _, name, sf, subf, kf in rules
+                    if (not sf or sf.lower() in sender.lower())
+                    and (not subf or subf.lower() in subject.lower())
+                    and (not kf or kf.lower() in body.lower())]
+        
+        assert matcher.match(sender, subject, body) == expected
+
+class TestEmailSender:
+    """Test cases for EmailSender against a local fake SMTP server"""
+    
+    CONFIG_KEYS = ('SMTP_SERVER', 'SMTP_PORT', 'SMTP_USE_TLS', 'EMAIL_ADDRESS',
+                   'EMAIL_PASSWORD', 'NOTIFICATION_EMAIL', 'DB_PATH', 'SMTP_MAX_RECIPIENTS')
+    
+    def setup_method(self):
+        """Point the sender at a fake SMTP server and a test database"""
+        self.test_db_path = 'test_sender.db'
+        self.smtp = FakeSMTPServer().start()
+        self.saved_config = {key: getattr(Config, key) for key in self.CONFIG_KEYS}
+        Config.SMTP_SERVER = self.smtp.host
+        Config.SMTP_PORT = self.smtp.port
+        Config.SMTP_USE_TLS = False
+        Config.EMAIL_ADDRESS = 'sender@example.com'
+        Config.EMAIL_PASSWORD = 'secret'
+        Config.NOTIFICATION_EMAIL = 'alerts@example.com'
+        Config.DB_PATH = self.test_db_path
+        self.sender = EmailSender()
+    
+    def teardown_method(self):
+        """Stop the fake server and restore configuration"""
+        self.sender.close()
+        self.smtp.stop()
+        for key, value in self.saved_config.items():
+            setattr(Config, key, value)
+        if os.path.exists(self.test_db_path):
+            os.remove(self.test_db_path)
+    
+    def test_sessions_are_reused_across_sends(self):
+        """Test several sends share one authenticated session"""
+        assert self.sender.send_email('a@example.com', 'One', 'Body')
+        assert self.sender.send_email('b@example.com', 'Two', 'Body')
+        assert self.sender.send_notification('Alert', 'Body')
+        
+        assert len(self.smtp.messages) == 3
+        assert self.smtp.connections == 1
+        assert self.smtp.logins == 1
+    
+    def test_batch_send_reports_each_recipient(self, monkeypatch):
+        """Test identical mail is pipelined in capped envelopes with per-recipient results"""
+        Config.SMTP_MAX_RECIPIENTS = 3
+        self.smtp.reject_recipients = {'bad@example.com'}
+        self.smtp.defer_recipients = {'later@example.com'}
+        writes = []
+        original_send = smtplib.SMTP.send
+        monkeypatch.setattr(smtplib.SMTP, 'send', lambda server, data: writes.append(data) or original_send(server, data))
+        recipients = ['a@example.com', 'bad@example.com', 'b@example.com', 'later@example.com', 'c@example.com']
+        
+        results = self.sender.send_batch(recipients, 'Announcement', 'Body')
+        
+        assert [rcpts for _, rcpts, _ in self.smtp.messages] == [['a@example.com', 'b@example.com'], ['c@example.com']]
+        assert results['bad@example.com'].startswith('550')
+        assert results['later@example.com'].startswith('451')
+        assert [rcpt for rcpt, error in results.items() if error is None] == ['a@example.com', 'b@example.com', 'c@example.com']
+        assert len([data for data in writes if b'RCPT TO' in (data if isinstance(data, bytes) else data.encode())]) == 2
+        stats = self.sender.db.get_email_stats()
+        assert (stats['sent'], stats['failed']) == (3, 2)
+    
+    def test_batch_send_without_pipelining(self):
+        """Test envelopes fall back to one command at a time without PIPELINING"""
+        self.sender.close()
+        self.smtp.stop()
+        self.smtp = FakeSMTPServer(pipelining=False, reject_recipients={'bad@example.com'}).start()
+        Config.SMTP_PORT = self.smtp.port
+        Config.NOTIFICATION_EMAIL = 'ops@example.com, bad@example.com, oncall@example.com'
+        self.sender = EmailSender()
+        
+        assert not self.sender.send_notification('Alert', 'Body')
+        
+        assert [rcpts for _, rcpts, _ in self.smtp.messages] == [['ops@example.com', 'oncall@example.com']]
+    
+    def test_outbox_retries_transient_and_dead_letters_permanent(self):
+        """Test 4xx failures are retried with backoff and 5xx failures are dead-lettered"""
+        self.smtp.reject_recipients = {'bad@example.com'}
+        self.smtp.defer_recipients = {'later@example.com'}
+        workers = OutboxWorkers(self.sender)
+        for rcpt in ('a@example.com', 'bad@example.com', 'later@example.com'):
+            self.sender.enqueue_email(rcpt, 'Hello', 'Body')
+        
+        assert workers.run_pending() == 3
+        assert [rcpts for _, rcpts, _ in self.smtp.messages] == [['a@example.com']]
+        assert self.sender.db.get_outbox_counts() == {'sent': 1, 'dead': 1, 'queued': 1}
+        assert workers.run_pending() == 0  # deferred message isn't due yet
+        
+        self.smtp.defer_recipients.clear()
+        conn = self.sender.db.get_connection()
+        conn.execute("UPDATE outbox SET next_attempt_at = 0 WHERE status = 'queued'")
+        conn.commit()
+        conn.close()
+        
+        assert workers.run_pending() == 1
+        assert self.smtp.messages[-1][1] == ['later@example.com']
+        assert self.sender.db.get_outbox_counts() == {'sent': 2, 'dead': 1}
+        stats = self.sender.db.get_email_stats()
+        assert (stats['sent'], stats['failed']) == (2, 1)
+    
+    def test_outbox_workers_deliver_in_background(self):
+        """Test enqueue returns at once and running workers deliver the mail"""
+        workers = OutboxWorkers(self.sender, workers=2, poll_interval=5).start()
+        try:
+            self.sender.enqueue_email('a@example.com', 'One', 'Body')
+            self.sender.enqueue_email('b@example.com', 'Two', 'Body')
+            assert wait_until(lambda: len(self.smtp.messages) == 2, timeout=3)
+        finally:
+            workers.stop()
+    
+    def test_outbox_reclaims_expired_lease(self):
+        """Test mail claimed by a worker that died is picked up again"""
+        self.sender.enqueue_email('a@example.com', 'Hello', 'Body')
+        assert len(self.sender.db.claim_outbox(10, lease=-1)) == 1
+        
+        assert OutboxWorkers(self.sender).run_pending() == 1
+        assert len(self.smtp.messages) == 1
+    
+    def test_retry_delay_backs_off_with_jitter(self):
+        """Test retry delays double per attempt, stay capped, and vary"""
+        delays = [retry_delay(attempt, 30, 3600) for attempt in (1, 2, 3, 10)]
+        
+        assert 15 <= delays[0] <= 30
+        assert 30 <= delays[1] <= 60
+        assert 60 <= delays[2] <= 120
+        assert 1800 <= delays[3] <= 3600
+        assert len({retry_delay(1, 30, 3600) for _ in range(10)}) > 1
+    
+    def test_reconnects_when_server_drops_session(self):
+        """Test a session closed by the server is replaced transparently"""
+        self.smtp.drop_after = 1
+        
+        assert self.sender.send_email('a@example.com', 'One', 'Body')
+        assert self.sender.send_email('b@example.com', 'Two', 'Body')
+        
+        assert len(self.smtp.messages) == 2
+        assert self.smtp.connections == 2
+    
+    def test_sessions_recycled_after_message_limit(self):
+        """Test a session is retired once it reaches the message limit"""
+        self.sender.pool.max_messages = 2
+        
+        for i in range(5):
+            assert self.sender.send_email(f'user{i}@example.com', 'Hi', 'Body')
+        
+        assert self.smtp.connections == 3
+    
+    def test_idle_session_checked_with_noop(self):
+        """Test an idle session is probed before reuse"""
+        self.sender.pool.health_check_after = 0
+        
+        self.sender.send_email('a@example.com', 'One', 'Body')
+        self.sender.send_email('b@example.com', 'Two', 'Body')
+        
+        assert self.smtp.noops == 1
+        assert self.smtp.connections == 1
+    
+    def test_concurrent_bulk_send(self, tmp_path):
+        """Test bulk sending with several workers sends and logs every row"""
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email,name\n' + ''.join(f'user{i}@example.com,User {i}\n' for i in range(20)))
+        
+        result = self.sender.send_bulk_emails(str(csv_file), 'Hi {name}', 'Hello {name}', workers=4)
+        
+        assert result == (20, 0)
+        assert len(self.smtp.messages) == 20
+        assert self.sender.db.get_email_stats()['sent'] == 20
+    
+    def test_bulk_send_skips_duplicates_and_suppressed(self, tmp_path, capsys):
+        """Test repeated, bounced and unsubscribed addresses are dropped before rendering and counted"""
+        self.sender.db.log_sent_email('bounced@example.com', 'Old', status='failed', error_message='550 5.1.1 Mailbox unavailable')
+        self.sender.db.add_suppression('optout@example.com')
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email,name\n'
+                            'ann@example.com,Ann\n'
+                            'ANN@example.com,Ann again\n'
+                            'bounced@example.com,Bo\n'
+                            'OptOut@Example.com,Opt\n'
+                            'cy@example.com,Cy\n')
+        
+        result = self.sender.send_bulk_emails(str(csv_file), 'Hi {name}', 'Hello {name}')
+        
+        assert result == (2, 0)
+        assert sorted(recipients[0] for _, recipients, _ in self.smtp.messages) == ['ann@example.com', 'cy@example.com']
+        output = capsys.readouterr().out
+        assert 'Suppressed (bounced or unsubscribed): 2' in output
+        assert 'Duplicate addresses skipped: 1' in output
+    
+    def test_bad_row_mid_batch_fails_alone(self, tmp_path):
+        """Test a row that fails to render is logged as failed and its batch still sent"""
+        jsonl_file = tmp_path / 'recipients.jsonl'
+        rows = [{'email': f'user{i}@example.com', 'amount': i + 0.5} for i in range(5)]
+        rows += [{'email': 'bad@example.com', 'amount': 'lots'}, {'email': 'late@example.com', 'amount': 1}]
+        jsonl_file.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+        
+        result = self.sender.send_bulk_emails(str(jsonl_file), 'Invoice', 'You owe {amount:.2f}')
+        
+        assert result == (6, 1)
+        assert sorted(rcpt for _, recipients, _ in self.smtp.messages for rcpt in recipients) == \
+            ['late@example.com'] + [f'user{i}@example.com' for i in range(5)]
+        assert self.sender.db.get_email_stats() == {'sent': 6, 'failed': 1, 'monitored': 0}
+    
+    def test_jsonl_record_missing_field_fails_alone(self, tmp_path, capsys):
+        """Test a later JSONL record without a placeholder's key fails only that row"""
+        jsonl_file = tmp_path / 'recipients.jsonl'
+        rows = [{'email': 'a@example.com', 'name': 'A'}, {'email': 'b@example.com'}, {'email': 'c@example.com', 'name': 'C'}]
+        jsonl_file.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+        
+        assert self.sender.send_bulk_emails(str(jsonl_file), 'Hi {name}', 'Hello {name}') == (2, 1)
+        
+        conn = self.sender.db.get_connection()
+        failed = conn.execute("SELECT recipient, error_message FROM sent_emails WHERE status = 'failed'").fetchall()
+        conn.close()
+        assert failed == [('b@example.com', "Could not render row: missing field 'name'")]
+        assert 'Error processing' not in capsys.readouterr().out
+    
+    def test_rate_limit_counts_envelope_recipients(self, tmp_path):
+        """Test a multi-recipient envelope draws one rate-limit token per recipient"""
+        self.sender.rate_limiter = TokenBucket(rate=40)
+        Config.SMTP_MAX_RECIPIENTS = 4
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email\n' + ''.join(f'user{i}@example.com\n' for i in range(8)))
+        start = time.monotonic()
+        
+        assert self.sender.send_bulk_emails(str(csv_file), 'News', 'Same for everyone') == (8, 0)
+        
+        # The second envelope waits for the first one's four tokens
+        assert len(self.smtp.messages) == 2
+        assert time.monotonic() - start >= 0.09
+    
+    def test_rejected_data_does_not_suppress_recipients(self, tmp_path):
+        """Test a 5xx reply to DATA fails the envelope without suppressing its recipients"""
+        self.smtp.reject_data = '554 5.7.1 Message rejected by content policy'
+        Config.SMTP_MAX_RECIPIENTS = 3
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email\n' + ''.join(f'user{i}@example.com\n' for i in range(3)))
+        
+        result = self.sender.send_bulk_emails(str(csv_file), 'News', 'Same for everyone')
+        
+        assert result == (0, 3)
+        assert self.sender.db.count_suppressions() == 0
+    
+    def test_sharded_bulk_send_across_processes(self, tmp_path):
+        """Test a bulk send sharded over worker processes sends each row once and totals the counts"""
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email,name\n' + ''.join(f'user{i}@example.com,User {i}\n' for i in range(30)))
+        
+        result = self.sender.send_bulk_emails(str(csv_file), 'Hi {name}', 'Hello {name}', workers=2, processes=3)
+        
+        assert result == (30, 0)
+        delivered = sorted(rcpt for _, recipients, _ in self.smtp.messages for rcpt in recipients)
+        assert delivered == sorted(f'user{i}@example.com' for i in range(30))
+        assert self.sender.db.get_email_stats()['sent'] == 30
+        conn = self.sender.db.get_connection()
+        assert conn.execute("SELECT COUNT(*) FROM campaign_rows WHERE status = 'sent'").fetchone()[0] == 30
+        assert conn.execute("SELECT status FROM campaigns").fetchone()[0] == 'completed'
+        conn.close()
+    
+    def test_bulk_attachment_encoded_once(self, tmp_path, monkeypatch):
+        """Test a shared attachment is encoded once and arrives intact in every message"""
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email,name\n' + ''.join(f'user{i}@example.com,Ünïcode {i}\n' for i in range(5)))
+        brochure = tmp_path / 'brochure.pdf'
+        brochure.write_bytes(os.urandom(200_000))
+        monkeypatch.setattr(mime_cache, 'MMAP_THRESHOLD', 64 * 1024)
+        encoded = []
+        original = mime_cache.encode_attachment
+        monkeypatch.setattr(mime_cache, 'encode_attachment', lambda path: encoded.append(path) or original(path))
+        
+        result = self.sender.send_bulk_emails(str(csv_file), 'Hi {name}', 'Hello {name}',
+                                              attachments=[str(brochure)])
+        
+        assert result == (5, 0)
+        assert len(encoded) == 1
+        for _, rcpts, data in self.smtp.messages:
+            msg = message_from_bytes(data, policy=policy.default)
+            parts = list(msg.iter_attachments())
+            assert msg['To'] == rcpts[0]
+            assert msg['Subject'].startswith('Hi Ünïcode')
+            assert parts[0].get_filename() == 'brochure.pdf'
+            assert parts[0].get_payload(decode=True) == brochure.read_bytes()
+    
+    def test_cached_attachment_sent_without_copy_or_stuffing(self, tmp_path, monkeypatch):
+        """Test only per-message bytes are dot-stuffed and the cached part goes out as is"""
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email\n' + ''.join(f'user{i}@example.com\n' for i in range(3)))
+        brochure = tmp_path / 'brochure.pdf'
+        brochure.write_bytes(os.urandom(300_000))
+        sent, scanned = [], []
+        real_send = smtplib.SMTP.send
+        monkeypatch.setattr(smtplib.SMTP, 'send', lambda server, data: (sent.append(data), real_send(server, data))[1])
+        real_stuff = smtp_batch._LEADING_DOT
+        class Stuffing:
+            def sub(self, repl, data):
+                scanned.append(len(data))
+                return real_stuff.sub(repl, data)
+        monkeypatch.setattr(smtp_batch, '_LEADING_DOT', Stuffing())
+        
+        result = self.sender.send_bulk_emails(str(csv_file), 'Hi {email}', 'Line one\n.hidden line\nEnd',
+                                              attachments=[str(brochure)])
+        
+        assert result == (3, 0)
+        cached = self.sender.attachment_cache.get(str(brochure))
+        assert sum(data is cached for data in sent) == 3
+        assert sum(scanned) < len(cached)
+        for _, _, data in self.smtp.messages:
+            msg = message_from_bytes(data, policy=policy.default)
+            assert msg.get_body().get_content().splitlines()[1] == '.hidden line'
+            assert next(msg.iter_attachments()).get_payload(decode=True) == brochure.read_bytes()
+    
+    def test_static_bulk_send_shares_envelopes(self, tmp_path):
+        """Test a bulk send without placeholders groups rows into envelopes"""
+        Config.SMTP_MAX_RECIPIENTS = 4
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email\n' + ''.join(f'user{i}@example.com\n' for i in range(10)))
+        
+        result = self.sender.send_bulk_emails(str(csv_file), 'News', 'Same for everyone')
+        
+        assert result == (10, 0)
+        assert [len(rcpts) for _, rcpts, _ in self.smtp.messages] == [4, 4, 2]
+    
+    def test_bulk_send_with_template_file(self, tmp_path):
+        """Test the body can be loaded from an HTML template file"""
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email,name\na@example.com,Ann\n')
+        template_file = tmp_path / 'welcome.html'
+        template_file.write_text('<p>Hello {name}</p>')
+        
+        result = self.sender.send_bulk_emails(str(csv_file), 'Hi', None, html=True,
+                                              body_template_file=str(template_file))
+        
+        assert result == (1, 0)
+        assert b'<p>Hello Ann</p>' in self.smtp.messages[0][2]
+    
+    def test_bulk_send_resumes_from_start_row(self, tmp_path):
+        """Test start_row skips the rows before it"""
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email,name\n' + ''.join(f'user{i}@example.com,User {i}\n' for i in range(10)))
+        
+        result = self.sender.send_bulk_emails(str(csv_file), 'Hi', 'Hello {name}', start_row=7)
+        
+        assert result == (3, 0)
+        assert [rcpts for _, rcpts, _ in self.smtp.messages] == [
+            ['user7@example.com'], ['user8@example.com'], ['user9@example.com']
+        ]
+    
+    def test_bulk_send_rejects_unknown_template_field(self, tmp_path):
+        """Test a placeholder missing from the CSV header fails before anything is sent"""
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email,name\na@example.com,A\nb@example.com\n')
+        
+        result = self.sender.send_bulk_emails(str(csv_file), 'Hi', 'Hello {missing}')
+        
+        assert result == (0, 0)
+        assert self.smtp.messages == []
+
+    def test_bulk_send_resumes_unfinished_campaign(self, tmp_path):
+        """Test a rerun after a crash skips rows the crashed run already sent"""
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email,name\n' + ''.join(f'user{i}@example.com,User {i}\n' for i in range(10)))
+        template_hash = hashlib.sha256('Hi\0Hello {name}'.encode('utf-8')).hexdigest()
+        campaign_id = self.sender.db.create_campaign('crashed', file_hash(str(csv_file)), template_hash)
+        self.sender.db.checkpoint_campaign_rows(campaign_id, [(i, 'sent') for i in range(6)] + [(6, 'failed')])
+        
+        result = self.sender.send_bulk_emails(str(csv_file), 'Hi', 'Hello {name}')
+        
+        assert result == (4, 0)
+        assert [rcpts[0] for _, rcpts, _ in self.smtp.messages] == [f'user{i}@example.com' for i in range(6, 10)]
+        assert self.sender.db.find_incomplete_campaign(file_hash(str(csv_file)), template_hash) is None
+    
+    def test_completed_campaign_is_not_resumed(self, tmp_path):
+        """Test sending the same file again after a finished run starts a new campaign"""
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email,name\na@example.com,A\nb@example.com,B\n')
+        
+        assert self.sender.send_bulk_emails(str(csv_file), 'Hi', 'Hello {name}') == (2, 0)
+        assert self.sender.send_bulk_emails(str(csv_file), 'Hi', 'Hello {name}') == (2, 0)
+        assert len(self.smtp.messages) == 4
+
+def make_message(sender, subject, body):
+    """Build raw message bytes for the fake IMAP server"""
+    msg = MIMEText(body)
+    msg['From'] = sender
+    msg['Subject'] = subject
+    return msg.as_bytes()
+
+def wait_until(condition, timeout=5):
+    """Poll condition until it is true or the timeout passes"""
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+class MonitorTestBase:
+    """Runs EmailMonitor against local fake IMAP and SMTP servers"""
+    
+    CONFIG_KEYS = ('IMAP_SERVER', 'IMAP_PORT', 'IMAP_USE_SSL', 'IMAP_IDLE_TIMEOUT', 'SMTP_SERVER',
+                   'SMTP_PORT', 'SMTP_USE_TLS', 'EMAIL_ADDRESS', 'EMAIL_PASSWORD',
+                   'NOTIFICATION_EMAIL', 'DB_PATH')
+    
+    def setup_method(self):
+        """Point the monitor at fake servers and a test database"""
+        self.test_db_path = 'test_monitor.db'
+        self.imap = FakeIMAPServer().start()
+        self.smtp = FakeSMTPServer().start()
+        self.saved_config = {key: getattr(Config, key) for key in self.CONFIG_KEYS}
+        Config.IMAP_SERVER = self.imap.host
+        Config.IMAP_PORT = self.imap.port
+        Config.IMAP_USE_SSL = False
+        Config.IMAP_IDLE_TIMEOUT = 30
+        Config.SMTP_SERVER = self.smtp.host
+        Config.SMTP_PORT = self.smtp.port
+        Config.SMTP_USE_TLS = False
+        Config.EMAIL_ADDRESS = 'me@example.com'
+        Config.EMAIL_PASSWORD = 'secret'
+        Config.NOTIFICATION_EMAIL = 'alerts@example.com'
+        Config.DB_PATH = self.test_db_path
+        self.monitor = EmailMonitor()
+        self.watcher = None
+    
+    def teardown_method(self):
+        """Stop the monitor and fake servers and restore configuration"""
+        self.monitor.stop()
+        if self.watcher:
+            self.watcher.join(timeout=5)
+        self.monitor.sender.close()
+        self.monitor.db.close()
+        self.imap.stop()
+        self.smtp.stop()
+        for key, value in self.saved_config.items():
+            setattr(Config, key, value)
+        if os.path.exists(self.test_db_path):
+            os.remove(self.test_db_path)
+    
+    def monitored_count(self):
+        return self.monitor.db.get_email_stats()['monitored']
+    
+    def start_watching(self, **kwargs):
+        self.watcher = threading.Thread(target=self.monitor.watch_folder, kwargs=kwargs, daemon=True)
+        self.watcher.start()
+    
+class TestEmailMonitor(MonitorTestBase):
+    """Test cases for EmailMonitor"""
+    
+    def test_monitor_inbox_processes_unseen_mail(self):
+        """Test a polling cycle logs new mail and sends alerts for matching rules"""
+        self.monitor.db.add_notification_rule('Boss', sender_filter='boss@example.com')
+        self.imap.deliver(make_message('boss@example.com', 'Status', 'Please call'))
+        self.imap.deliver(make_message('friend@example.com', 'Lunch', 'Noon?'))
+        self.imap.deliver(make_message('old@example.com', 'Old', 'Seen already'), seen=True)
+        
+        assert self.monitor.monitor_inbox() == 2
+        assert self.monitored_count() == 2
+        # No background flusher is running, so the cycle sends its digests itself
+        assert self.monitor.digest.pending() == 0
+        
+        assert self.monitor.outbox.run_pending() == 1
+        assert len(self.smtp.messages) == 1
+        assert self.smtp.messages[0][1] == ['alerts@example.com']
+    
+    def test_html_only_mail_gets_a_preview(self):
+        """Test rules see the text of mail that has only an HTML part"""
+        self.monitor.db.add_notification_rule('Invoices', keyword_filter='invoice overdue')
+        msg = MIMEText('<div>Your <b>invoice overdue</b> notice</div>', 'html')
+        msg['From'] = 'billing@example.com'
+        msg['Subject'] = 'Reminder'
+        self.imap.deliver(msg.as_bytes())
+        
+        assert self.monitor.monitor_inbox() == 1
+        assert self.monitor.db.get_outbox_counts() == {'queued': 1}
+        self.monitor.db.flush()
+        conn = self.monitor.db.get_connection()
+        assert conn.execute('SELECT body_preview FROM monitored_emails').fetchone()[0] == 'Your invoice overdue notice'
+        conn.close()
+        assert self.monitor.get_email_body(msg) == 'Your invoice overdue notice'
+    
+    def test_headers_found_when_server_quotes_field_names(self):
+        """Test sender and subject are read whatever way the server echoes the header field list"""
+        self.imap.quote_field_names = True
+        self.imap.deliver(make_message('boss@example.com', 'Status', 'Please call'))
+        
+        assert self.monitor.monitor_inbox() == 1
+        self.monitor.db.flush()
+        conn = self.monitor.db.get_connection()
+        assert conn.execute('SELECT sender, subject FROM monitored_emails').fetchone() == ('boss@example.com', 'Status')
+        conn.close()
+    
+    def test_parsed_8bit_parts_respect_their_charset(self):
+        """Test 8bit bodies of parsed messages are decoded once, in their declared charset"""
+        for charset in ('iso-8859-1', 'utf-8'):
+            raw = (f'From: a@example.com\r\nContent-Type: text/plain; charset={charset}\r\n'
+                   'Content-Transfer-Encoding: 8bit\r\n\r\n').encode('ascii') + 'Café ok\r\n'.encode(charset)
+            
+            assert self.monitor.get_email_body(message_from_bytes(raw)).strip() == 'Café ok', charset
+            assert self.monitor.get_email_body(raw).strip() == 'Café ok', charset
+    
+    def test_matches_coalesced_into_one_digest_per_rule(self):
+        """Test a burst of matching mail becomes one alert per rule, with every email marked"""
+        self.monitor.db.add_notification_rule('Outage', subject_filter='outage')
+        self.monitor.db.add_notification_rule('Pager', sender_filter='pager@example.com')
+        for i in range(30):
+            self.imap.deliver(make_message('pager@example.com', f'Outage {i}', 'Details'))
+        self.imap.deliver(make_message('pager@example.com', 'Heartbeat', 'OK'))
+        
+        assert self.monitor.monitor_inbox() == 31
+        self.monitor.outbox.run_pending()
+        
+        subjects = sorted(message_from_bytes(data)['Subject'] for _, _, data in self.smtp.messages)
+        assert subjects == ['Email Alert: Outage (30 new emails)', 'Email Alert: Pager (31 new emails)']
+        self.monitor.db.flush()
+        conn = self.monitor.db.get_connection()
+        notified = conn.execute('SELECT COUNT(*) FROM monitored_emails WHERE notification_sent = 1').fetchone()[0]
+        conn.close()
+        assert notified == 31
+    
+    def test_rules_version_checked_once_per_batch(self, monkeypatch):
+        """Test matching a batch reads the rules version once and still sees rule changes"""
+        self.monitor.db.add_notification_rule('Outage', subject_filter='outage')
+        for i in range(5):
+            self.imap.deliver(make_message('pager@example.com', f'Outage {i}', 'Details'))
+        self.monitor.get_rule_matcher()
+        reads = []
+        version = EmailDatabase.rules_version
+        monkeypatch.setattr(EmailDatabase, 'rules_version', property(lambda db: reads.append(1) or version.fget(db)))
+        
+        assert self.monitor.monitor_inbox() == 5
+        assert len(reads) == 1
+        
+        conn = sqlite3.connect(self.test_db_path)
+        conn.execute("INSERT INTO notification_rules (rule_name, subject_filter) VALUES ('Urgent', 'urgent')")
+        conn.commit()
+        conn.close()
+        self.imap.deliver(make_message('boss@example.com', 'Urgent request', 'Details'))
+        
+        assert self.monitor.monitor_inbox() == 1
+        self.monitor.outbox.run_pending()
+        subjects = {message_from_bytes(data)['Subject'] for _, _, data in self.smtp.messages}
+        assert 'Email Alert: Urgent' in subjects
+    
+    def test_dead_lettered_alert_leaves_emails_unnotified(self):
+        """Test emails are only marked notified once their alert is delivered"""
+        self.monitor.db.add_notification_rule('Outage', subject_filter='outage')
+        self.imap.deliver(make_message('pager@example.com', 'Outage 1', 'Details'))
+        self.imap.deliver(make_message('pager@example.com', 'Outage 2', 'Details'))
+        self.smtp.reject_recipients.add(Config.NOTIFICATION_EMAIL)
+        
+        def notified():
+            self.monitor.db.flush()
+            conn = self.monitor.db.get_connection()
+            count = conn.execute('SELECT COUNT(*) FROM monitored_emails WHERE notification_sent = 1').fetchone()[0]
+            conn.close()
+            return count
+        
+        assert self.monitor.monitor_inbox() == 2
+        assert notified() == 0
+        self.monitor.outbox.run_pending()
+        
+        assert self.monitor.db.get_outbox_counts() == {'dead': 1}
+        assert notified() == 0
+    
+    def test_digest_flushes_when_full_or_window_passes(self):
+        """Test the background flusher sends a digest at max_items or after the window"""
+        digest = NotificationDigest(self.monitor.sender, self.monitor.db, window=0.3, max_items=3).start()
+        try:
+            for i in range(3):
+                digest.add('Full', i + 1, 'a@example.com', f'Subject {i}', 'Body')
+            digest.add('Slow', 10, 'b@example.com', 'Later', 'Body')
+            assert wait_until(lambda: digest.pending() == 1, timeout=0.25)
+            assert wait_until(lambda: digest.pending() == 0, timeout=2)
+        finally:
+            digest.stop()
+        
+        assert self.monitor.db.get_outbox_counts() == {'queued': 2}
+    
+    def test_buffered_matches_survive_restart(self):
+        """Test matches buffered when the monitor stopped are alerted by the next one"""
+        self.monitor.db.add_notification_rule('Boss', sender_filter='boss@example.com')
+        self.monitor.process_email('boss@example.com', 'Status', 'Please call')
+        assert self.monitor.digest.pending() == 1
+        # The process dies here, before the digest window closes
+        self.monitor.db.close()
+        
+        restarted = NotificationDigest(self.monitor.sender, EmailDatabase(self.test_db_path), window=60)
+        restarted.start()
+        restarted.stop()
+        
+        assert self.monitor.outbox.run_pending() == 1
+        assert b'boss@example.com' in self.smtp.messages[0][2]
+        assert restarted.db.get_digest_entries() == []
+        restarted.db.close()
+    
+    def test_high_water_mark_survives_restart(self):
+        """Test a restarted monitor doesn't reprocess mail, even if it is unread again"""
+        for i in range(3):
+            self.imap.deliver(make_message(f'user{i}@example.com', f'Message {i}', 'Body'))
+        assert self.monitor.monitor_inbox() == 3
+        for message in self.imap.mailboxes['INBOX']['messages']:
+            message['flags'].clear()
+        
+        restarted = EmailMonitor()
+        try:
+            assert restarted.monitor_inbox() == 0
+            self.imap.deliver(make_message('new@example.com', 'New', 'Body'))
+            assert restarted.monitor_inbox() == 1
+        finally:
+            restarted.sender.close()
+            restarted.db.close()
+        assert self.monitored_count() == 4
+    
+    def test_expunge_does_not_skip_new_mail(self):
+        """Test shifted sequence numbers after an expunge don't hide new mail"""
+        first = self.imap.deliver(make_message('a@example.com', 'A', 'Body'))
+        self.imap.deliver(make_message('b@example.com', 'B', 'Body'))
+        assert self.monitor.monitor_inbox() == 2
+        
+        self.imap.expunge(first)
+        self.imap.deliver(make_message('c@example.com', 'C', 'Body'))
+        
+        assert self.monitor.monitor_inbox() == 1
+        assert self.monitor.db.get_mailbox_state('me@example.com', 'INBOX') == (1, 3)
+    
+    def test_uidvalidity_change_resets_high_water_mark(self):
+        """Test a new UIDVALIDITY makes the monitor rescan unseen mail"""
+        self.imap.deliver(make_message('a@example.com', 'A', 'Body'))
+        assert self.monitor.monitor_inbox() == 1
+        
+        mailbox = self.imap.mailboxes['INBOX']
+        mailbox['uidvalidity'] = 2
+        mailbox['messages'][0]['flags'].clear()
+        
+        assert self.monitor.monitor_inbox() == 1
+        assert self.monitor.db.get_mailbox_state('me@example.com', 'INBOX') == (2, 1)
+    
+    def test_fetch_skips_attachments_and_leaves_mail_unread(self):
+        """Test only headers and a bounded text preview are downloaded"""
+        msg = MIMEMultipart()
+        msg['From'] = 'reports@example.com'
+        msg['Subject'] = 'Quarterly numbers'
+        msg.attach(MIMEText('Numbers attached. ' * 10, 'plain', 'utf-8'))
+        msg.attach(MIMEApplication(os.urandom(1024 * 1024), Name='report.bin'))
+        self.imap.deliver(msg.as_bytes())
+        
+        sent = []
+        original_connect = self.monitor.connect
+        def connect(target=None):
+            mail = original_connect(target)
+            real_send = mail.send
+            mail.send = lambda data: (sent.append(data), real_send(data))[1]
+            return mail
+        self.monitor.connect = connect
+        
+        assert self.monitor.monitor_inbox() == 1
+        
+        conn = self.monitor.db.get_connection()
+        sender, subject, preview = conn.execute('SELECT sender, subject, body_preview FROM monitored_emails').fetchone()
+        conn.close()
+        assert (sender, subject) == ('reports@example.com', 'Quarterly numbers')
+        assert preview.startswith('Numbers attached. Numbers attached.')
+        assert b'RFC822' not in b''.join(sent)
+        assert b'BODY.PEEK[1]<0.' in b''.join(sent)
+        assert '\\Seen' not in self.imap.mailboxes['INBOX']['messages'][0]['flags']
+    
+    def test_multipart_with_disposition_previewed(self):
+        """Test a multipart's extension data (parameters, disposition) isn't taken for a part"""
+        msg = MIMEMultipart()
+        msg['From'] = 'reports@example.com'
+        msg['Subject'] = 'Inline report'
+        msg['Content-Disposition'] = 'inline'
+        msg.attach(MIMEText('Summary inline', 'plain', 'utf-8'))
+        self.imap.deliver(msg.as_bytes())
+        
+        assert self.monitor.monitor_inbox() == 1
+        
+        conn = self.monitor.db.get_connection()
+        assert conn.execute('SELECT body_preview FROM monitored_emails').fetchone()[0].strip() == 'Summary inline'
+        conn.close()
+    
+    def test_unparseable_batch_skipped_not_retried(self):
+        """Test a batch whose response can't be parsed is logged and passed over"""
+        self.imap.deliver(make_message('a@example.com', 'Broken', 'Body'))
+        original_fetch = self.monitor.fetch_previews
+        def broken_fetch(mail, uids):
+            raise AttributeError("'NoneType' object has no attribute 'lower'")
+        self.monitor.fetch_previews = broken_fetch
+        
+        assert self.monitor.monitor_inbox() == 0
+        assert self.monitor.db.get_mailbox_state('me@example.com', 'INBOX') == (1, 1)
+        
+        self.monitor.fetch_previews = original_fetch
+        self.imap.deliver(make_message('b@example.com', 'Next', 'Body'))
+        assert self.monitor.monitor_inbox() == 1
+    
+    def test_fetch_in_batches_and_mark_as_read(self):
+        """Test new mail is fetched in UID batches and optionally marked read"""
+        Config.IMAP_FETCH_BATCH_SIZE, saved = 2, Config.IMAP_FETCH_BATCH_SIZE
+        try:
+            for i in range(5):
+                self.imap.deliver(make_message(f'user{i}@example.com', f'Message {i}', 'Body'))
+            
+            assert self.monitor.monitor_inbox(mark_as_read=True) == 5
+        finally:
+            Config.IMAP_FETCH_BATCH_SIZE = saved
+        
+        assert self.imap.commands.count('UID FETCH') == 6
+        assert all('\\Seen' in message['flags'] for message in self.imap.mailboxes['INBOX']['messages'])
+    
+    def test_idle_delivers_new_mail_in_one_session(self):
+        """Test new mail is pushed via IDLE without reconnecting"""
+        self.imap.deliver(make_message('a@example.com', 'First', 'Body'))
+        self.start_watching(idle=True)
+        assert wait_until(lambda: self.monitored_count() == 1)
+        assert wait_until(lambda: 'IDLE' in self.imap.commands)
+        
+        self.imap.deliver(make_message('b@example.com', 'Second', 'Body'))
+        
+        assert wait_until(lambda: self.monitored_count() == 2, timeout=3)
+        assert self.imap.logins == 1
+    
+    def test_idle_sees_exists_sent_with_continuation(self):
+        """Test an EXISTS arriving in the same packet as '+ idling' ends the wait at once"""
+        mail = self.monitor.connect()
+        try:
+            mail.select('INBOX')
+            # Delivered after SELECT, so the server reports it as IDLE starts
+            self.imap.deliver(make_message('a@example.com', 'First', 'Body'))
+            started = time.monotonic()
+            
+            assert self.monitor.wait_for_new_mail(mail, timeout=5) is True
+            assert time.monotonic() - started < 2
+            assert mail.noop()[0] == 'OK'
+        finally:
+            mail.logout()
+    
+    def test_falls_back_to_polling_without_idle(self):
+        """Test servers without IDLE are polled on the open session"""
+        self.imap.idle = False
+        self.start_watching(idle=True, interval=0.1)
+        
+        self.imap.deliver(make_message('a@example.com', 'First', 'Body'))
+        
+        assert wait_until(lambda: self.monitored_count() == 1)
+        assert 'IDLE' not in self.imap.commands
+        assert self.imap.logins == 1
+
+class TestImapFetch:
+    """Test cases for parsing partial IMAP fetch responses"""
+    
+    def test_parse_fetch_response_with_literals(self):
+        """Test BODYSTRUCTURE lists and literal sections are parsed per UID"""
+        data = [
+            (b'1 (UID 7 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "BASE64" 20 1 NIL NIL)'
+             b'("APPLICATION" "PDF" NIL NIL NIL "BASE64" 900 NIL ("ATTACHMENT" NIL)) "MIXED") '
+             b'BODY[HEADER.FIELDS (FROM SUBJECT DATE)] {21}', b'From: a@example.com\r\n'),
+            b')',
+        ]
+        
+        fields = parse_fetch_response(data)[7]
+        
+        assert fields['BODY[HEADER.FIELDS (FROM SUBJECT DATE)]'] == b'From: a@example.com\r\n'
+        assert find_text_part(fields['BODYSTRUCTURE']) == ('1', 'plain', 'base64', 'utf-8')
+    
+    def test_multipart_extension_data_skipped(self):
+        """Test parameter, disposition and language lists after a subtype aren't walked as parts"""
+        data = [
+            b'1 (UID 8 BODYSTRUCTURE ((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 5 1 NIL NIL)'
+            b'("TEXT" "HTML" NIL NIL NIL "7BIT" 12 1 NIL NIL) "ALTERNATIVE" ("BOUNDARY" "a") ("INLINE" NIL) NIL)'
+            b'("APPLICATION" "PDF" NIL NIL NIL "BASE64" 900 NIL ("ATTACHMENT" NIL)) "MIXED" ("BOUNDARY" "m") NIL NIL))',
+        ]
+        
+        structure = parse_fetch_response(data)[8]['BODYSTRUCTURE']
+        
+        assert find_text_part(structure) == ('1.1', 'plain', '7bit', 'utf-8')
+        assert find_text_part(structure, prefer=('html',)) == ('1.2', 'html', '7bit', None)
+    
+    def test_decode_partial_drops_cut_off_tail(self):
+        """Test truncated base64, quoted-printable and multi-byte text decode cleanly"""
+        assert decode_partial(b'aGVsbG8gd29ybGQ=\r\nZm9v'[:14], 'base64', 'utf-8') == 'hello wor'
+        assert decode_partial(b'caf=C3=A9 =C3', 'quoted-printable', 'utf-8') == 'caf\u00e9 '
+        assert decode_partial('na\u00efve'.encode('utf-8')[:3], '8bit', 'utf-8') == 'na'
+        assert decode_partial(b'plain', '7bit', 'x-unknown-charset') == 'plain'
+
+    def test_preview_falls_back_to_stripped_html(self):
+        """Test HTML-only mail previews as text, in its declared charset, skipping attachments"""
+        msg = MIMEMultipart('mixed')
+        msg.attach(MIMEText('<html><head><style>p {color: red}</style></head>'
+                            '<body><p>Caf\u00e9 &amp; <b>bar</b></p><p>Second</p></body></html>', 'html', 'iso-8859-1'))
+        msg.attach(MIMEApplication(os.urandom(200000), Name='big.bin'))
+        msg['Subject'] = 'Menu'
+        
+        assert extract_preview(msg.as_bytes()) == 'Caf\u00e9 & bar\nSecond'
+        assert html_to_text('<p>cut <a href="x') == 'cut'
+    
+    def test_preview_decodes_only_leading_bytes(self):
+        """Test a long plain part is decoded only up to the byte budget"""
+        alternative = MIMEMultipart('alternative')
+        alternative.attach(MIMEText('plain ' * 10000, 'plain', 'utf-8'))
+        alternative.attach(MIMEText('<p>html</p>', 'html'))
+        
+        preview = extract_preview(alternative.as_bytes(), max_bytes=120)
+        
+        assert preview.startswith('plain plain')
+        assert len(preview) < 120
+        assert len(extract_preview(alternative.as_bytes(), chars=50)) == 50
+
+class TestMultiTargetMonitoring(MonitorTestBase):
+    """Test cases for watching several accounts and folders at once"""
+    
+    def setup_method(self):
+        """Add a second account with two folders next to the default one"""
+        super().setup_method()
+        self.other_imap = FakeIMAPServer(folders=('INBOX', 'Escalations')).start()
+        self.targets = [
+            MonitorTarget(),
+            MonitorTarget(account='support@example.com', server=self.other_imap.host,
+                          port=self.other_imap.port, folders=['INBOX', 'Escalations']),
+        ]
+    
+    def teardown_method(self):
+        """Stop the second account's server too"""
+        super().teardown_method()
+        self.other_imap.stop()
+    
+    def test_polling_cycle_covers_every_folder(self):
+        """Test one cycle processes mail from all accounts and folders"""
+        self.monitor.db.add_notification_rule('Escalation', subject_filter='sev1')
+        self.imap.deliver(make_message('a@example.com', 'Hello', 'Body'))
+        self.other_imap.deliver(make_message('b@example.com', 'Question', 'Body'))
+        self.other_imap.deliver(make_message('c@example.com', 'SEV1 outage', 'Body'), folder='Escalations')
+        
+        assert self.monitor.monitor_targets(self.targets) == 3
+        assert self.monitor.db.get_mailbox_state('support@example.com', 'Escalations') == (1, 1)
+        self.monitor.digest.flush()
+        self.monitor.outbox.run_pending()
+        assert len(self.smtp.messages) == 1
+        assert b'support@example.com/Escalations' in self.smtp.messages[0][2]
+    
+    def test_scheduled_monitoring_covers_targets_file(self, tmp_path, monkeypatch):
+        """Test the scheduler's monitoring job checks every folder in MONITOR_TARGETS_FILE"""
+        targets_file = tmp_path / 'targets.json'
+        targets_file.write_text(json.dumps([
+            {'folders': ['INBOX']},
+            {'account': 'support@example.com', 'server': self.other_imap.host, 'port': self.other_imap.port,
+             'folders': ['INBOX', 'Escalations']},
+        ]))
+        monkeypatch.setattr(Config, 'MONITOR_TARGETS_FILE', str(targets_file))
+        self.other_imap.deliver(make_message('c@example.com', 'SEV1 outage', 'Body'), folder='Escalations')
+        scheduler = EmailScheduler()
+        
+        try:
+            scheduler._monitoring_job()
+            assert scheduler.monitor.db.get_mailbox_state('support@example.com', 'Escalations') == (1, 1)
+        finally:
+            scheduler.monitor.stop()
+            scheduler.monitor.sender.close()
+            scheduler.monitor.db.close()
+            scheduler.sender.close()
+    
+    def test_failing_target_is_isolated(self):
+        """Test an unreachable account doesn't stop the others"""
+        unreachable = MonitorTarget(account='down@example.com', server='127.0.0.1', port=1)
+        self.imap.deliver(make_message('a@example.com', 'Hello', 'Body'))
+        
+        assert self.monitor.monitor_targets([unreachable, self.targets[0]]) == 1
+    
+    def test_watch_targets_idles_on_each_folder(self):
+        """Test each folder gets its own session and pushed mail"""
+        self.watcher = threading.Thread(target=self.monitor.watch_targets, args=(self.targets,), kwargs={'idle': True}, daemon=True)
+        self.watcher.start()
+        assert wait_until(lambda: self.imap.commands.count('IDLE') >= 1 and self.other_imap.commands.count('IDLE') >= 2)
+        
+        self.other_imap.deliver(make_message('c@example.com', 'Urgent', 'Body'), folder='Escalations')
+        self.imap.deliver(make_message('a@example.com', 'Hello', 'Body'))
+        
+        assert wait_until(lambda: self.monitored_count() == 2, timeout=3)
+        assert self.other_imap.logins == 2
+
+class TestRecipients:
+    """Test cases for reading recipient files"""
+    
+    def test_reads_gzipped_csv(self, tmp_path):
+        """Test gzip'd CSV files are read transparently"""
+        path = tmp_path / 'recipients.csv.gz'
+        with gzip.open(path, 'wt', encoding='utf-8') as file:
+            file.write('email,name\na@example.com,A\nb@example.com,B\n')
+        
+        rows = list(iter_recipients(str(path)))
+        
+        assert rows == [(0, {'email': 'a@example.com', 'name': 'A'}), (1, {'email': 'b@example.com', 'name': 'B'})]
+    
+    def test_reads_jsonl_from_start_row(self, tmp_path):
+        """Test JSONL records are numbered and skipped like CSV rows"""
+        path = tmp_path / 'recipients.jsonl'
+        path.write_text(''.join(json.dumps({'email': f'user{i}@example.com'}) + '\n' for i in range(3)) + '\n')
+        
+        rows = list(iter_recipients(str(path), start_row=1))
+        
+        assert rows == [(1, {'email': 'user1@example.com'}), (2, {'email': 'user2@example.com'})]
+
+class TestSuppression:
+    """Test cases for recipient dedup and the suppression list"""
+    
+    def setup_method(self):
+        self.test_db_path = 'test_suppression.db'
+        self.db = EmailDatabase(self.test_db_path)
+    
+    def teardown_method(self):
+        self.db.close()
+        if os.path.exists(self.test_db_path):
+            os.remove(self.test_db_path)
+    
+    def test_normalize_address(self):
+        """Test display names, whitespace and case don't make addresses differ"""
+        assert normalize_address(' Ann <Ann@Example.COM> ') == 'ann@example.com'
+        assert normalize_address('BOB@example.com') == 'bob@example.com'
+        assert normalize_address(None) == ''
+    
+    def test_hard_bounces_suppressed_and_repeats_skipped(self):
+        """Test 5xx failures are suppressed automatically and repeated addresses are caught"""
+        self.db.log_sent_email('Gone@Example.com', 'S', status='failed', error_message='550 5.1.1 No such user')
+        self.db.log_sent_email('busy@example.com', 'S', status='failed', error_message='421 Try again later')
+        self.db.log_sent_email('big@example.com', 'S', status='failed', error_message='552 5.3.4 Message too large')
+        self.db.log_sent_email('me@example.com', 'S', status='failed', error_message='550 5.1.8 Bad sender domain')
+        self.db.add_suppression('Left <left@example.com>')
+        
+        assert self.db.get_suppression('gone@example.com') == 'bounce'
+        assert self.db.get_suppression('busy@example.com') is None
+        assert self.db.get_suppression('big@example.com') is None
+        assert self.db.get_suppression('me@example.com') is None
+        recipients = RecipientFilter(self.db)
+        assert recipients.suppressed(['LEFT@example.com', 'gone@example.com', 'busy@example.com']) == {
+            'left@example.com': 'unsubscribe', 'gone@example.com': 'bounce'
+        }
+        assert recipients.first_seen('busy@example.com')
+        assert not recipients.first_seen('Busy <busy@example.com>')
+    
+    def test_backfill_suppresses_only_recipient_bounces(self, tmp_path):
+        """Test the migration backfill skips failures the whole envelope got"""
+        path = str(tmp_path / 'old.db')
+        EmailDatabase(path).close()
+        conn = sqlite3.connect(path)
+        conn.execute('DROP TRIGGER sent_emails_bounce')
+        conn.execute('DROP TABLE suppressions')
+        conn.executemany("INSERT INTO sent_emails (recipient, subject, status, error_message) VALUES (?, 'S', 'failed', ?)", [
+            ('gone@example.com', '550 5.1.1 No such user'),
+            ('a@example.com', '530 5.7.0 Authentication required'),
+            ('b@example.com', '554 5.7.1 Rejected by content policy'),
+        ])
+        # As if the database predates migration 5, which added suppressions
+        conn.execute('PRAGMA user_version = 4')
+        conn.commit()
+        conn.close()
+        
+        db = EmailDatabase(path)
+        
+        assert db.get_suppressions(['gone@example.com', 'a@example.com', 'b@example.com']) == {'gone@example.com': 'bounce'}
+        db.close()
+    
+    def test_suppression_lookups_are_chunked(self):
+        """Test batches larger than one IN query still find every suppressed address"""
+        self.db.writer.executemany(
+            'INSERT INTO suppressions (address, reason) VALUES (?, ?)',
+            ((f'user{i}@example.com', 'unsubscribe') for i in range(0, 1200, 3))
+        )
+        
+        found = self.db.get_suppressions([f'User{i}@example.com' for i in range(1200)], chunk=250)
+        
+        assert len(found) == 400
+        assert self.db.count_suppressions() == 400
+
+class TestTemplates:
+    """Test cases for compiled templates"""
+    
+    def test_render_matches_str_format(self):
+        """Test compiled rendering gives the same output as str.format"""
+        source = 'Hi {name!r}, {{literal}} {user.upper} {score:>6.2f} {items[0]} {score:{width}}'
+        
+        class User:
+            upper = 'U'
+        
+        row = {'name': 'Ann', 'user': User(), 'score': 3.14159, 'items': ['x'], 'width': 8}
+        template = CompiledTemplate(source)
+        
+        assert template.render(row) == source.format(**row)
+        assert template.fields == {'name', 'user', 'score', 'items', 'width'}
+    
+    def test_validate_against_header(self, tmp_path):
+        """Test placeholders are checked against the recipient file's columns"""
+        csv_file = tmp_path / 'recipients.csv'
+        csv_file.write_text('email,name\na@example.com,A\n')
+        template = CompiledTemplate('Hello {name}, your code is {code}')
+        
+        with pytest.raises(TemplateError, match='code'):
+            template.validate(read_fieldnames(str(csv_file)))
+        with pytest.raises(TemplateError):
+            CompiledTemplate('Hello {}')
+    
+    def test_template_file_cache_reloads_on_change(self, tmp_path):
+        """Test template files are compiled once and reloaded when edited"""
+        path = tmp_path / 'welcome.html'
+        path.write_text('<p>Hello {name}</p>')
+        
+        first = load_template(str(path))
+        assert load_template(str(path)) is first
+        
+        path.write_text('<p>Welcome back, {name}!</p>')
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+        
+        assert load_template(str(path)).render({'name': 'A'}) == '<p>Welcome back, A!</p>'
+
+class TestReporting:
+    """Test cases for windowed reports and log exports"""
+    
+    def setup_method(self):
+        """Fill a test database with a few days of sent mail"""
+        self.test_db_path = 'test_reports.db'
+        self.db = EmailDatabase(self.test_db_path)
+        self.reports = EmailReports(self.db)
+        conn = self.db.get_connection()
+        rows = [(f'user{i % 4}@example.com', f'2024-03-0{1 + i % 9} 12:00:00', 'failed' if i % 3 == 0 else 'sent',
+                 'Mailbox full' if i % 6 == 0 else None) for i in range(45)]
+        conn.executemany('INSERT INTO sent_emails (recipient, subject, sent_at, status, error_message) '
+                         'VALUES (?, \'S\', ?, ?, ?)', rows)
+        conn.commit()
+        conn.close()
+    
+    def teardown_method(self):
+        """Clean up test database"""
+        self.db.close()
+        if os.path.exists(self.test_db_path):
+            os.remove(self.test_db_path)
+    
+    def test_windowed_aggregates(self):
+        """Test summaries, top failures and error breakdowns respect the window"""
+        since, until = date(2024, 3, 1), date(2024, 3, 4)
+        
+        assert self.reports.summary(since, until) == {'sent': 10, 'failed': 5, 'monitored': 0}
+        assert self.reports.top_failing_recipients(since, until, limit=2) == [('user0@example.com', 2),
+                                                                              ('user1@example.com', 1)]
+        assert self.reports.error_breakdown(since, until) == [('Mailbox full', 3), ('', 2)]
+        assert 'Sent: 20\nFailed: 15' in self.reports.weekly_report(today=date(2024, 3, 7))
+    
+    def test_keyset_pages_cover_window_once(self):
+        """Test paging through rows that share timestamps yields each row exactly once"""
+        rows = list(self.reports.iter_rows(since='2024-03-02', until='2024-03-05', page_size=4))
+        
+        assert len(rows) == 15
+        assert len({row['id'] for row in rows}) == 15
+        assert [row['sent_at'] for row in rows] == sorted(row['sent_at'] for row in rows)
+    
+    def test_export_csv_and_jsonl(self, tmp_path):
+        """Test exports stream the window to gzip'd CSV and JSONL files"""
+        csv_path = str(tmp_path / 'week.csv.gz')
+        jsonl_path = str(tmp_path / 'failed.jsonl')
+        
+        assert self.reports.export(csv_path, since='2024-03-01', until='2024-03-08', page_size=7) == 35
+        assert self.reports.export(jsonl_path, fmt='jsonl', status='failed', page_size=7) == 15
+        
+        with gzip.open(csv_path, 'rt', encoding='utf-8') as file:
+            assert len(list(csv.DictReader(file))) == 35
+        with open(jsonl_path, encoding='utf-8') as file:
+            assert {json.loads(line)['status'] for line in file} == {'failed'}
+
+class TestSearch:
+    """Test cases for full-text search over the email logs"""
+    
+    def setup_method(self):
+        self.test_db_path = 'test_search.db'
+        self.db = EmailDatabase(self.test_db_path)
+        self.search = EmailSearch(self.db)
+    
+    def teardown_method(self):
+        self.db.close()
+        if os.path.exists(self.test_db_path):
+            os.remove(self.test_db_path)
+    
+    def check_index(self, table):
+        conn = self.db.get_connection()
+        conn.execute(f"INSERT INTO {table}_fts ({table}_fts, rank) VALUES ('integrity-check', 1)")
+        conn.close()
+    
+    def test_logged_emails_are_searchable_and_ranked(self):
+        """Test new rows are indexed as they are logged and matches are ranked and paged"""
+        self.db.log_monitored_email('billing@example.com', 'Invoice overdue', 'Your invoice is overdue')
+        self.db.log_monitored_email('friend@example.com', 'Lunch', 'Saw your invoice joke')
+        for i in range(5):
+            self.db.log_monitored_email(f'user{i}@example.com', f'Invoice {i}', 'Attached', sync=False)
+        self.db.log_monitored_email('news@example.com', 'Weekly digest', 'Nothing relevant')
+        self.db.log_sent_email('client@example.com', 'Quarterly invoice')
+        
+        assert self.search.count('invoice') == 7
+        best = self.search.search('invoice overdue')
+        assert [match['sender'] for match in best] == ['billing@example.com']
+        assert '[overdue]' in best[0]['snippet']
+        pages = [self.search.search('invoic', page=page, page_size=3) for page in (1, 2, 3)]
+        assert [len(page) for page in pages] == [3, 3, 1]
+        assert len({match['id'] for page in pages for match in page}) == 7
+        assert self.search.search('quarterly', table='sent_emails')[0]['recipient'] == 'client@example.com'
+        assert self.search.search('AND OR "') == []
+        assert match_query('re: "past due" NEAR(') == '"re:"* "past due" "NEAR("*'
+        
+        conn = self.db.get_connection()
+        conn.execute("DELETE FROM monitored_emails WHERE sender = 'billing@example.com'")
+        conn.commit()
+        conn.close()
+        assert self.search.search('overdue') == []
+        self.check_index('monitored_emails')
+    
+    def test_backfill_indexes_existing_rows_in_chunks(self, tmp_path):
+        """Test rows logged before the index existed are indexed by a resumable backfill"""
+        path = str(tmp_path / 'old.db')
+        db = EmailDatabase(path)
+        db.close()
+        conn = sqlite3.connect(path)
+        for table in ('monitored_emails', 'sent_emails'):
+            conn.execute(f'DROP TABLE {table}_fts')
+            for trigger in ('insert', 'delete', 'update'):
+                conn.execute(f'DROP TRIGGER {table}_fts_{trigger}')
+        conn.execute('DROP TABLE search_index_state')
+        conn.executemany('INSERT INTO monitored_emails (sender, subject, body_preview) VALUES (?, ?, ?)',
+                         [(f'old{i}@example.com', f'Renewal {i}', 'Contract renewal') for i in range(7)])
+        # As if the database predates migration 4, which added search
+        conn.execute('PRAGMA user_version = 3')
+        conn.commit()
+        conn.close()
+        
+        db = EmailDatabase(path)
+        search = EmailSearch(db)
+        db.log_monitored_email('new@example.com', 'Renewal new', 'Contract renewal')
+        assert search.pending_backfill() == 7
+        assert search.count('renewal') == 1
+        
+        # Deleting a row that isn't indexed yet must leave the index consistent
+        db.writer.execute('DELETE FROM monitored_emails WHERE id = 2')
+        assert search.backfill('monitored_emails', chunk_size=2) == {'monitored_emails': 6}
+        assert search.pending_backfill() == 0
+        assert search.count('renewal') == 7
+        assert search.backfill() == {'monitored_emails': 0, 'sent_emails': 0}
+        db.writer.execute('DELETE FROM monitored_emails WHERE id = 3')
+        assert search.count('renewal') == 6
+        conn = db.get_connection()
+        conn.execute("INSERT INTO monitored_emails_fts (monitored_emails_fts, rank) VALUES ('integrity-check', 1)")
+        conn.close()
+        db.close()
+
+class TestRetention:
+    """Test cases for log retention and archival"""
+    
+    CONFIG_KEYS = ('RETENTION_SENT_DAYS', 'RETENTION_MONITORED_DAYS', 'RETENTION_OUTBOX_DAYS')
+    
+    def setup_method(self):
+        """Create a test database with old and recent log rows"""
+        self.test_db_path = 'test_retention.db'
+        self.saved_config = {key: getattr(Config, key) for key in self.CONFIG_KEYS}
+        Config.RETENTION_SENT_DAYS = 30
+        Config.RETENTION_MONITORED_DAYS = 7
+        Config.RETENTION_OUTBOX_DAYS = 0
+        self.db = EmailDatabase(self.test_db_path)
+        conn = self.db.get_connection()
+        conn.executemany('INSERT INTO sent_emails (recipient, subject, sent_at) VALUES (?, ?, ?)', [
+            (f'user{i}@example.com', 'x' * 2000, sent_at)
+            for i, sent_at in enumerate(['2024-01-15 10:00:00'] * 3 + ['2024-02-20 10:00:00'] * 2 + ['2024-06-01 10:00:00'])
+        ])
+        conn.executemany('INSERT INTO monitored_emails (sender, subject, received_at, body_preview) VALUES (?, ?, ?, ?)', [
+            ('old@example.com', 'Old', '2024-05-20 08:00:00', 'Preview'),
+            ('new@example.com', 'New', '2024-05-31 08:00:00', 'Preview'),
+        ])
+        conn.commit()
+        conn.close()
+        self.now = datetime(2024, 6, 2, tzinfo=timezone.utc)
+    
+    def teardown_method(self):
+        """Clean up test database and restore configuration"""
+        self.db.close()
+        for key, value in self.saved_config.items():
+            setattr(Config, key, value)
+        if os.path.exists(self.test_db_path):
+            os.remove(self.test_db_path)
+    
+    def test_expired_rows_archived_by_month(self, tmp_path):
+        """Test rows past their TTL move to monthly gzip archives in chunks"""
+        retention = LogRetention(self.db, archive_dir=str(tmp_path), chunk_size=2)
+        
+        assert retention.run(now=self.now) == {'sent_emails': 5, 'monitored_emails': 1}
+        
+        def archived(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                return [json.loads(line) for line in file]
+        
+        january = archived(tmp_path / 'sent_emails' / 'sent_emails-2024-01.jsonl.gz')
+        assert [row['recipient'] for row in january] == ['user0@example.com', 'user1@example.com', 'user2@example.com']
+        assert len(archived(tmp_path / 'sent_emails' / 'sent_emails-2024-02.jsonl.gz')) == 2
+        assert archived(tmp_path / 'monitored_emails' / 'monitored_emails-2024-05.jsonl.gz')[0]['sender'] == 'old@example.com'
+        
+        conn = self.db.get_connection()
+        assert conn.execute('SELECT COUNT(*) FROM sent_emails').fetchone()[0] == 1
+        assert conn.execute('SELECT COUNT(*) FROM monitored_emails').fetchone()[0] == 1
+        assert conn.execute('PRAGMA freelist_count').fetchone()[0] == 0
+        conn.close()
+        assert self.db.get_email_stats() == {'sent': 6, 'failed': 0, 'monitored': 2}
+    
+    def test_chunks_larger_than_parameter_limit_deleted(self, tmp_path):
+        """Test a chunk with more rows than SQLite allows parameters is still deleted"""
+        conn = self.db.get_connection()
+        conn.executemany('INSERT INTO sent_emails (recipient, subject, sent_at) VALUES (?, ?, ?)', [
+            (f'bulk{i}@example.com', 'Old', '2024-03-01 10:00:00') for i in range(1200)
+        ])
+        conn.commit()
+        conn.close()
+        # Stands in for a chunk size above the build's SQLITE_MAX_VARIABLE_NUMBER
+        self.db.writer._connection().setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+        
+        retention = LogRetention(self.db, archive_dir=str(tmp_path), chunk_size=1500)
+        
+        assert retention.run(now=self.now)['sent_emails'] == 1205
+        assert self.db.get_email_stats()['sent'] == 1206
+        conn = self.db.get_connection()
+        assert conn.execute('SELECT COUNT(*) FROM sent_emails').fetchone()[0] == 1
+        conn.close()
+    
+    def test_older_databases_converted_only_on_request(self, tmp_path):
+        """Test retention never runs a full VACUUM; converting is a separate step"""
+        conn = self.db.get_connection()
+        conn.execute('PRAGMA auto_vacuum = NONE')
+        conn.execute('VACUUM')
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+        conn.close()
+        retention = LogRetention(self.db, archive_dir=str(tmp_path))
+        
+        retention.run(now=self.now)
+        conn = self.db.get_connection()
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+        conn.close()
+        
+        assert retention.enable_incremental_vacuum() is True
+        assert retention.enable_incremental_vacuum() is False
+        conn = self.db.get_connection()
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        conn.close()
+
+class TestScheduling:
+    """Test cases for the persistent job scheduler"""
+    
+    def setup_method(self):
+        self.test_db_path = 'test_scheduler.db'
+        self.db = EmailDatabase(self.test_db_path)
+        self.calls = []
+    
+    def teardown_method(self):
+        self.db.close()
+        if os.path.exists(self.test_db_path):
+            os.remove(self.test_db_path)
+    
+    def make_scheduler(self, **handlers):
+        handlers.setdefault('record', lambda **params: self.calls.append(params))
+        return JobScheduler(self.db, handlers, workers=4)
+    
+    def test_triggers_compute_next_run(self):
+        """Test daily, weekly and interval triggers pick the next matching time"""
+        start = datetime(2024, 3, 6, 10, 30).timestamp()  # a Wednesday
+        assert datetime.fromtimestamp(DailyTrigger('09:00').next_after(start)) == datetime(2024, 3, 7, 9, 0)
+        assert datetime.fromtimestamp(DailyTrigger('18:15').next_after(start)) == datetime(2024, 3, 6, 18, 15)
+        assert datetime.fromtimestamp(WeeklyTrigger('Monday', '08:00').next_after(start)) == datetime(2024, 3, 11, 8, 0)
+        assert datetime.fromtimestamp(WeeklyTrigger('wednesday', '10:00').next_after(start)) == datetime(2024, 3, 13, 10, 0)
+        assert IntervalTrigger(300).next_after(start) == start + 300
+        with pytest.raises(ValueError):
+            DailyTrigger('25:00')
+    
+    def test_missed_runs_caught_up_after_restart(self):
+        """Test persisted jobs due while stopped run once on startup, unless catch-up is off"""
+        first = self.make_scheduler()
+        first.add_job('report', 'record', DailyTrigger('09:00'), {'name': 'report'})
+        first.add_job('cleanup', 'record', DailyTrigger('09:00'), {'name': 'cleanup'}, catch_up=False)
+        first.stop()
+        overdue = time.time() - 3 * 86400
+        conn = self.db.get_connection()
+        conn.execute('UPDATE scheduled_jobs SET next_run_at = ?', (overdue,))
+        conn.commit()
+        conn.close()
+        
+        second = self.make_scheduler()
+        try:
+            assert second.load_jobs() == 2
+            second.run_pending()
+            assert wait_until(lambda: self.calls == [{'name': 'report'}])
+            assert wait_until(lambda: second.jobs['report'].running == 0)
+            jobs = {job['name']: job for job in self.db.get_scheduled_jobs()}
+            assert jobs['report']['last_run_at'] is not None
+            assert jobs['report']['next_run_at'] > time.time()
+            assert jobs['cleanup']['last_run_at'] is None
+            assert second.jobs['cleanup'].next_run > time.time()
+        finally:
+            second.stop()
+    
+    def test_long_job_does_not_block_others(self):
+        """Test a running job is capped at its instance limit while other jobs keep firing"""
+        release = threading.Event()
+        slow_runs = []
+        def slow():
+            slow_runs.append(1)
+            release.wait(5)
+        scheduler = self.make_scheduler(slow=slow)
+        try:
+            scheduler.add_job('bulk', 'slow', IntervalTrigger(60))
+            scheduler.add_job('monitor', 'record', IntervalTrigger(60), {'name': 'monitor'})
+            now = time.time()
+            for tick in range(1, 4):
+                scheduler.run_pending(now + 60 * tick + 1)
+                assert wait_until(lambda: len(self.calls) == tick and scheduler.jobs['monitor'].running == 0)
+            assert slow_runs == [1]
+        finally:
+            release.set()
+            scheduler.stop()
+    
+    def test_sleeps_until_next_due_job(self):
+        """Test the loop reports the wait until the next job rather than polling"""
+        scheduler = self.make_scheduler()
+        try:
+            scheduler.add_job('monitor', 'record', IntervalTrigger(120))
+            delay = scheduler.run_pending()
+            assert 119 < delay <= 120
+        finally:
+            scheduler.stop()
+
+class TestRateLimiter:
+    """Test cases for the token-bucket rate limiter"""
+    
+    def test_token_bucket_paces_to_rate(self):
+        """Test acquiring tokens beyond the capacity waits for refills"""
+        bucket = TokenBucket(rate=100)
+        start = time.monotonic()
+        for _ in range(11):
+            bucket.acquire()
+        
+        assert time.monotonic() - start >= 0.09
+    
+    def test_multi_token_requests_are_paid_for(self):
+        """Test taking more tokens than the capacity holds back later callers until repaid"""
+        bucket = TokenBucket(rate=100)
+        start = time.monotonic()
+        bucket.acquire(5)
+        bucket.acquire(5)
+        bucket.acquire()
+        
+        assert time.monotonic() - start >= 0.09
+    
+    def test_try_acquire_does_not_block(self):
+        """Test try_acquire fails fast when the bucket is empty"""
+        bucket = TokenBucket(rate=1)
+        
+        assert bucket.try_acquire()
+        assert not bucket.try_acquire()
+    
+    def test_limiter_shared_per_host(self):
+        """Test senders to the same host share one bucket"""
+        assert get_rate_limiter('smtp.example.com', 30) is get_rate_limiter('smtp.example.com', 30)
+        assert get_rate_limiter('smtp.example.com', 30) is not get_rate_limiter('smtp.other.com', 30)
+        assert get_rate_limiter('smtp.example.com', 0) is None
+
+class TestBenchmark:
+    """Test cases for the benchmark harness"""
+    
+    def test_percentile_is_nearest_rank(self):
+        """Test percentiles pick a sample and convert seconds to milliseconds"""
+        samples = [i / 1000 for i in range(1, 101)]
+        
+        assert percentile(samples, 50) == 50.0
+        assert percentile(samples, 99) == 99.0
+        assert percentile(samples, 100) == 100.0
+        assert percentile(samples, 0) == 1.0
+        assert percentile([], 50) is None
+    
+    def test_every_scenario_reports_figures(self):
+        """Test each scenario runs at a small scale and leaves Config untouched"""
+        db_path = Config.DB_PATH
+        
+        for name in SCENARIOS:
+            result = run_scenario(name, {'rows': 20, 'rules': 10})
+            assert result['count'] >= 20, name
+            assert result['msgs_per_sec'] > 0, name
+            assert result['p50_ms'] <= result['p99_ms'], name
+        assert Config.DB_PATH == db_path
 
 class TestConfig:
     """Test cases for Config"""